@@ -0,0 +1,245 @@
+# -*- coding:utf-8 -*-
+"""
+Load test of /v1/chat/completions against local stand-ins for the upstreams.
+
+Starts mock_upstreams.py, then for each backend app.py through serve_app.py,
+and streams --requests chat completions through it, --concurrency at a time.
+Reports per backend the time to the first token (p50/p99), tokens per second
+of a stream and of the whole run, the app's CPU time per stream and its
+resident memory (current and peak). CPU and memory are read from /proc, so
+they are only reported on Linux. Tokens are the stand-in's words. The poe
+backend needs the packages in benchmarks/requirements.txt.
+
+    python benchmarks/load.py --backends claude,messages,slack,poe --concurrency 32 --requests 500 \
+        --rate 50 --jitter 0.2 --tokens 100
+
+--env KEY=VALUE is passed to the app, e.g. --env STREAM_COALESCE_MS=20 to
+compare settings.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+BACKENDS = {
+    "claude": {"MODEL": "claude", "CLAUDE_API_KEY": "bench", "CLAUDE_API_MODE": "complete"},
+    "messages": {"MODEL": "claude", "CLAUDE_API_KEY": "bench", "CLAUDE_API_MODE": "messages"},
+    "slack": {"MODEL": "slack", "SLACK_CHANNEL": "bench", "SLACK_ACCESS_TOKEN": "bench"},
+    "poe": {"MODEL": "poe"},
+}
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def cpu_seconds(pid):
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+    # utime and stime, fields 14 and 15 of stat(5)
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+
+
+def memory_mb(pid):
+    """Resident and peak resident memory in MB."""
+    values = {}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                if name in ("VmRSS", "VmHWM"):
+                    values[name] = int(value.split()[0]) / 1024
+    except OSError:
+        pass
+    return values.get("VmRSS"), values.get("VmHWM")
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] if values else None
+
+
+def start(argv, env=None):
+    return subprocess.Popen([sys.executable, *argv], env={**os.environ, **(env or {})})
+
+
+def wait_ready(process, url, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{url} exited with {process.returncode}")
+        try:
+            if httpx.get(url, timeout=1).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f"{url} did not start within {timeout}s")
+
+
+def stop(process):
+    process.terminate()
+    try:
+        process.wait(10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+async def stream(client, url, model, i):
+    body = {
+        "model": model,
+        "messages": [{"role": "user", "content": f"Benchmark request {i}, reply with a few words."}],
+        "stream": True,
+    }
+    begin = time.perf_counter()
+    first = None
+    text = []
+    async with client.stream("POST", f"{url}/v1/chat/completions", json=body) as response:
+        if response.status_code != 200:
+            await response.aread()
+            return None
+        async for line in response.aiter_lines():
+            if not line.startswith("data: "):
+                continue
+            chunk = json.loads(line[6:])
+            # the end of the stream is sent as the JSON string "[DONE]"
+            if not isinstance(chunk, dict):
+                continue
+            choices = chunk.get("choices") or [{}]
+            content = choices[0].get("delta", {}).get("content")
+            if content:
+                first = first or time.perf_counter()
+                text.append(content)
+    end = time.perf_counter()
+    if first is None:
+        return None
+    tokens = len("".join(text).split())
+    return first - begin, tokens, tokens / (end - first) if end > first else None
+
+
+async def drive(url, model, requests, concurrency):
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with semaphore:
+            try:
+                return await stream(client, url, model, i)
+            except httpx.HTTPError:
+                return None
+
+    async with httpx.AsyncClient(limits=limits, timeout=120) as client:
+        return await asyncio.gather(*[one(i) for i in range(requests)])
+
+
+def run(name, args, upstream):
+    port = free_port()
+    url = f"http://127.0.0.1:{port}"
+    env = {**BACKENDS[name], "LOG_LEVEL": "warning"}
+    if name == "poe":
+        # a Poe account streams one reply per bot at a time
+        env["POE_TOKEN"] = ",".join(f"bench{i}" for i in range(args.concurrency))
+    env.update(args.env)
+    app = start([os.path.join(HERE, "serve_app.py"), "--port", str(port), "--upstream", upstream], env)
+    try:
+        wait_ready(app, f"{url}/v1/models")
+        # connections, pools and lazily built state are not part of the measurement
+        asyncio.run(drive(url, args.model, args.concurrency, args.concurrency))
+        cpu_before = cpu_seconds(app.pid)
+        begin = time.perf_counter()
+        results = asyncio.run(drive(url, args.model, args.requests, args.concurrency))
+        wall = time.perf_counter() - begin
+        cpu_after = cpu_seconds(app.pid)
+        rss, peak = memory_mb(app.pid)
+    finally:
+        stop(app)
+
+    ok = [result for result in results if result is not None]
+    ttft = [result[0] for result in ok]
+    rates = [result[2] for result in ok if result[2] is not None]
+    cpu = (cpu_after - cpu_before) / len(results) if cpu_before is not None and cpu_after is not None else None
+    return {
+        "backend": name,
+        "requests": len(results),
+        "errors": len(results) - len(ok),
+        "wall_s": wall,
+        "ttft_p50_ms": percentile(ttft, 0.5) * 1000 if ttft else None,
+        "ttft_p99_ms": percentile(ttft, 0.99) * 1000 if ttft else None,
+        "stream_tokens_per_s": percentile(rates, 0.5),
+        "total_tokens_per_s": sum(result[1] for result in ok) / wall,
+        "cpu_ms_per_stream": cpu * 1000 if cpu is not None else None,
+        "rss_mb": rss,
+        "peak_rss_mb": peak,
+    }
+
+
+def fmt(value, width, digits=1):
+    return f"{value:{width}.{digits}f}" if value is not None else f"{'n/a':>{width}}"
+
+
+def report(row):
+    print(
+        f"{row['backend']:<9} requests={row['requests']:<5} errors={row['errors']:<4} wall={fmt(row['wall_s'], 7, 2)}s  "
+        f"ttft p50={fmt(row['ttft_p50_ms'], 7)}ms p99={fmt(row['ttft_p99_ms'], 7)}ms  "
+        f"tok/s stream={fmt(row['stream_tokens_per_s'], 6)} total={fmt(row['total_tokens_per_s'], 8)}  "
+        f"cpu/stream={fmt(row['cpu_ms_per_stream'], 6, 2)}ms  "
+        f"rss={fmt(row['rss_mb'], 6)}MB peak={fmt(row['peak_rss_mb'], 6)}MB",
+        flush=True,
+    )
+
+
+def main(args):
+    port = free_port()
+    upstream = f"http://127.0.0.1:{port}"
+    mock = start([os.path.join(HERE, "mock_upstreams.py"), "--port", str(port), "--tokens", str(args.tokens),
+                  "--rate", str(args.rate), "--jitter", str(args.jitter), "--ttft", str(args.ttft)])
+    rows = []
+    try:
+        wait_ready(mock, f"{upstream}/health")
+        for name in args.backends:
+            row = run(name, args, upstream)
+            rows.append(row)
+            if not args.json:
+                report(row)
+    finally:
+        stop(mock)
+    if args.json:
+        print(json.dumps(rows, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", default="claude,messages,slack,poe",
+                        help=f"comma separated, of {', '.join(BACKENDS)}")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--model", default="gpt-3.5-turbo")
+    parser.add_argument("--tokens", type=int, default=50, help="words per reply")
+    parser.add_argument("--rate", type=float, default=50.0, help="tokens per second of a reply")
+    parser.add_argument("--jitter", type=float, default=0.2, help="relative variation of every upstream delay")
+    parser.add_argument("--ttft", type=float, default=0.05, help="upstream seconds before the first token")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="setting for the app")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+    args.backends = [name.strip() for name in args.backends.split(",") if name.strip()]
+    unknown = [name for name in args.backends if name not in BACKENDS]
+    if unknown:
+        parser.error(f"unknown backends: {', '.join(unknown)}")
+    args.env = dict(item.split("=", 1) for item in args.env)
+
+    main(args)
@@ -0,0 +1,202 @@
+# -*- coding:utf-8 -*-
+"""
+Local stand-ins for the upstreams, for benchmarks that must not touch the network.
+
+One server answers like all of them:
+
+    POST /v1/complete                  Anthropic text completions, cumulative SSE
+    POST /v1/messages                  Anthropic messages, delta SSE events
+    POST /backend-api/conversation     the Slack relay, cumulative SSE
+    GET  /api/settings                 Poe channel data
+    POST /api/gql_POST                 Poe GraphQL, SendMessageMutation starts a reply
+    POST /api/receive_POST             Poe response stats
+    WS   /up/{box}/updates             Poe updates of the replies on a channel
+
+Replies are --tokens words long. A reply starts after --ttft seconds and then
+streams --rate tokens per second; every delay is varied by up to +-jitter of
+itself. uvicorn serves the Poe websocket through the websockets package,
+install it with
+
+    pip install -r benchmarks/requirements.txt
+
+    python benchmarks/mock_upstreams.py --port 9100 --rate 50 --jitter 0.3
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import random
+
+import uvicorn
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+class Timing:
+    def __init__(self, tokens=50, rate=50.0, jitter=0.2, ttft=0.05):
+        self.tokens = tokens
+        self.rate = rate
+        self.jitter = jitter
+        self.ttft = ttft
+
+    def vary(self, seconds):
+        return max(0.0, seconds * (1 + random.uniform(-self.jitter, self.jitter)))
+
+    async def words(self):
+        """The words of one reply, at the configured pace."""
+        await asyncio.sleep(self.vary(self.ttft))
+        for i in range(self.tokens):
+            if i:
+                await asyncio.sleep(self.vary(1 / self.rate))
+            yield f" word{i}" if i else "word0"
+
+
+def sse(data, event=None):
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+
+def mock_app(timing):
+    mock = FastAPI()
+    # Poe: channel -> open websocket, and message ids shared by all channels
+    channels = {}
+    message_ids = itertools.count(1000)
+    channel_ids = itertools.count(1)
+    seq = itertools.count(1)
+
+    @mock.get("/health")
+    async def health():
+        return {"ok": True}
+
+    @mock.post("/v1/complete")
+    async def complete(request: Request):
+        params = await request.json()
+
+        async def generate():
+            text = ""
+            async for word in timing.words():
+                text += word
+                yield sse({"completion": text, "stop_reason": None})
+            yield sse({"completion": text, "stop_reason": "stop_sequence"})
+            yield "data: [DONE]\n\n"
+
+        if not params.get("stream"):
+            text = "".join([word async for word in timing.words()])
+            return JSONResponse({"completion": text, "stop_reason": "stop_sequence"})
+        return StreamingResponse(generate(), media_type="text/event-stream")
+
+    @mock.post("/v1/messages")
+    async def messages(request: Request):
+        params = await request.json()
+        input_tokens = len(json.dumps(params["messages"])) // 4
+
+        async def generate():
+            yield sse({"type": "message_start", "message": {"usage": {"input_tokens": input_tokens, "output_tokens": 1}}},
+                      "message_start")
+            yield sse({"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}},
+                      "content_block_start")
+            async for word in timing.words():
+                yield sse({"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": word}},
+                          "content_block_delta")
+            yield sse({"type": "content_block_stop", "index": 0}, "content_block_stop")
+            yield sse({"type": "message_delta", "delta": {"stop_reason": "end_turn"},
+                       "usage": {"output_tokens": timing.tokens}}, "message_delta")
+            yield sse({"type": "message_stop"}, "message_stop")
+
+        if not params.get("stream"):
+            text = "".join([word async for word in timing.words()])
+            return JSONResponse({
+                "content": [{"type": "text", "text": text}],
+                "stop_reason": "end_turn",
+                "usage": {"input_tokens": input_tokens, "output_tokens": timing.tokens},
+            })
+        return StreamingResponse(generate(), media_type="text/event-stream")
+
+    @mock.post("/backend-api/conversation")
+    async def slack(request: Request):
+        params = await request.json()
+        conversation_id = params.get("conversation_id") or f"conv-{next(message_ids)}"
+
+        async def generate():
+            text = ""
+            async for word in timing.words():
+                text += word
+                yield sse({"conversation_id": conversation_id,
+                           "message": {"id": f"msg-{len(text)}", "content": {"parts": [text]}}})
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(generate(), media_type="text/event-stream")
+
+    @mock.get("/api/settings")
+    async def settings():
+        # every client setup gets a channel of its own
+        channel = f"channel-{next(channel_ids)}"
+        return {"tchannelData": {"channel": channel, "minSeq": 1, "channelHash": "hash", "baseHost": "mock",
+                                 "boxName": "box"}}
+
+    @mock.post("/api/receive_POST")
+    async def receive():
+        return {"data": {}}
+
+    @mock.post("/api/gql_POST")
+    async def gql(request: Request):
+        query = await request.json()
+        if query.get("queryName") != "SendMessageMutation":
+            return {"data": {"ok": True}}
+        variables = query["variables"]
+        human_message_id = next(message_ids)
+        task = asyncio.create_task(poe_reply(request.headers.get("poe-tchannel"), variables["bot"]))
+        mock.state.tasks.add(task)
+        task.add_done_callback(mock.state.tasks.discard)
+        return {"data": {"messageEdgeCreate": {"message": {"node": {"messageId": human_message_id}}}}}
+
+    async def poe_reply(channel, bot):
+        websocket = channels.get(channel)
+        if websocket is None:
+            return
+        message_id = next(message_ids)
+        text = ""
+
+        async def send(state):
+            update = {"messageId": message_id, "text": text, "state": state, "author": bot}
+            payload = {"message_type": "subscriptionUpdate", "payload": {"data": {"messageAdded": update}}}
+            await websocket.send_text(json.dumps({"min_seq": next(seq), "messages": [json.dumps(payload)]}))
+
+        try:
+            async for word in timing.words():
+                text += word
+                await send("incomplete")
+            await send("complete")
+        except (WebSocketDisconnect, RuntimeError):
+            pass
+
+    @mock.websocket("/up/{box}/updates")
+    async def updates(websocket: WebSocket, box: str):
+        channel = websocket.query_params.get("channel")
+        await websocket.accept()
+        channels[channel] = websocket
+        try:
+            while True:
+                await websocket.receive_text()
+        except WebSocketDisconnect:
+            pass
+        finally:
+            if channels.get(channel) is websocket:
+                del channels[channel]
+
+    mock.state.tasks = set()
+    return mock
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--tokens", type=int, default=50, help="words per reply")
+    parser.add_argument("--rate", type=float, default=50.0, help="tokens per second of a reply")
+    parser.add_argument("--jitter", type=float, default=0.2, help="relative variation of every delay")
+    parser.add_argument("--ttft", type=float, default=0.05, help="seconds before the first token")
+    args = parser.parse_args()
+
+    timing = Timing(args.tokens, args.rate, args.jitter, args.ttft)
+    uvicorn.run(mock_app(timing), host=args.host, port=args.port, log_level="warning")
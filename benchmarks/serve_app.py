@@ -0,0 +1,87 @@
+# -*- coding:utf-8 -*-
+"""
+Runs app.py against mock_upstreams.py instead of the real upstreams.
+
+The Anthropic and Slack adapters only need their base URL. The Poe client is
+patched to talk to the stand-in: its page bootstrap (next data, the obfuscated
+formkey script and the bot list) is skipped, GraphQL, the channel settings and
+the websocket go to --upstream. Tokens are counted as words and punctuation
+instead of with the tiktoken encoding, which would be downloaded on first use.
+Everything else comes from the environment as for app.py, e.g. MODEL=poe
+POE_TOKEN=a,b.
+
+    MODEL=slack python benchmarks/serve_app.py --port 8100 --upstream http://127.0.0.1:9100
+"""
+import argparse
+import os
+import re
+import sys
+import zlib
+
+import uvicorn
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "claude_to_chatgpt")]
+
+import poe  # noqa: E402
+from claude_to_chatgpt import util  # noqa: E402
+
+
+class WordEncoding:
+    """Stands in for the tiktoken encoding, so the benchmark runs offline."""
+
+    def encode(self, text, **kwargs):
+        return re.findall(r"\w+|[^\w\s]", text)
+
+
+def offline_encoding():
+    util.get_encoding = lambda encoding_name="cl100k_base": WordEncoding()
+
+
+def mock_poe(upstream):
+    host = upstream.split("://", 1)[1]
+    poe.Client.gql_url = f"{upstream}/api/gql_POST"
+    poe.Client.gql_recv_url = f"{upstream}/api/receive_POST"
+    poe.Client.home_url = upstream
+    poe.Client.settings_url = f"{upstream}/api/settings"
+
+    def setup_connection(self):
+        if self.setup_count % 5 == 0:
+            self.setup_session()
+        self.setup_count += 1
+        self.ws_domain = "mock"
+        self.formkey = self.formkey_salt = "mock"
+        self.set_channel(self.get_channel_data())
+        self.set_gql_headers()
+        if self.device_id is None:
+            self.device_id = "mock"
+        self.subscribe()
+
+    def get_websocket_url(self, channel=None):
+        channel = channel or self.channel
+        min_seq = channel["minSeq"] if self.min_seq is None else self.min_seq
+        return f'ws://{host}/up/{channel["boxName"]}/updates?min_seq={min_seq}&channel={channel["channel"]}'
+
+    def get_bot_by_codename(self, bot_codename):
+        return {"chatId": zlib.crc32(bot_codename.encode()),
+                "defaultBotObject": {"nickname": bot_codename, "displayName": bot_codename}}
+
+    poe.Client.setup_connection = setup_connection
+    poe.Client.get_websocket_url = get_websocket_url
+    poe.Client.get_bot_by_codename = get_bot_by_codename
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--upstream", default="http://127.0.0.1:9100", help="URL of mock_upstreams.py")
+    args = parser.parse_args()
+
+    os.environ.setdefault("CLAUDE_BASE_URL", args.upstream)
+    os.environ.setdefault("CLAUDE_SLACK_URL", args.upstream)
+    mock_poe(args.upstream)
+    offline_encoding()
+
+    from claude_to_chatgpt.app import app  # noqa: E402
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,142 @@
+# -*- coding:utf-8 -*-
+"""
+Concurrent Slack relay streams: blocking requests.post vs the async adapter.
+
+Starts a local stand-in for the Slack relay that streams a reply word by word,
+then runs the same number of concurrent conversations through the old blocking
+code path and through ClaudeSlackAdapter.chat.
+
+    python benchmarks/slack_concurrency.py --streams 20 --words 20 --delay 0.02
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+
+import requests
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "claude_to_chatgpt")]
+
+from claude_to_chatgpt import transport  # noqa: E402
+from claude_to_chatgpt.adapter import ClaudeSlackAdapter  # noqa: E402
+from claude_to_chatgpt.schemas import ChatRequest  # noqa: E402
+
+
+def relay_app(words, delay):
+    relay = FastAPI()
+
+    @relay.post("/backend-api/conversation")
+    async def conversation(request: Request):
+        await request.json()
+
+        async def generate():
+            text = ""
+            for i in range(words):
+                text += f" word{i}"
+                message = {"conversation_id": "bench", "message": {"content": {"parts": [text]}}}
+                yield f"data: {json.dumps(message)}\n\n"
+                await asyncio.sleep(delay)
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(generate(), media_type="text/event-stream")
+
+    return relay
+
+
+def start_relay(port, words, delay):
+    server = uvicorn.Server(uvicorn.Config(relay_app(words, delay), port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+BODY = {"model": "gpt-3.5-turbo", "messages": [{"role": "user", "content": "hello"}], "stream": True}
+
+
+async def blocking_stream(url, start):
+    # the pre-async adapter: requests.post + iter_lines on the event loop
+    first = None
+    response = requests.post(
+        f"{url}/backend-api/conversation",
+        headers={"content-type": "application/json"},
+        json=BODY,
+        timeout=10,
+        stream=True,
+    )
+    chunks = 0
+    for line in response.iter_lines():
+        if line.startswith(b"data:"):
+            chunks += 1
+            first = first or time.perf_counter() - start
+        await asyncio.sleep(0)
+    return chunks, first
+
+
+async def adapter_stream(adapter, start):
+    first = None
+    chunks = 0
+    async for _ in adapter.chat(ChatRequest.from_dict(BODY)):
+        chunks += 1
+        first = first or time.perf_counter() - start
+    return chunks, first
+
+
+async def loop_lag(stop, interval=0.005):
+    # how late the event loop wakes up a timer, i.e. how long it was blocked
+    worst = 0.0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - start - interval)
+    return worst
+
+
+async def run(label, streams, factory):
+    # time to first token is measured from the moment the whole batch is started
+    stop = asyncio.Event()
+    lag = asyncio.create_task(loop_lag(stop))
+    start = time.perf_counter()
+    results = await asyncio.gather(*[factory(start) for _ in range(streams)])
+    elapsed = time.perf_counter() - start
+    stop.set()
+    worst_lag = await lag
+
+    chunks = sum(count for count, _ in results)
+    ttft = sorted(first for _, first in results)
+    p50 = ttft[len(ttft) // 2] * 1000
+    p99 = ttft[min(len(ttft) - 1, int(len(ttft) * 0.99))] * 1000
+    print(
+        f"{label:<10} streams={streams:<4} wall={elapsed:7.3f}s  chunks/s={chunks / elapsed:9.1f}  "
+        f"ttft p50={p50:7.1f}ms p99={p99:7.1f}ms  max loop lag={worst_lag * 1000:7.1f}ms"
+    )
+
+
+async def main(args):
+    url = f"http://127.0.0.1:{args.port}"
+    adapter = ClaudeSlackAdapter("bench", "bench", url)
+    await transport.startup()
+    try:
+        await run("blocking", args.streams, lambda start: blocking_stream(url, start))
+        await run("async", args.streams, lambda start: adapter_stream(adapter, start))
+    finally:
+        await transport.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--streams", type=int, default=20)
+    parser.add_argument("--words", type=int, default=20)
+    parser.add_argument("--delay", type=float, default=0.02)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    start_relay(args.port, args.words, args.delay)
+    asyncio.run(main(args))
@@ -0,0 +1,75 @@
+# -*- coding:utf-8 -*-
+"""
+Per chunk SSE encoding: json.dumps of every chunk dict vs SSEEncoder.
+
+Builds one stream of chunks with chatgpt_chunk, checks that both paths produce
+the same bytes, then times encoding the whole stream with each.
+
+    python benchmarks/sse_encoding.py --chunks 2000 --repeat 20
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "claude_to_chatgpt")]
+
+from claude_to_chatgpt.adapter import chatgpt_chunk, finish  # noqa: E402
+from claude_to_chatgpt.sse import SSEEncoder  # noqa: E402
+from claude_to_chatgpt.usage import Usage  # noqa: E402
+
+WORDS = ["Hello", " there", ",", " how", " are", " you", "?", "\n", " \"quoted\"", " café", " 你好"]
+
+
+def build_stream(count):
+    t = time.time()
+    usage = Usage(42)
+    items = []
+    for i in range(count):
+        usage.completion.tokens = i + 1
+        items.append(chatgpt_chunk(t, "gpt-3.5-turbo", WORDS[i % len(WORDS)], usage))
+    items.append(finish(t, "gpt-3.5-turbo", usage, "stop"))
+    return items
+
+
+def dumps_path(items):
+    # the previous generate(): one json.dumps per item, encoded by Starlette
+    return [f"data: {json.dumps(item)}\n\n".encode("utf-8") for item in items]
+
+
+def encoder_path(items):
+    encoder = SSEEncoder()
+    return [encoder.encode(item) for item in items]
+
+
+def timed(func, items, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(items)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    items = build_stream(args.chunks)
+    assert dumps_path(items) == encoder_path(items), "SSEEncoder output differs from json.dumps"
+
+    baseline = timed(dumps_path, items, args.repeat)
+    for name, elapsed in (("json.dumps", baseline), ("SSEEncoder", timed(encoder_path, items, args.repeat))):
+        print(
+            f"{name:<11} chunks={len(items):<6} best={elapsed * 1000:8.2f}ms  "
+            f"per chunk={elapsed / len(items) * 1e6:6.2f}us  speedup={baseline / elapsed:5.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
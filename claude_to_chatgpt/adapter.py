@@ -1,13 +1,18 @@
 # -*- coding:utf-8 -*- 
-import httpx
-import requests
 import time
 import json
 import uuid
-from fastapi import Request
-from claude_to_chatgpt.util import num_tokens_from_string
+import httpx
+from claude_to_chatgpt.schemas import ChatRequest
+from claude_to_chatgpt.usage import Usage
 from claude_to_chatgpt.logger import logger
-from claude_to_chatgpt.models import model_map
+from claude_to_chatgpt.models import model_map, messages_model_map
+from claude_to_chatgpt import transport, resilience
+from claude_to_chatgpt.sse import Chunk, Interrupted, aiter_sse
+from claude_to_chatgpt.metrics import record_upstream_error
+from claude_to_chatgpt.credentials import Credential, CredentialPool, retry_after, split_credentials
+from claude_to_chatgpt.sessions import Session, text_of, transcript
+from claude_to_chatgpt.conversations import ConversationPool
 import poe 
 import claude
 
@@ -22,32 +27,94 @@ stop_reason_map = {
     "max_tokens": "length",
 }
 
+messages_stop_reason_map = {
+    "end_turn": "stop",
+    "stop_sequence": "stop",
+    "max_tokens": "length",
+}
+
+
+def build_pool(values, pool_options=None, cooldown=60.0, client_factory=None, shared=None):
+    pool_options = pool_options or {}
+    credentials = []
+    for value in values:
+        client = client_factory(value) if client_factory else None
+        credentials.append(Credential(value, client=client, **pool_options))
+    return CredentialPool(credentials, cooldown=cooldown, shared=shared)
+
+
+async def send(upstream, client, request):
+    """
+    Sends an httpx request behind the upstream's circuit breaker and returns the
+    streamed response. Connection errors and 5xx responses are retried.
+    """
+    async def attempt():
+        response = await client.send(request, stream=True)
+        if response.status_code >= 500:
+            await response.aclose()
+            raise resilience.UpstreamError(f"{upstream} returned status {response.status_code}")
+        return response
+
+    return await resilience.call(upstream, attempt, retry_on=(resilience.UpstreamError, httpx.TransportError))
+
+
+def content_blocks(content):
+    """OpenAI message content as messages api content, lists of parts stay structured."""
+    if isinstance(content, str):
+        return content
+    blocks = []
+    for part in content:
+        if part.get("type") != "image_url":
+            blocks.append(part)
+            continue
+        url = part["image_url"]["url"] if isinstance(part["image_url"], dict) else part["image_url"]
+        if url.startswith("data:"):
+            # data:image/png;base64,....
+            media_type, _, data = url[5:].partition(";base64,")
+            blocks.append({"type": "image", "source": {"type": "base64", "media_type": media_type, "data": data}})
+        else:
+            blocks.append({"type": "image", "source": {"type": "url", "url": url}})
+    return blocks
+
 
 class ClaudeAdapter:
-    def __init__(self,claude_api_key="", claude_base_url="https://api.anthropic.com"):
-        self.claude_api_key = claude_api_key
+    def __init__(self,claude_api_key="", claude_base_url="https://api.anthropic.com", pool_options=None, cooldown=60.0,
+                 shared=None, api_mode="complete", anthropic_version="2023-06-01"):
+        api_keys = claude_api_key if isinstance(claude_api_key, list) else split_credentials(claude_api_key)
         self.claude_base_url = claude_base_url
+        self.pool = build_pool(api_keys, pool_options, cooldown, shared=shared) if api_keys else None
+        self.anthropic_version = anthropic_version
+        # "complete" talks to the legacy /v1/complete, "messages" to /v1/messages
+        self.engine = self.messages if api_mode == "messages" else self.complete
 
     def get_api_key(self, headers):
+        # a key sent by the caller is used as is, otherwise one is taken from the pool
         auth_header = headers.get("authorization", None)
         if auth_header:
             return auth_header.split(" ")[1]
-        else:
-            return self.claude_api_key
+        return None
+
+    def check_response(self, response, credential):
+        if response.status_code == 429 and credential is not None:
+            self.pool.cooldown(credential, retry_after(response.headers))
+        if response.is_error:
+            raise Exception(f"Error: {response.status_code}")
+
+    def stream_failed(self, e, model):
+        # the stream already reached the caller, it ends interrupted instead of failing
+        logger.error(f"anthropic stream failed: {e}")
+        record_upstream_error(type(self).__name__, model)
+        if isinstance(e, (resilience.UpstreamError, httpx.TransportError)):
+            resilience.breaker("anthropic").record_failure()
 
     def convert_messages_to_prompt(self, messages):
-        prompt = ""
-        for message in messages:
-            role = message["role"]
-            content = message["content"]
-            transformed_role = role_map[role]
-            prompt += f"\n\n{transformed_role.capitalize()}: {content}"
-        prompt += "\n\nAssistant: "
-        return prompt
+        parts = [f"\n\n{role_map[message['role']]}: {text_of(message['content'])}" for message in messages]
+        parts.append("\n\nAssistant: ")
+        return "".join(parts)
 
-    def openai_to_claude_params(self, openai_params):
-        model = model_map.get(openai_params["model"], "claude-v1.3-100k")
-        messages = openai_params["messages"]
+    def openai_to_claude_params(self, chat_request):
+        model = model_map.get(chat_request.model, "claude-v1.3-100k")
+        messages = chat_request.messages
 
         prompt = self.convert_messages_to_prompt(messages)
 
@@ -57,62 +124,56 @@ class ClaudeAdapter:
             "max_tokens_to_sample": 100000 if model == "claude-v1.3-100k" else 9016,
         }
 
-        if openai_params.get("max_tokens"):
-            claude_params["max_tokens_to_sample"] = openai_params["max_tokens"]
+        if chat_request.max_tokens:
+            claude_params["max_tokens_to_sample"] = chat_request.max_tokens
 
-        if openai_params.get("stop"):
-            claude_params["stop_sequences"] = openai_params.get("stop")
+        if chat_request.stop:
+            claude_params["stop_sequences"] = chat_request.stop
 
-        if openai_params.get("temperature"):
-            claude_params["temperature"] = openai_params.get("temperature")
+        if chat_request.temperature is not None:
+            claude_params["temperature"] = chat_request.temperature
 
-        if openai_params.get("stream"):
+        if chat_request.stream:
             claude_params["stream"] = True
 
         return claude_params
 
-    def claude_to_chatgpt_response_stream(self, claude_response, prev_decoded_response):
-        completion_tokens = num_tokens_from_string(claude_response["completion"])
-        openai_response = {
-            "id": f"chatcmpl-{str(time.time())}",
-            "object": "chat.completion.chunk",
-            "created": int(time.time()),
-            "model": "gpt-3.5-turbo-0301",
-            "usage": {
-                "prompt_tokens": 0,
-                "completion_tokens": completion_tokens,
-                "total_tokens": completion_tokens,
-            },
-            "choices": [
-                {
-                    "delta": {
-                        "role": "assistant",
-                        "content": claude_response.get("completion", "").removeprefix(
-                            prev_decoded_response.get("completion", "")
-                        ),
-                    },
-                    "index": 0,
-                    "finish_reason": stop_reason_map[claude_response.get("stop_reason")]
-                    if claude_response.get("stop_reason")
-                    else None,
-                }
-            ],
-        }
+    def openai_to_messages_params(self, chat_request):
+        model = chat_request.model
+        if not model.startswith("claude-"):
+            model = messages_model_map.get(model, "claude-3-haiku-20240307")
 
-        return openai_response
+        system = []
+        messages = []
+        for message in chat_request.messages:
+            if message["role"] == "system":
+                system.append(text_of(message["content"]))
+            else:
+                messages.append({"role": message["role"], "content": content_blocks(message["content"])})
 
-    def claude_to_chatgpt_response(self, claude_response):
-        completion_tokens = num_tokens_from_string(claude_response["completion"])
+        params = {
+            "model": model,
+            "messages": messages,
+            "max_tokens": chat_request.max_tokens or 4096,
+            "stream": chat_request.stream,
+        }
+        if system:
+            params["system"] = "\n\n".join(system)
+        if chat_request.stop:
+            params["stop_sequences"] = chat_request.stop
+        if chat_request.temperature is not None:
+            params["temperature"] = chat_request.temperature
+        if chat_request.top_p is not None:
+            params["top_p"] = chat_request.top_p
+        return params
+
+    def claude_to_chatgpt_response(self, claude_response, usage, model, reason_map=stop_reason_map):
         openai_response = {
             "id": f"chatcmpl-{str(time.time())}",
             "object": "chat.completion",
             "created": int(time.time()),
-            "model": "gpt-3.5-turbo-0301",
-            "usage": {
-                "prompt_tokens": 0,
-                "completion_tokens": completion_tokens,
-                "total_tokens": completion_tokens,
-            },
+            "model": model,
+            "usage": usage.to_dict(),
             "choices": [
                 {
                     "message": {
@@ -120,7 +181,7 @@ class ClaudeAdapter:
                         "content": claude_response.get("completion", ""),
                     },
                     "index": 0,
-                    "finish_reason": stop_reason_map[claude_response.get("stop_reason")]
+                    "finish_reason": reason_map.get(claude_response["stop_reason"], "stop")
                     if claude_response.get("stop_reason")
                     else None,
                 }
@@ -129,79 +190,176 @@ class ClaudeAdapter:
 
         return openai_response
 
-    async def chat(self, request: Request):
-        openai_params = await request.json()
-        headers = request.headers
-        claude_params = self.openai_to_claude_params(openai_params)
-        api_key = self.get_api_key(headers)
+    async def chat(self, chat_request: ChatRequest):
+        api_key = self.get_api_key(chat_request.headers)
+        if api_key is not None or self.pool is None:
+            async for response in self.engine(chat_request, api_key):
+                yield response
+            return
+
+        async with self.pool.acquire() as credential:
+            async for response in self.engine(chat_request, credential.value, credential):
+                yield response
 
-        async with httpx.AsyncClient(timeout=60.0) as client:
+    async def complete(self, chat_request, api_key, credential=None):
+        claude_params = self.openai_to_claude_params(chat_request)
+        model = chat_request.model
+        usage = await Usage.for_prompt(claude_params["prompt"])
+        t = time.time()
+
+        client = transport.get_client()
+        request = client.build_request(
+            "POST",
+            f"{self.claude_base_url}/v1/complete",
+            headers={
+                "x-api-key": api_key,
+                "content-type": "application/json",
+            },
+            json=claude_params,
+        )
+        response = await send("anthropic", client, request)
+        try:
+            self.check_response(response, credential)
             if not claude_params.get("stream", False):
-                response = await client.post(
-                    f"{self.claude_base_url}/v1/complete",
-                    headers={
-                        "x-api-key": api_key,
-                        "content-type": "application/json",
-                    },
-                    json=claude_params,
+                claude_response = json.loads(await response.aread())
+                await usage.add(claude_response["completion"])
+                openai_response = self.claude_to_chatgpt_response(
+                    claude_response, usage, model
                 )
-                if response.is_error:
-                    raise Exception(f"Error: {response.status_code}")
-                claude_response = response.json()
-                openai_response = self.claude_to_chatgpt_response(claude_response)
                 yield openai_response
+                return
+
+            prev_decoded_line = {}
+            done = False
+            started = False
+            try:
+                async for line in response.aiter_lines():
+                    if line:
+                        if line == "data: [DONE]":
+                            done = True
+                            break
+                        stripped_line = line.lstrip("data:")
+                        if stripped_line:
+                            try:
+                                decoded_line = json.loads(stripped_line)
+                                # yield decoded_line
+                                # the completion so far is resent every time, only its end is new
+                                content = decoded_line.get("completion", "")[len(prev_decoded_line.get("completion", "")):]
+                                # count only the new text, not the whole completion so far
+                                await usage.add(content)
+                                prev_decoded_line = decoded_line
+                                started = True
+                                yield chatgpt_chunk(t, model, content, usage)
+                            except json.JSONDecodeError as e:
+                                logger.debug(
+                                    f"Error decoding JSON: {e}"
+                                )  # Debug output
+                                logger.debug(
+                                    f"Failed to decode line: {stripped_line}"
+                                )  # Debug output
+            except Exception as e:
+                # before any content the error goes to the caller, a router can still try another backend
+                if not started:
+                    raise
+                self.stream_failed(e, model)
+                yield interrupted(t, model, usage)
+                return
+            stop_reason = prev_decoded_line.get("stop_reason")
+            if stop_reason is None and not done:
+                # the connection closed before the completion did
+                yield interrupted(t, model, usage)
             else:
-                async with client.stream(
-                    "POST",
-                    f"{self.claude_base_url}/v1/complete",
-                    headers={
-                        "x-api-key": api_key,
-                        "content-type": "application/json",
-                    },
-                    json=claude_params,
-                ) as response:
-                    if response.is_error:
-                        raise Exception(f"Error: {response.status_code}")
-                    prev_decoded_line = {}
-                    async for line in response.aiter_lines():
-                        if line:
-                            if line == "data: [DONE]":
-                                yield "[DONE]"
-                                break
-                            stripped_line = line.lstrip("data:")
-                            if stripped_line:
-                                try:
-                                    decoded_line = json.loads(stripped_line)
-                                    # yield decoded_line
-                                    openai_response = (
-                                        self.claude_to_chatgpt_response_stream(
-                                            decoded_line, prev_decoded_line
-                                        )
-                                    )
-                                    prev_decoded_line = decoded_line
-                                    yield openai_response
-                                except json.JSONDecodeError as e:
-                                    logger.debug(
-                                        f"Error decoding JSON: {e}"
-                                    )  # Debug output
-                                    logger.debug(
-                                        f"Failed to decode line: {stripped_line}"
-                                    )  # Debug output
+                yield finish(t, model, usage, stop_reason_map.get(stop_reason, "stop"))
+            if done:
+                yield "[DONE]"
+        finally:
+            await response.aclose()
+
+    async def messages(self, chat_request, api_key, credential=None):
+        params = self.openai_to_messages_params(chat_request)
+        model = chat_request.model
+        # deltas are counted as they arrive, the exact counts reported by the upstream replace the local ones
+        usage = Usage()
+        t = time.time()
+
+        client = transport.get_client()
+        request = client.build_request(
+            "POST",
+            f"{self.claude_base_url}/v1/messages",
+            headers={
+                "x-api-key": api_key,
+                "anthropic-version": self.anthropic_version,
+                "content-type": "application/json",
+            },
+            json=params,
+        )
+        response = await send("anthropic", client, request)
+        try:
+            self.check_response(response, credential)
+            if not params["stream"]:
+                message = json.loads(await response.aread())
+                usage.report(message["usage"]["input_tokens"], message["usage"]["output_tokens"])
+                content = "".join(block["text"] for block in message["content"] if block["type"] == "text")
+                yield self.claude_to_chatgpt_response(
+                    {"completion": content, "stop_reason": message.get("stop_reason")}, usage, model,
+                    messages_stop_reason_map,
+                )
+                return
+
+            stop_reason = None
+            stopped = False
+            started = False
+            try:
+                async for data in aiter_sse(response.aiter_bytes()):
+                    event = json.loads(data)
+                    kind = event["type"]
+                    if kind == "content_block_delta":
+                        delta = event["delta"]
+                        if delta["type"] == "text_delta":
+                            await usage.add(delta["text"])
+                            started = True
+                            yield chatgpt_chunk(t, model, delta["text"], usage)
+                    elif kind == "message_start":
+                        usage.report(event["message"]["usage"].get("input_tokens"))
+                    elif kind == "message_delta":
+                        stop_reason = event["delta"].get("stop_reason")
+                        usage.report(completion_tokens=event.get("usage", {}).get("output_tokens"))
+                    elif kind == "message_stop":
+                        stopped = True
+                        break
+                    elif kind == "error":
+                        raise resilience.UpstreamError(f"anthropic stream failed: {event['error'].get('message')}")
+            except Exception as e:
+                if not started:
+                    raise
+                self.stream_failed(e, model)
+                yield interrupted(t, model, usage)
+                return
+            if not stopped:
+                # the connection closed before message_stop
+                yield interrupted(t, model, usage)
+            else:
+                yield finish(t, model, usage, messages_stop_reason_map.get(stop_reason, "stop"))
+        finally:
+            await response.aclose()
 
 class ClaudeSlackAdapter:
-    def __init__(self, channelid="",access_token="",claude_slack_url=""):
+    def __init__(self, channelid="",access_token="",claude_slack_url="", sessions=None):
         self.channel_id = channelid
         self.access_token = access_token
         self.claude_base_url = claude_slack_url
+        # with a SessionStore a chat continues its relay conversation instead of starting a new one
+        self.sessions = sessions
 
     def convert_messages_to_prompt(self, messages):
-        return messages[len(messages)-1]["content"]
+        return text_of(messages[len(messages)-1]["content"])
 
-    def openai_to_claude_params(self, openai_params):
-        model = model_map.get(openai_params["model"], "gpt-3.5-turbo")
-        messages = openai_params["messages"]
+    def openai_to_claude_params(self, chat_request, prompt=None, session=None):
+        model = model_map.get(chat_request.model, "gpt-3.5-turbo")
+        messages = chat_request.messages
 
-        prompt = self.convert_messages_to_prompt(messages)
+        if prompt is None:
+            prompt = self.convert_messages_to_prompt(messages)
 
         claude_params = {
             "action": "next",
@@ -220,206 +378,265 @@ class ClaudeSlackAdapter:
                     }
                 }
             ],
-            "parent_message_id": str(uuid.uuid4()),
+            "parent_message_id": session.parent if session else str(uuid.uuid4()),
             "model": model,
         }
-        claude_params["stream"] = openai_params.get("stream", True)
+        if session is not None:
+            claude_params["conversation_id"] = session.conversation
+        # the relay is always read as a stream, non streaming requests are aggregated in app.py
+        claude_params["stream"] = True
         return claude_params
 
-    
-    def chatgpt_response(self, decoded_line, prev_decoded_line, t, model):
-        content = decoded_line[len(prev_decoded_line):]
-        length = len(content)
-        
-        return  {
-            "id": f"chatcmpl-{str(t)}",
-            "object": "chat.completion",
-            "created": int(t),
-            "model": model,
-            "usage": {
-                "completion_tokens": length,
-                "total_tokens": length,
-            },
-            "choices": [
-                {
-                    "delta": {
-                        "role": "assistant",
-                        "content": content,
-                    },
-                    "index": 0,
-                }
-            ],
-        }
-   
-    async def chat(self, request: Request):
-        openai_params = await request.json()
-        claude_params = self.openai_to_claude_params(openai_params)
+    async def chat(self, chat_request: ChatRequest):
+        messages = chat_request.messages
+        prompt = None
+        session = None
+        if self.sessions is not None:
+            session = self.sessions.take(chat_request.model, messages)
+            prompt = self.convert_messages_to_prompt(messages) if session else transcript(messages)
+        claude_params = self.openai_to_claude_params(chat_request, prompt, session)
+        model = chat_request.model
+        usage = await Usage.for_prompt(claude_params["messages"][0]["content"]["parts"][0])
         t=time.time()
+        client = transport.get_client()
+        prev_decoded_line = ""
+        conversation_id = None
+        message_id = None
+        started = False
         try:
-            response = requests.post(
-                    f"{self.claude_base_url}/backend-api/conversation",
-                    headers={
-                        'Authorization': f'Bearer {self.channel_id}@{self.access_token}',
-                        "content-type": "application/json",
-                    },
-                    json=claude_params,
-                    timeout=10,
-                    stream=True,
-                )
-            response.raise_for_status()
+            request = client.build_request(
+                "POST",
+                f"{self.claude_base_url}/backend-api/conversation",
+                headers={
+                    'Authorization': f'Bearer {self.channel_id}@{self.access_token}',
+                    "content-type": "application/json",
+                },
+                json=claude_params,
+            )
+            response = await send("slack", client, request)
+            try:
+                response.raise_for_status()
+                async for data in aiter_sse(response.aiter_bytes()):
+                    if data.find(b'[DONE]')>-1:
+                        if self.sessions is not None and conversation_id is not None:
+                            self.sessions.put(model, messages, prev_decoded_line, Session(None, conversation_id, message_id))
+                        yield ( finish(t,model,usage) )
+                        break
+                    try:
+                        json_line = json.loads(data)
+                        conversation_id = json_line.get("conversation_id", conversation_id)
+                        message_id = json_line["message"].get("id", message_id)
+                        decoded_line = json_line["message"]["content"]["parts"][0]
+                        # yield decoded_line
+                        content = decoded_line[len(prev_decoded_line):]
+                        await usage.add(content)
+                        prev_decoded_line = decoded_line
+                        started = True
+                        yield ( chatgpt_chunk(t, model, content, usage) )
+                    except Exception as e:
+                        logger.error(f"req slack failed: {e}")
+                        record_upstream_error(type(self).__name__, model)
+                        yield ( interrupted(t,model,usage) )
+            finally:
+                await response.aclose()
         except Exception as e:
-            print("slack server failed: ",e)
-            yield ( finish(t,openai_params.get("model")) )
-            return
+            # before any content the error goes to the caller, app.py answers with an error status
+            if not started:
+                raise
+            logger.error(f"slack server failed: {e}")
+            record_upstream_error(type(self).__name__, model)
+            yield ( interrupted(t,model,usage) )
 
-        prev_decoded_line = ""
-        for line in response.iter_lines():
-            if not line or line is None:
-                continue
-            if not line.startswith(b'data:'):
-                continue
-            stripped_line = line.removeprefix(b'data: ')
-            if not stripped_line:
-                continue
-            if stripped_line.find(b'[DONE]')>-1:
-                yield ( finish(t,openai_params.get("model")) )
-                break
-            try:
-                json_line = json.loads(stripped_line)
-                decoded_line = json_line["message"]["content"]["parts"][0]
-                # yield decoded_line
-                openai_response = self.chatgpt_response(decoded_line, prev_decoded_line, t, claude_params.get("model"))
-                prev_decoded_line = decoded_line
-                yield ( openai_response )
-            except Exception as e:
-                print(f"req slack failed: {e}") 
-                yield ( finish(t,openai_params.get("model")) )
-                
 class PoeAdapter:
-    def __init__(self, poe_token, proxy, model3, model4):
-        self.client = poe.Client(poe_token, proxy=proxy)
+    def __init__(self, poe_token, proxy, model3, model4, pool_options=None, cooldown=60.0, daily_limit_cooldown=3600.0,
+                 shared=None, sessions=None):
+        tokens = poe_token if isinstance(poe_token, list) else split_credentials(poe_token)
+        self.pool = build_pool(
+            tokens, pool_options, cooldown,
+            client_factory=lambda token: poe.AsyncClient(token, proxy=proxy, shared=shared, bots=[model3, model4]),
+            shared=shared,
+        )
         self.model3 = model3
         self.model4 = model4
+        self.daily_limit_cooldown = daily_limit_cooldown
+        # with a SessionStore a chat continues its Poe conversation instead of sending a chat break
+        self.sessions = sessions
+        # (credential key, bot) of the chats streaming a reply
+        self.busy = set()
+
+    async def close(self):
+        for credential in self.pool.credentials:
+            await credential.client.close()
 
     def convert_messages_to_prompt(self, messages):
-        return messages[len(messages)-1]["content"]
+        return text_of(messages[len(messages)-1]["content"])
 
-    def openai_to_poe_params(self, openai_params):
-        messages = openai_params["messages"]
+    def openai_to_poe_params(self, chat_request):
+        messages = chat_request.messages
         prompt = self.convert_messages_to_prompt(messages)
 
         return prompt
 
-    def chatgpt_response(self, decoded_line, prev_decoded_line, t, model="gpt-3.5-turbo"):
-        content = decoded_line[len(prev_decoded_line):]
-        length = len(content)
-        return  {
-            "id": f"chatcmpl-{str(t)}",
-            "object": "chat.completion",
-            "created": int(t),
-            "model": model,
-            "usage": {
-                "completion_tokens": length,
-                "total_tokens": length,
-            },
-            "choices": [
-                {
-                    "delta": {
-                        "role": "assistant",
-                        "content": content,
-                    },
-                    "index": 0,
-                }
-            ],
-        }
-    
-    async def chat(self, request: Request):
-        openai_params = await request.json()
-        prompt = self.openai_to_poe_params(openai_params)
+    async def chat(self, chat_request: ChatRequest):
         t = time.time()
-        if openai_params.get("stream", False) == False:
-            yield ( finish(t,openai_params.get("model")) )
-        omodel = openai_params.get("model", "gpt-3.5-turbo")
+        omodel = chat_request.model
         model = self.model3
         if omodel.startswith("gpt-4"):
             model =self.model4
+        messages = chat_request.messages
+        session = self.sessions.take(omodel, messages) if self.sessions is not None else None
+        usage = None
+        started = False
         try:
-            for resp in self.client.send_message(model, prompt, with_chat_break=True):
-                chunk = resp.get("text_new", None)
-                if chunk is None:
-                    yield ( finish(t,openai_params.get("model")) )
-                    return 
-                r = self.chatgpt_response(chunk, "", t, openai_params.get("model"))
-                yield ( r )
-            yield ( finish(t,openai_params.get("model")) )
+            # an account streams one reply per bot at a time, others take the request while its chat is busy
+            async with self.pool.acquire(prefer=session.credential if session else None,
+                                         available=lambda credential: (credential.key, model) not in self.busy) as credential:
+                slot = (credential.key, model)
+                self.busy.add(slot)
+                try:
+                    # each bot has one chat per account, its context lasts until the next chat break,
+                    # which another chat may have sent while this request waited for the account
+                    if session is not None and session.credential == credential.key and self.sessions.current(session):
+                        prompt = self.openai_to_poe_params(chat_request)
+                        with_chat_break = False
+                    else:
+                        session = Session(credential.key, model)
+                        if self.sessions is not None:
+                            self.sessions.release(session)
+                            prompt = transcript(messages)
+                        else:
+                            prompt = self.openai_to_poe_params(chat_request)
+                        with_chat_break = True
+                    usage = await Usage.for_prompt(prompt)
+                    reply = []
+                    try:
+                        async for resp in credential.client.send_message(model, prompt, with_chat_break=with_chat_break):
+                            chunk = resp.get("text_new", None)
+                            if chunk is None:
+                                break
+                            await usage.add(chunk)
+                            reply.append(chunk)
+                            started = True
+                            yield ( chatgpt_chunk(t, chat_request.model, chunk, usage) )
+                    except poe.RateLimitError:
+                        self.pool.cooldown(credential, self.daily_limit_cooldown)
+                        raise
+                    if self.sessions is not None:
+                        self.sessions.put(omodel, messages, "".join(reply), session)
+                finally:
+                    self.busy.discard(slot)
+            yield ( finish(t,chat_request.model,usage) )
         except Exception as e:
-            print(f"req poe.com failed: {e}")
-            yield ( finish(t,openai_params.get("model")) )
+            if not started:
+                raise
+            logger.error(f"req poe.com failed: {e}")
+            record_upstream_error(type(self).__name__, chat_request.model)
+            yield ( interrupted(t,chat_request.model,usage) )
+
+
+# streams of one claude.ai account expected at once when the credential pool does not limit them
+CLAUDE2_STREAMS = 32
 
 
 class claude2Adapter:
-    def __init__(self, cookie, chatid, orgid=None):
-        self.client = claude.Client(cookie=cookie,organization=orgid)
-        self.conversation_id = chatid
+    def __init__(self, cookie, chatid, orgid=None, pool_options=None, cooldown=60.0, shared=None, sessions=None,
+                 conversations=2, gc_interval=30.0, max_clients=None):
+        # several accounts are given as aligned lists of cookies, chat ids and org ids
+        cookies = cookie if isinstance(cookie, list) else [cookie]
+        chatids = chatid if isinstance(chatid, list) else [chatid]
+        orgids = orgid if isinstance(orgid, list) else [orgid]
+        chatids = chatids + [None] * (len(cookies) - len(chatids))
+        orgids = orgids + [None] * (len(cookies) - len(orgids))
+        if conversations <= 0 and sessions is None and not all(chatids[:len(cookies)]):
+            raise ValueError("Without a conversation pool (CLAUDE2_CONVERSATIONS=0) every claude.ai account needs "
+                             "its conversation in CLAUDE2_CHATID.")
+        if not max_clients:
+            # streams, conversation refills and batch deletes of an account share its session's connections
+            streams = (pool_options or {}).get("max_concurrency") or CLAUDE2_STREAMS
+            max_clients = streams + conversations + claude.DELETE_CONCURRENCY
+        credentials = []
+        for cookie, chatid, orgid in zip(cookies, chatids, orgids):
+            client = claude.Client(cookie=cookie,organization=orgid, max_clients=max_clients)
+            credentials.append(Credential(cookie, client=client, conversation_id=chatid, **(pool_options or {})))
+        self.pool = CredentialPool(credentials, cooldown=cooldown, shared=shared)
+        # conversations are leased from a pool per account, unless the pool is turned off
+        # with conversations=0, then every request goes to the account's configured chat id
+        self.conversations = {}
+        if conversations > 0 or sessions is not None:
+            for credential in credentials:
+                self.conversations[credential.key] = ConversationPool(credential.client, conversations, gc_interval)
+        # with a SessionStore a chat keeps its conversation until the session is dropped
+        self.sessions = sessions
+        if sessions is not None:
+            sessions.on_evict = self.retire
 
     def convert_messages_to_prompt(self, messages):
-        return messages[len(messages)-1]["content"]
+        return text_of(messages[len(messages)-1]["content"])
 
-    def openai_to_params(self, openai_params):
-        messages = openai_params["messages"]
+    def openai_to_params(self, chat_request):
+        messages = chat_request.messages
         prompt = self.convert_messages_to_prompt(messages)
 
         return prompt
 
-    def chatgpt_response(self, decoded_line, prev_decoded_line, t, model="gpt-3.5-turbo"):
-        content = decoded_line[len(prev_decoded_line):]
-        length = len(content)
-        return  {
-            "id": f"chatcmpl-{str(t)}",
-            "object": "chat.completion",
-            "created": int(t),
-            "model": model,
-            "usage": {
-                "completion_tokens": length,
-                "total_tokens": length,
-            },
-            "choices": [
-                {
-                    "delta": {
-                        "role": "assistant",
-                        "content": content,
-                    },
-                    "index": 0,
-                }
-            ],
-        }
-    
-    async def chat(self, request: Request):
-        openai_params = await request.json()
-        prompt = self.openai_to_params(openai_params)
+    def retire(self, session):
+        self.conversations[session.credential].retire(session.conversation)
+
+    async def close(self):
+        for pool in self.conversations.values():
+            await pool.close()
+        for credential in self.pool.credentials:
+            await credential.client.close()
+
+    async def chat(self, chat_request: ChatRequest):
         t = time.time()
-        if openai_params.get("stream", False) == False:
-            yield ( finish(t,openai_params.get("model")) )
+        messages = chat_request.messages
+        session = self.sessions.take(chat_request.model, messages) if self.sessions is not None else None
+        usage = None
+        started = False
         try:
-            pre_completion = ""
-            # response = self.client.send_message(prompt, self.conversation_id)
-            # print(f"prompt: {prompt}, response: {response}")
-            
-            # for line in response.iter_lines():
-            async for line in self.client.send_message(prompt, self.conversation_id):
-                # print(f"prompt: {prompt}, response: {line}")
-                # if line.startswith(b'data:'):
-                #     json_obj = json.loads(line[6:])
-                #     completion = json_obj.get('completion')
-                #     if completion is None:
-                #         continue
-                for completion in line:                    
-                    r = self.chatgpt_response(completion, pre_completion,t, openai_params.get("model"))
-                    yield ( r )
-            yield ( finish(t,openai_params.get("model")) )
+            async with self.pool.acquire(prefer=session.credential if session else None) as credential:
+                conversations = self.conversations.get(credential.key)
+                if session is not None and session.credential != credential.key:
+                    # the account holding the chat is busy, the chat is replayed on another one
+                    self.retire(session)
+                    session = None
+                if session is not None:
+                    conversation_id = session.conversation
+                    prompt = self.openai_to_params(chat_request)
+                elif conversations is None:
+                    conversation_id = credential.extra["conversation_id"]
+                    prompt = self.openai_to_params(chat_request)
+                else:
+                    conversation_id = await conversations.lease()
+                    session = Session(credential.key, conversation_id)
+                    prompt = transcript(messages) if self.sessions is not None else self.openai_to_params(chat_request)
+                kept = False
+                try:
+                    usage = await Usage.for_prompt(prompt)
+                    reply = []
+                    async for completion in credential.client.send_message(prompt, conversation_id):
+                        await usage.add(completion)
+                        reply.append(completion)
+                        started = True
+                        yield ( chatgpt_chunk(t, chat_request.model, completion, usage) )
+                    if self.sessions is not None:
+                        self.sessions.put(chat_request.model, messages, "".join(reply), session)
+                        kept = True
+                except claude.RateLimitError:
+                    self.pool.cooldown(credential)
+                    raise
+                finally:
+                    # a leased conversation goes back only through its session
+                    if session is not None and not kept:
+                        conversations.retire(conversation_id)
+            yield ( finish(t,chat_request.model,usage) )
         except Exception as e:
-            print(f"req claude2 failed: {e}")
-            yield ( finish(t,openai_params.get("model")) )
+            if not started:
+                raise
+            logger.error(f"req claude2 failed: {e}")
+            record_upstream_error(type(self).__name__, chat_request.model)
+            yield ( interrupted(t,chat_request.model,usage) )
 
 
 # TBD
@@ -433,8 +650,8 @@ class MerlinAdapter:
     def convert_messages_to_prompt(self, messages):
         return messages[len(messages)-1]["content"]
 
-    def openai_to_poe_params(self, openai_params):
-        messages = openai_params["messages"]
+    def openai_to_poe_params(self, chat_request):
+        messages = chat_request.messages
         prompt = self.convert_messages_to_prompt(messages)
 
         return prompt
@@ -463,32 +680,116 @@ class MerlinAdapter:
             ],
         }
     
-    async def chat(self, request: Request):
-        openai_params = await request.json()
-        prompt = self.openai_to_poe_params(openai_params)
+    async def chat(self, chat_request: ChatRequest):
+        prompt = self.openai_to_poe_params(chat_request)
         t = time.time()
-        if openai_params.get("stream", False)==False:
-            yield ( finish(t,openai_params.get("model")) )
+        if not chat_request.stream:
+            yield ( finish(t,chat_request.model) )
         for resp in self.client.send_message(self.model, prompt, with_chat_break=True):
             chunk = resp.get("text_new", None)
             if chunk is None:
-                yield ( finish(t,openai_params.get("model")) )
+                yield ( finish(t,chat_request.model) )
                 return 
-            r = self.chatgpt_response(chunk, "", t, openai_params.get("model"))
+            r = self.chatgpt_response(chunk, "", t, chat_request.model)
             yield ( r )
-        yield ( finish(t,openai_params.get("model")) )
+        yield ( finish(t,chat_request.model) )
+
+
+def chatgpt_chunk(t, model, content, usage):
+    # the key order is the one SSEEncoder's template expects
+    return Chunk({
+        "id": f"chatcmpl-{str(t)}",
+        "object": "chat.completion.chunk",
+        "created": int(t),
+        "model": model,
+        "usage": usage.to_dict(),
+        "choices": [
+            {
+                "delta": {
+                    "role": "assistant",
+                    "content": content,
+                },
+                "index": 0,
+                "finish_reason": None,
+            }
+        ],
+    })
 
 
-def finish(t,model):
-    return {
+def finish(t, model, usage=None, finish_reason="stop"):
+    response = {
         "id": f"chatcmpl-{str(t)}",
         "object": "chat.completion",
         "created": int(t),
         "model": model,
         "choices": [
             {
-                "finish_reason": "done",
+                "finish_reason": finish_reason,
                 "index": 0,
             }
         ],
-    }
\ No newline at end of file
+    }
+    # the final chunk carries the usage of the whole request
+    if usage is not None:
+        response["usage"] = usage.to_dict()
+    return response
+
+
+def interrupted(t, model, usage=None):
+    """The finish item of a stream that failed after its first chunk, it is not cached."""
+    return Interrupted(finish(t, model, usage))
+
+
+async def aggregate(stream):
+    """
+    Consumes an adapter's chat() stream into one chat.completion response.
+
+    Only the content of each chunk is kept until the finish item arrives, the
+    rest of the stream is then closed. A complete response, as ClaudeAdapter
+    returns for non streaming requests, is passed through as is.
+    """
+    parts = []
+    header = None
+    usage = None
+    finish_reason = None
+    cut_off = False
+    try:
+        async for item in stream:
+            if not isinstance(item, dict):
+                continue
+            choice = item["choices"][0]
+            if "message" in choice:
+                return item
+            if header is None:
+                header = (item["id"], item["created"], item["model"])
+            usage = item.get("usage", usage)
+            if item["object"] == "chat.completion.chunk":
+                parts.append(choice["delta"]["content"] or "")
+            else:
+                finish_reason = choice["finish_reason"]
+                cut_off = isinstance(item, Interrupted)
+                break
+    finally:
+        await stream.aclose()
+
+    if header is None:
+        raise RuntimeError("The upstream stream ended without a response.")
+    response = {
+        "id": header[0],
+        "object": "chat.completion",
+        "created": header[1],
+        "model": header[2],
+    }
+    if usage is not None:
+        response["usage"] = usage
+    response["choices"] = [
+        {
+            "message": {
+                "role": "assistant",
+                "content": "".join(parts),
+            },
+            "index": 0,
+            "finish_reason": finish_reason or "stop",
+        }
+    ]
+    return Interrupted(response) if cut_off else response
@@ -1,24 +1,48 @@
 # -*- coding:utf-8 -*- 
 from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from claude_to_chatgpt.adapter import ClaudeAdapter, ClaudeSlackAdapter, PoeAdapter, claude2Adapter
-import json
+from claude_to_chatgpt.adapter import ClaudeAdapter, ClaudeSlackAdapter, PoeAdapter, claude2Adapter, aggregate
+import atexit
 import os
+import shutil
+import tempfile
 from claude_to_chatgpt.logger import logger
 from claude_to_chatgpt.models import models_list
+from claude_to_chatgpt import transport
+from claude_to_chatgpt.credentials import split_credentials
+from claude_to_chatgpt.shared import SharedState
+from claude_to_chatgpt.cache import ResponseCache, is_deterministic, request_key
+from claude_to_chatgpt.singleflight import SingleFlight
+from claude_to_chatgpt.schemas import ChatRequest
+from claude_to_chatgpt.sse import SSEEncoder
+from claude_to_chatgpt.coalesce import coalesce
+from claude_to_chatgpt.router import Router, parse_routes
+from claude_to_chatgpt.sessions import SessionStore
+from claude_to_chatgpt import metrics, resilience
 
+# several credentials can be given: api keys, poe tokens, chat and org ids separated by ",", cookies by "|"
 CLAUDE_BASE_URL = os.getenv("CLAUDE_BASE_URL", "https://api.anthropic.com")
-CLAUDE_API_KEY = os.getenv("CLAUDE_API_KEY", None)
-CLAUDE2_COOKIE = os.getenv("CLAUDE2_COOKIE", None)
-CLAUDE2_CHATID = os.getenv("CLAUDE2_CHATID", None)
-CLAUDE2_ORGID = os.getenv("CLAUDE2_ORGID", None)
+CLAUDE_API_KEY = split_credentials(os.getenv("CLAUDE_API_KEY", None))
+# "complete" for the legacy text completions api, "messages" for the messages api
+CLAUDE_API_MODE = os.getenv("CLAUDE_API_MODE", "complete")
+ANTHROPIC_VERSION = os.getenv("ANTHROPIC_VERSION", "2023-06-01")
+CLAUDE2_COOKIE = split_credentials(os.getenv("CLAUDE2_COOKIE", None), "|")
+CLAUDE2_CHATID = split_credentials(os.getenv("CLAUDE2_CHATID", None))
+CLAUDE2_ORGID = split_credentials(os.getenv("CLAUDE2_ORGID", None)) or None
+# warm claude.ai conversations kept per account, each request leases its own. With 0 and no
+# SESSIONS every request goes to the conversation in CLAUDE2_CHATID, which stays the default
+# when CLAUDE2_CHATID is set
+CLAUDE2_CONVERSATIONS = int(os.getenv("CLAUDE2_CONVERSATIONS", 0 if CLAUDE2_CHATID else 2))
+CLAUDE2_GC_INTERVAL = float(os.getenv("CLAUDE2_GC_INTERVAL", 30))
+# connections per claude.ai account, 0 sizes them for the streams, the conversation pool and its deletes
+CLAUDE2_MAX_CLIENTS = int(os.getenv("CLAUDE2_MAX_CLIENTS", 0))
 
 CLAUDE_SLACK_URL = os.getenv("CLAUDE_SLACK_URL", None)
 SLACK_CHANNEL = os.getenv("SLACK_CHANNEL", None)
 SLACK_ACCESS_TOKEN = os.getenv("SLACK_ACCESS_TOKEN", None)
 
-POE_TOKEN = os.getenv("POE_TOKEN", None)
+POE_TOKEN = split_credentials(os.getenv("POE_TOKEN", None))
 POE_PROXY = os.getenv("POE_PROXY", None)
 POE_GPT3_MODEL = os.getenv("POE_GPT3_MODEL", "chinchilla") 
 POE_GPT4_MODEL = os.getenv("POE_GPT4_MODEL", "a2_2") 
@@ -36,19 +60,153 @@ POE_GPT4_MODEL = os.getenv("POE_GPT4_MODEL", "a2_2")
 
 MODEL = os.getenv("MODEL", "poe")
 LOG_LEVEL = os.getenv("LOG_LEVEL", "info")
-PORT = os.getenv("PORT", 8000)
+PORT = int(os.getenv("PORT", 8000))
 HOST = os.getenv("HOST", "0.0.0.0")
 
+
+def remove_shared_state_dir(directory, owner):
+    # forked children inherit atexit handlers, only the process that created the directory removes it
+    if os.getpid() == owner:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+# several worker processes share bootstrap data and credential cooldowns through files in SHARED_STATE_DIR
+WORKERS = int(os.getenv("WORKERS", 1))
+SHARED_STATE_DIR = os.getenv("SHARED_STATE_DIR", None)
+if WORKERS > 1 and not SHARED_STATE_DIR:
+    # created by the supervisor, inherited by the workers it spawns, removed when the supervisor exits
+    SHARED_STATE_DIR = os.environ["SHARED_STATE_DIR"] = tempfile.mkdtemp(prefix="claude-to-chatgpt-")
+    atexit.register(remove_shared_state_dir, SHARED_STATE_DIR, os.getpid())
+shared_state = SharedState(SHARED_STATE_DIR) if SHARED_STATE_DIR else None
+
+# shared upstream http client
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", 100))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", 20))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", 30))
+HTTP2 = os.getenv("HTTP2", "false").lower() in ("1", "true", "yes")
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", 10))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", 60))
+HTTP_POOL_TIMEOUT = float(os.getenv("HTTP_POOL_TIMEOUT", 10))
+
+transport.configure(
+    max_connections=HTTP_MAX_CONNECTIONS,
+    max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+    keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    http2=HTTP2,
+    connect_timeout=HTTP_CONNECT_TIMEOUT,
+    read_timeout=HTTP_READ_TIMEOUT,
+    write_timeout=HTTP_READ_TIMEOUT,
+    pool_timeout=HTTP_POOL_TIMEOUT,
+)
+
+# per credential limits, unset or 0 is no limit: the pool then only spreads requests across credentials
+CREDENTIAL_CONCURRENCY = int(os.getenv("CREDENTIAL_CONCURRENCY", 0))
+CREDENTIAL_RATE = float(os.getenv("CREDENTIAL_RATE", 0))
+CREDENTIAL_BURST = int(os.getenv("CREDENTIAL_BURST", 0))
+CREDENTIAL_COOLDOWN = float(os.getenv("CREDENTIAL_COOLDOWN", 60))
+POE_DAILY_LIMIT_COOLDOWN = float(os.getenv("POE_DAILY_LIMIT_COOLDOWN", 3600))
+
+# limits are per credential across the whole deployment, each worker gets its share
+pool_options = {
+    "max_concurrency": max(1, CREDENTIAL_CONCURRENCY // WORKERS) if CREDENTIAL_CONCURRENCY > 0 else None,
+    "rate": CREDENTIAL_RATE / WORKERS if CREDENTIAL_RATE > 0 else None,
+    "burst": max(1, CREDENTIAL_BURST // WORKERS) if CREDENTIAL_BURST > 0 else None,
+}
+
+# cache for temperature 0 requests
+RESPONSE_CACHE = os.getenv("RESPONSE_CACHE", "false").lower() in ("1", "true", "yes")
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", 3600))
+RESPONSE_CACHE_BYTES = int(os.getenv("RESPONSE_CACHE_BYTES", 64 * 1024 * 1024))
+RESPONSE_CACHE_DIR = os.getenv("RESPONSE_CACHE_DIR", None)
+
+response_cache = None
+if RESPONSE_CACHE:
+    response_cache = ResponseCache(RESPONSE_CACHE_BYTES, RESPONSE_CACHE_TTL, RESPONSE_CACHE_DIR)
+
+# merge stream deltas for up to STREAM_COALESCE_MS before sending them, 0 sends every delta at once.
+# clients can opt out per request with the header "X-Stream-Flush: immediate"
+STREAM_COALESCE_MS = float(os.getenv("STREAM_COALESCE_MS", 0))
+STREAM_COALESCE_BYTES = int(os.getenv("STREAM_COALESCE_BYTES", 4096))
+
+# retries with backoff are limited to a share of the requests, an upstream failing
+# BREAKER_FAILURE_THRESHOLD times in a row is not called for BREAKER_RESET_TIMEOUT seconds
+RETRY_BUDGET_RATIO = float(os.getenv("RETRY_BUDGET_RATIO", 0.2))
+RETRY_MIN_PER_SECOND = float(os.getenv("RETRY_MIN_PER_SECOND", 1))
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", 3))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", 0.2))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", 10))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", 5))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", 30))
+
+resilience.configure(
+    retry_ratio=RETRY_BUDGET_RATIO,
+    retry_min_per_second=RETRY_MIN_PER_SECOND,
+    max_attempts=RETRY_MAX_ATTEMPTS,
+    base_delay=RETRY_BASE_DELAY,
+    max_delay=RETRY_MAX_DELAY,
+    failure_threshold=BREAKER_FAILURE_THRESHOLD,
+    reset_timeout=BREAKER_RESET_TIMEOUT,
+)
+
+# merge identical concurrent requests into one upstream call
+SINGLE_FLIGHT = os.getenv("SINGLE_FLIGHT", "false").lower() in ("1", "true", "yes")
+single_flight = SingleFlight() if SINGLE_FLIGHT else None
+
+# continue the upstream conversation of a chat on Poe, claude.ai and Slack and send only its new
+# message, instead of only the last message. Sessions are kept in memory, per worker
+SESSIONS = os.getenv("SESSIONS", "false").lower() in ("1", "true", "yes")
+SESSION_TTL = float(os.getenv("SESSION_TTL", 3600))
+SESSION_MAX = int(os.getenv("SESSION_MAX", 4096))
+
+
+def session_store():
+    return SessionStore(SESSION_MAX, SESSION_TTL) if SESSIONS else None
+
+
+# MODEL=router serves models from several backends, ROUTER_ROUTES maps each model to the
+# backends allowed for it, e.g. "gpt-3.5-turbo=claude,poe;gpt-4=poe,claude2;*=claude"
+ROUTER_ROUTES = os.getenv("ROUTER_ROUTES", None)
+ROUTER_EWMA_ALPHA = float(os.getenv("ROUTER_EWMA_ALPHA", 0.3))
+ROUTER_ERROR_HALF_LIFE = float(os.getenv("ROUTER_ERROR_HALF_LIFE", 30))
+
+
+def configured_backends():
+    backends = []
+    if CLAUDE_API_KEY:
+        backends.append("claude")
+    if POE_TOKEN:
+        backends.append("poe")
+    if CLAUDE2_COOKIE:
+        backends.append("claude2")
+    if CLAUDE_SLACK_URL:
+        backends.append("slack")
+    return backends
+
+
 # default is poeadapter
-if MODEL=="poe": 
-    adapter = PoeAdapter(POE_TOKEN, POE_PROXY, POE_GPT3_MODEL, POE_GPT4_MODEL)
-elif MODEL=="slack":
-    adapter = ClaudeSlackAdapter(SLACK_CHANNEL,SLACK_ACCESS_TOKEN,CLAUDE_SLACK_URL)
-elif MODEL=="claude2":
-    adapter = claude2Adapter(CLAUDE2_COOKIE, CLAUDE2_CHATID, CLAUDE2_ORGID)
-else:
-    adapter =  ClaudeAdapter(CLAUDE_API_KEY, CLAUDE_BASE_URL)
-    
+def build_adapter(model=MODEL):
+    if model=="router":
+        # without routes every backend with credentials serves every model
+        routes = parse_routes(ROUTER_ROUTES) or {"*": configured_backends()}
+        names = dict.fromkeys(name for backends in routes.values() for name in backends)
+        return Router({name: build_adapter(name) for name in names}, routes, ROUTER_EWMA_ALPHA, ROUTER_ERROR_HALF_LIFE)
+    elif model=="poe":
+        return PoeAdapter(POE_TOKEN, POE_PROXY, POE_GPT3_MODEL, POE_GPT4_MODEL,
+                          pool_options, CREDENTIAL_COOLDOWN, POE_DAILY_LIMIT_COOLDOWN, shared_state, session_store())
+    elif model=="slack":
+        return ClaudeSlackAdapter(SLACK_CHANNEL,SLACK_ACCESS_TOKEN,CLAUDE_SLACK_URL, session_store())
+    elif model=="claude2":
+        if CLAUDE2_CHATID and CLAUDE2_CONVERSATIONS > 0:
+            logger.warning("CLAUDE2_CONVERSATIONS is set, so the conversations in CLAUDE2_CHATID are not used")
+        return claude2Adapter(CLAUDE2_COOKIE, CLAUDE2_CHATID, CLAUDE2_ORGID, pool_options, CREDENTIAL_COOLDOWN, shared_state,
+                              session_store(), CLAUDE2_CONVERSATIONS, CLAUDE2_GC_INTERVAL, CLAUDE2_MAX_CLIENTS)
+    return ClaudeAdapter(CLAUDE_API_KEY, CLAUDE_BASE_URL, pool_options, CREDENTIAL_COOLDOWN, shared_state,
+                         CLAUDE_API_MODE, ANTHROPIC_VERSION)
+
+
+# with several workers the supervisor only spawns them and serves nothing itself
+adapter = None if __name__ == "__main__" and WORKERS > 1 else build_adapter()
+
 app = FastAPI()
 
 # Add CORS middleware
@@ -61,34 +219,152 @@ app.add_middleware(
 )
 
 
+@app.on_event("startup")
+async def startup():
+    await transport.startup()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    close = getattr(adapter, "close", None)
+    if close is not None:
+        await close()
+    await transport.shutdown()
+
+
 @app.api_route(
     "/v1/chat/completions",
     methods=["POST", "OPTIONS"],
 )
 async def chat(request: Request):
-    openai_params = await request.json()
-    stream=openai_params.get("stream")
-    if stream is None:
-        openai_params["stream"]=True
-    if openai_params.get("stream", False):
+    try:
+        chat_request = ChatRequest.parse(await request.body(), request.headers)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": {"message": str(e), "type": "invalid_request_error"}})
+    openai_params = chat_request.params
+
+    key = None
+    cached = None
+    scope = request.headers.get("authorization", "")
+    if response_cache is not None and is_deterministic(openai_params):
+        key = request_key(openai_params, scope)
+        cached = await response_cache.get(key)
+
+    if chat_request.stream:
+        if cached is not None:
+            responses = replay(cached)
+        elif key is not None:
+            responses = response_cache.record(key, upstream(chat_request, scope))
+        else:
+            responses = upstream(chat_request, scope)
+        try:
+            # errors before the first chunk still get a status code
+            responses = await prime(responses)
+        except Exception as e:
+            return upstream_error(e)
+        if STREAM_COALESCE_MS > 0 and request.headers.get("x-stream-flush", "").lower() != "immediate":
+            responses = coalesce(responses, STREAM_COALESCE_MS / 1000, STREAM_COALESCE_BYTES)
+
         async def generate():
-            async for response in adapter.chat(request):
-                yield f"data: {json.dumps(response)}\n\n"
+            encoder = SSEEncoder()
+            async for response in responses:
+                yield encoder.encode(response)
         return StreamingResponse(generate(), media_type="text/event-stream")
     else:
-        openai_response = None
-        response = adapter.chat(request)
-        openai_response = await response.__anext__()
+        if cached is not None:
+            return JSONResponse(content=cached[0])
+        try:
+            openai_response = await aggregate(upstream(chat_request, scope))
+        except Exception as e:
+            return upstream_error(e)
+        if key is not None:
+            await response_cache.put(key, [openai_response])
         return JSONResponse(content=openai_response)
 
 
+def upstream_error(e):
+    logger.error(f"upstream failed: {e}")
+    # 503 when the upstream is down or we stopped calling it, it is worth retrying later
+    status_code = 503 if isinstance(e, (resilience.UpstreamError, resilience.CircuitOpenError)) else 502
+    return JSONResponse(status_code=status_code, content={"error": {"message": str(e), "type": "upstream_error"}})
+
+
+def upstream(chat_request, scope):
+    def call():
+        if isinstance(adapter, Router):
+            # the router instruments each backend it calls
+            return adapter.chat(chat_request)
+        return metrics.instrument(adapter.chat(chat_request), type(adapter).__name__, chat_request.model)
+
+    if single_flight is None:
+        return call()
+    return single_flight.subscribe(request_key(chat_request.params, scope), call)
+
+
+async def replay(items):
+    for item in items:
+        yield item
+
+
+async def prime(stream):
+    """Waits for the first item of a stream, returns a stream of all its items."""
+    iterator = stream.__aiter__()
+    try:
+        first = await iterator.__anext__()
+    except StopAsyncIteration:
+        return replay(())
+
+    async def resume():
+        try:
+            yield first
+            async for item in iterator:
+                yield item
+        finally:
+            if hasattr(iterator, "aclose"):
+                await iterator.aclose()
+
+    return resume()
+
+
 @app.route("/v1/models", methods=["POST", "GET"])
 async def models(request: Request):
     # return a dict with key "object" and "data", "object" value is "list", "data" values is models list
     return JSONResponse(content={"object": "list", "data": models_list})
 
 
+@app.get("/metrics")
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+def adapter_stats(adapter):
+    stats = {}
+    if getattr(adapter, "pool", None) is not None:
+        stats["credentials"] = adapter.pool.stats()
+    if getattr(adapter, "sessions", None) is not None:
+        stats["sessions"] = adapter.sessions.stats()
+    if getattr(adapter, "conversations", None):
+        stats["conversations"] = [pool.stats() for pool in adapter.conversations.values()]
+    return stats
+
+
+@app.get("/stats")
+async def stats():
+    stats = {"http": transport.pool_stats()}
+    if isinstance(adapter, Router):
+        stats["router"] = adapter.stats()
+        stats["backends"] = {name: adapter_stats(backend.adapter) for name, backend in adapter.backends.items()}
+    else:
+        stats.update(adapter_stats(adapter))
+    if response_cache is not None:
+        stats["cache"] = response_cache.stats()
+    if single_flight is not None:
+        stats["single_flight"] = single_flight.stats()
+    stats["breakers"] = resilience.stats()
+    return JSONResponse(content=stats)
+
+
 if __name__ == "__main__":
     import uvicorn
 
-    uvicorn.run("app:app", host=HOST, port=PORT, log_level=LOG_LEVEL)
+    uvicorn.run("app:app", host=HOST, port=PORT, log_level=LOG_LEVEL, workers=WORKERS)
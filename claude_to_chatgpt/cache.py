@@ -0,0 +1,171 @@
+# -*- coding:utf-8 -*-
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from claude_to_chatgpt.logger import logger
+from claude_to_chatgpt.sse import Interrupted
+
+# request fields that change the answer
+KEY_FIELDS = ("model", "messages", "temperature", "top_p", "max_tokens", "stop", "n", "stream")
+
+
+def request_key(openai_params, scope=""):
+    # scope keeps callers with different api keys apart
+    canonical = {field: openai_params.get(field) for field in KEY_FIELDS}
+    canonical["stream"] = bool(canonical["stream"])
+    canonical["scope"] = scope
+    data = json.dumps(canonical, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def is_deterministic(openai_params):
+    # only temperature 0 requests give the same answer every time
+    temperature = openai_params.get("temperature")
+    return temperature is not None and float(temperature) == 0 and openai_params.get("n", 1) in (None, 1)
+
+
+def completed(items):
+    """True if the response ended with a finish from upstream, not one cut off by an error."""
+    finished = False
+    for item in items:
+        if isinstance(item, Interrupted):
+            return False
+        if isinstance(item, dict) and item.get("object") == "chat.completion":
+            finished = True
+    return finished
+
+
+def has_content(items):
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        for choice in item.get("choices", []):
+            if choice.get("delta", {}).get("content") or choice.get("message", {}).get("content"):
+                return True
+    return False
+
+
+class ResponseCache:
+    """
+    LRU cache of chat completion responses with a TTL and a byte budget.
+
+    A response is the list of items the adapter yielded, so cached streams are
+    replayed chunk by chunk. Entries can also be kept in a directory, which
+    survives restarts and is checked on a memory miss.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl=3600.0, directory=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.directory = directory
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def remove(self, key):
+        expires, items, size = self.entries.pop(key)
+        self.size -= size
+
+    def store(self, key, expires, items, size):
+        if key in self.entries:
+            self.remove(key)
+        if size > self.max_bytes:
+            return
+        self.entries[key] = (expires, items, size)
+        self.size += size
+        while self.size > self.max_bytes:
+            oldest = next(iter(self.entries))
+            self.remove(oldest)
+            self.evictions += 1
+
+    def read_file(self, key):
+        try:
+            with open(self.path(key), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def write_file(self, key, entry):
+        tmp_path = f"{self.path(key)}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path(key))
+        except OSError as e:
+            logger.warning(f"Failed to write response cache entry: {e}")
+
+    def delete_file(self, key):
+        try:
+            os.remove(self.path(key))
+        except OSError:
+            pass
+
+    async def get(self, key):
+        now = time.time()
+        entry = self.entries.get(key)
+        if entry is not None:
+            if entry[0] > now:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.remove(key)
+            self.expirations += 1
+
+        if self.directory:
+            loop = asyncio.get_running_loop()
+            data = await loop.run_in_executor(None, self.read_file, key)
+            if data is not None:
+                if data["expires"] > now:
+                    items = data["items"]
+                    self.store(key, data["expires"], items, len(json.dumps(items)))
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return items
+                self.expirations += 1
+                await loop.run_in_executor(None, self.delete_file, key)
+
+        self.misses += 1
+        return None
+
+    async def put(self, key, items):
+        # a partial answer would be served for the whole ttl
+        if not completed(items) or not has_content(items):
+            return
+        expires = time.time() + self.ttl
+        data = json.dumps(items)
+        self.store(key, expires, items, len(data))
+        if self.directory:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self.write_file, key, {"expires": expires, "items": items})
+
+    async def record(self, key, stream):
+        """Passes a response stream through and caches it if it completed without an upstream error."""
+        items = []
+        async for item in stream:
+            items.append(item)
+            yield item
+        await self.put(key, items)
+
+    def stats(self):
+        return {
+            "entries": len(self.entries),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
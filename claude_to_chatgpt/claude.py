@@ -1,52 +1,19 @@
 # -*- coding:utf-8 -*- 
-#import requests
+import asyncio
 import json
 import os
 import uuid
-import httpx
-import ssl
-import random
-from curl_cffi import requests
-import tls_client as requests_tls
-from requests.adapters import HTTPAdapter
-from requests.packages.urllib3.util.ssl_ import create_urllib3_context
-
-ORIGIN_CIPHERS = ('ECDH+AESGCM:DH+AESGCM:ECDH+AES256')
-
-class SSLFactory:
-    def __init__(self):
-        self.ciphers = ORIGIN_CIPHERS.split(":")
- 
-    def __call__(self) -> ssl.SSLContext:
-        random.shuffle(self.ciphers)
-        ciphers = ":".join(self.ciphers)
-        ciphers = ciphers + ":!aNULL:!eNULL:!MD5"
-        context = ssl.create_default_context()
-        context.set_ciphers(ciphers)
-        return context
- 
-class DESAdapter(HTTPAdapter):
-    def __init__(self, *args, **kwargs):
-        """
-        A TransportAdapter that re-enables 3DES support in Requests.
-        """      
-        CIPHERS = ORIGIN_CIPHERS.split(':')
-        random.shuffle(CIPHERS)
-        CIPHERS = ':'.join(CIPHERS)
-        self.CIPHERS = CIPHERS + ':!aNULL:!eNULL:!MD5'
-        print(f"{self.CIPHERS}")
-        super().__init__(*args, **kwargs)
- 
-    def init_poolmanager(self, *args, **kwargs):
-        context = create_urllib3_context(ciphers=self.CIPHERS)
-        kwargs['ssl_context'] = context
-        return super(DESAdapter, self).init_poolmanager(*args, **kwargs)
- 
-    def proxy_manager_for(self, *args, **kwargs):
-        context = create_urllib3_context(ciphers=self.CIPHERS)
-        kwargs['ssl_context'] = context
-        return super(DESAdapter, self).proxy_manager_for(*args, **kwargs)
- 
+from curl_cffi import CurlMime, requests
+from claude_to_chatgpt.logger import logger
+from claude_to_chatgpt.sse import aiter_sse
+from claude_to_chatgpt import resilience
+
+# conversations deleted at once by delete_conversations
+DELETE_CONCURRENCY = 8
+
+class RateLimitError(RuntimeError):
+  pass
+
 class Client:
   sendurl = "https://claude.ai/api/append_message"
 
@@ -65,40 +32,56 @@ class Client:
     'TE': 'trailers'
   }
 
-  def __init__(self, cookie, organization):
+  def __init__(self, cookie, organization=None, impersonate="chrome101", timeout=120, max_clients=10):
     self.cookie = cookie
-    #self.session = requests_tls.Session(client_identifier="chrome_103")
-    #self.asession = requests.AsyncSession()
-    self.session = requests.Session()
-    sslgen = SSLFactory()
-    self.client = httpx.AsyncClient(timeout=20.0, verify=sslgen())
-
-    if organization is not None:
-        self.organization_id = organization
-    else:
-        self.organization_id = self.get_organization_id()
-
-  def get_organization_id(self):
-    url = "https://claude.ai/api/organizations"
-
-    headers = {
-        'User-Agent':
-        'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:109.0) Gecko/20100101 Firefox/115.0',
-        'Accept-Language': 'en-US,en;q=0.5',
-        'Referer': 'https://claude.ai/chats',
-        'Content-Type': 'application/json',
-        'Sec-Fetch-Dest': 'empty',
-        'Sec-Fetch-Mode': 'cors',
-        'Sec-Fetch-Site': 'same-origin',
-        'Connection': 'keep-alive',
-        'Cookie': f'{self.cookie}'
-    }
-
-    response = self.session.get(url, headers=headers)
-    res = json.loads(response.text)
-    uuid = res[0]['uuid']
-
-    return uuid
+    self.impersonate = impersonate
+    self.timeout = timeout
+    # connections the session opens at once, streams and conversation calls wait for a free one
+    self.max_clients = max_clients
+    # one session for every call, created on first use in the event loop that uses it
+    self.session = None
+    # looked up on the first call that needs it, not at startup
+    self.organization_id = organization
+    self.organization_lock = None
+
+  def get_session(self):
+    if self.session is None:
+      self.session = requests.AsyncSession(impersonate=self.impersonate, timeout=self.timeout,
+                                           max_clients=self.max_clients)
+    return self.session
+
+  async def close(self):
+    if self.session is not None:
+      await self.session.close()
+      self.session = None
+
+  async def get_organization_id(self):
+    if self.organization_id is not None:
+      return self.organization_id
+    if self.organization_lock is None:
+      self.organization_lock = asyncio.Lock()
+    async with self.organization_lock:
+      if self.organization_id is None:
+        url = "https://claude.ai/api/organizations"
+
+        headers = {
+            'User-Agent':
+            'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:109.0) Gecko/20100101 Firefox/115.0',
+            'Accept-Language': 'en-US,en;q=0.5',
+            'Referer': 'https://claude.ai/chats',
+            'Content-Type': 'application/json',
+            'Sec-Fetch-Dest': 'empty',
+            'Sec-Fetch-Mode': 'cors',
+            'Sec-Fetch-Site': 'same-origin',
+            'Connection': 'keep-alive',
+            'Cookie': f'{self.cookie}'
+        }
+
+        response = await self.get_session().get(url, headers=headers)
+        res = json.loads(response.text)
+        self.organization_id = res[0]['uuid']
+
+    return self.organization_id
 
   def get_content_type(self, file_path):
     # Function to determine content type based on file extension
@@ -114,8 +97,8 @@ class Client:
       return 'application/octet-stream'
 
   # Lists all the conversations you had with Claude
-  def list_all_conversations(self):
-    url = f"https://claude.ai/api/organizations/{self.organization_id}/chat_conversations"
+  async def list_all_conversations(self):
+    url = f"https://claude.ai/api/organizations/{await self.get_organization_id()}/chat_conversations"
 
     headers = {
         'User-Agent':
@@ -130,14 +113,13 @@ class Client:
         'Cookie': f'{self.cookie}'
     }
 
-    response = self.session.get(url, headers=headers)
-    conversations = response.json()
+    response = await self.get_session().get(url, headers=headers)
 
     # Returns all conversation information in a list
     if response.status_code == 200:
-      return conversations
+      return response.json()
     else:
-      print(f"Error: {response.status_code} - {response.text}")
+      logger.error(f"Failed to list claude.ai conversations: {response.status_code} - {response.text}")
 
   # Send Message to Claude
   async def send_message(self, prompt, conversation_id, attachment=None):
@@ -145,11 +127,11 @@ class Client:
     # Upload attachment if provided
     attachments = []
     if attachment:
-      attachment_response = self.upload_attachment(attachment)
+      attachment_response = await self.upload_attachment(attachment)
       if attachment_response:
         attachments = [attachment_response]
       else:
-        yield {"Error: Invalid file format. Please try again."}
+        raise RuntimeError("Invalid file format. Please try again.")
 
     # Ensure attachments is an empty list when no attachment is provided
     if not attachment:
@@ -161,55 +143,41 @@ class Client:
         "timezone": "Asia/Shanghai",
         "model": "claude-2"
       },
-      "organization_uuid": f"{self.organization_id}",
+      "organization_uuid": f"{await self.get_organization_id()}",
       "conversation_uuid": f"{conversation_id}",
       "text": f"{prompt}",
       "attachments": attachments
     })
-    self.headers['Cookie']= self.cookie
-
-    # Stop streaming by returning None
-    # async with self.client.stream("POST", self.sendurl, headers = self.headers, data=payload) as resp:
-    #     print(resp)
-    #     async for chunk in resp.aiter_lines():
-    #         yield chunk
- 
-    # se = requests_tls.Session(client_identifier='chrome_103')
-    # response = se.post(self.sendurl, headers=self.headers, data=payload)
-    # print(f"code: {response.status_code}")
-
-    # for i in range(20):
-    #   self.session.mount('', DESAdapter())
-    #   response = self.session.post(self.sendurl, headers=self.headers, data=payload, stream=True)
-    #   print(f"code: {response.content}")
-    #   if response.status_code // 100 == 2 :
-    #     return response
-    # return response
-
-    content = []
-
-    async with requests.AsyncSession() as s:
-        await s.post(self.sendurl, headers=self.headers, data=payload, impersonate="chrome101",
-                        content_callback=lambda chunk: self.chunk_callback(chunk, content),
-                        timeout=120)
-    yield content
-    #print("".join(response_content))
-
-  def chunk_callback(self, chunk, content, *args, **kwargs):
-      #print(chunk)
-      njsondata = chunk.decode("utf-8").split('\n\n')
-      for line in njsondata:
-          if line.startswith('data:'):
-            json_obj = json.loads(line[6:])
-            completion = json_obj.get('completion')
-            if completion is None:
-                continue
-            content.append(completion)
+    headers = {**self.headers, 'Cookie': self.cookie}
+
+    async def connect():
+      response = await self.get_session().post(self.sendurl, headers=headers, data=payload, stream=True)
+      if response.status_code >= 500:
+        await response.aclose()
+        raise resilience.UpstreamError(f"claude.ai returned status {response.status_code}")
+      return response
+
+    # only connecting is retried, once completions are yielded the request can't be replayed
+    response = await resilience.call("claude.ai", connect, retry_on=(resilience.UpstreamError, OSError))
+    # completions are yielded as the SSE events arrive, the next network chunk is
+    # only read once the consumer asks for more
+    try:
+      if response.status_code == 429:
+        raise RateLimitError("claude.ai rate limit reached.")
+      if response.status_code != 200:
+        raise RuntimeError(f"claude.ai returned status {response.status_code}")
+      async for data in aiter_sse(response.aiter_content()):
+        json_obj = json.loads(data)
+        completion = json_obj.get('completion')
+        if completion is None:
+          continue
+        yield completion
+    finally:
+      await response.aclose()
 
-      
   # Deletes the conversation
-  def delete_conversation(self, conversation_id):
-    url = f"https://claude.ai/api/organizations/{self.organization_id}/chat_conversations/{conversation_id}"
+  async def delete_conversation(self, conversation_id):
+    url = f"https://claude.ai/api/organizations/{await self.get_organization_id()}/chat_conversations/{conversation_id}"
 
     payload = json.dumps(f"{conversation_id}")
     headers = {
@@ -228,7 +196,7 @@ class Client:
         'TE': 'trailers'
     }
 
-    response = requests.request("DELETE", url, headers=headers, data=payload, impersonate="chrome112")
+    response = await self.get_session().delete(url, headers=headers, data=payload)
 
     # Returns True if deleted or False if any error in deleting
     if response.status_code == 204:
@@ -236,9 +204,33 @@ class Client:
     else:
       return False
 
+  # Deletes several conversations at once, returns the ids that were deleted
+  async def delete_conversations(self, conversation_ids, concurrency=DELETE_CONCURRENCY):
+    headers = {
+        'User-Agent':
+        'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:109.0) Gecko/20100101 Firefox/115.0',
+        'Accept-Language': 'en-US,en;q=0.5',
+        'Content-Type': 'application/json',
+        'Referer': 'https://claude.ai/chats',
+        'Origin': 'https://claude.ai',
+        'Cookie': f'{self.cookie}',
+    }
+    organization_id = await self.get_organization_id()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def delete(conversation_id):
+      url = f"https://claude.ai/api/organizations/{organization_id}/chat_conversations/{conversation_id}"
+      async with semaphore:
+        response = await self.get_session().delete(url, headers=headers, data=json.dumps(conversation_id))
+      return response.status_code == 204
+
+    results = await asyncio.gather(*(delete(conversation_id) for conversation_id in conversation_ids),
+                                   return_exceptions=True)
+    return [conversation_id for conversation_id, deleted in zip(conversation_ids, results) if deleted is True]
+
   # Returns all the messages in conversation
-  def chat_conversation_history(self, conversation_id):
-    url = f"https://claude.ai/api/organizations/{self.organization_id}/chat_conversations/{conversation_id}"
+  async def chat_conversation_history(self, conversation_id):
+    url = f"https://claude.ai/api/organizations/{await self.get_organization_id()}/chat_conversations/{conversation_id}"
 
     headers = {
         'User-Agent':
@@ -253,8 +245,7 @@ class Client:
         'Cookie': f'{self.cookie}'
     }
 
-    response = requests.request("GET", url, headers=headers, impersonate="chrome112")
-    print(type(response))
+    response = await self.get_session().get(url, headers=headers)
 
     # List all the conversations in JSON
     return response.json()
@@ -265,8 +256,8 @@ class Client:
     formatted_uuid = f"{random_uuid_str[0:8]}-{random_uuid_str[9:13]}-{random_uuid_str[14:18]}-{random_uuid_str[19:23]}-{random_uuid_str[24:]}"
     return formatted_uuid
 
-  def create_new_chat(self):
-    url = f"https://claude.ai/api/organizations/{self.organization_id}/chat_conversations"
+  async def create_new_chat(self):
+    url = f"https://claude.ai/api/organizations/{await self.get_organization_id()}/chat_conversations"
     uuid = self.generate_uuid()
 
     payload = json.dumps({"uuid": uuid, "name": ""})
@@ -286,22 +277,26 @@ class Client:
         'TE': 'trailers'
     }
 
-    response = requests.request("POST", url, headers=headers, data=payload, impersonate="chrome112")
+    response = await self.get_session().post(url, headers=headers, data=payload)
+    if response.status_code == 429:
+      raise RateLimitError("claude.ai rate limit reached.")
+    if not 200 <= response.status_code < 300:
+      raise RuntimeError(f"claude.ai returned status {response.status_code} creating a conversation")
 
     # Returns JSON of the newly created conversation information
     return response.json()
 
   # Resets all the conversations
-  def reset_all(self):
-    conversations = self.list_all_conversations()
-
-    for conversation in conversations:
-      conversation_id = conversation['uuid']
-      delete_id = self.delete_conversation(conversation_id)
+  async def reset_all(self):
+    conversations = await self.list_all_conversations()
+    if conversations is None:
+      return False
+    conversation_ids = [conversation['uuid'] for conversation in conversations]
+    await self.delete_conversations(conversation_ids)
 
     return True
 
-  def upload_attachment(self, file_path):
+  async def upload_attachment(self, file_path):
     url = 'https://claude.ai/api/convert_document'
     headers = {
         'User-Agent':
@@ -320,12 +315,14 @@ class Client:
     file_name = os.path.basename(file_path)
     content_type = self.get_content_type(file_path)
 
-    files = {
-        'file': (file_name, open(file_path, 'rb'), content_type),
-        'orgUuid': (None, self.organization_id)
-    }
+    multipart = CurlMime()
+    multipart.addpart(name='file', content_type=content_type, filename=file_name, local_path=file_path)
+    multipart.addpart(name='orgUuid', data=(await self.get_organization_id()).encode())
 
-    response = requests.post(url, headers=headers, files=files, impersonate="chrome112")
+    try:
+      response = await self.get_session().post(url, headers=headers, multipart=multipart)
+    finally:
+      multipart.close()
     if response.status_code == 200:
       return response.json()
     else:
@@ -334,11 +331,11 @@ class Client:
 
     
   # Renames the chat conversation title
-  def rename_chat(self, title, conversation_id):
+  async def rename_chat(self, title, conversation_id):
     url = "https://claude.ai/api/rename_chat"
 
     payload = json.dumps({
-        "organization_uuid": f"{self.organization_id}",
+        "organization_uuid": f"{await self.get_organization_id()}",
         "conversation_uuid": f"{conversation_id}",
         "title": f"{title}"
     })
@@ -357,7 +354,7 @@ class Client:
         'TE': 'trailers'
     }
 
-    response = requests.request("POST", url, headers=headers, data=payload, impersonate="chrome112")
+    response = await self.get_session().post(url, headers=headers, data=payload)
 
     if response.status_code == 200:
       return True
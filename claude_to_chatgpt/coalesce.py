@@ -0,0 +1,83 @@
+# -*- coding:utf-8 -*-
+import asyncio
+import time
+from claude_to_chatgpt.sse import Chunk
+
+
+def merge(chunks):
+    """One chunk with the content of all, and the usage of the last one."""
+    last = chunks[-1]
+    if len(chunks) == 1:
+        return last
+    content = "".join(chunk["choices"][0]["delta"]["content"] for chunk in chunks)
+    choice = last["choices"][0]
+    merged = Chunk(last)
+    merged["choices"] = [dict(choice, delta=dict(choice["delta"], content=content))]
+    return merged
+
+
+def mergeable(item):
+    return type(item) is Chunk and type(item["choices"][0]["delta"]["content"]) is str
+
+
+async def coalesce(stream, window=0.03, max_bytes=4096):
+    """
+    Merges the deltas of a response stream before they are sent.
+
+    Consecutive chunks are held for up to `window` seconds after the first of
+    them arrived, or until their content reaches `max_bytes`, and are then sent
+    as one chunk. Any other item flushes what is held and is passed on as is.
+    """
+    held = []
+    size = 0
+    deadline = None
+    pending = None
+    iterator = stream.__aiter__()
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            done, _ = await asyncio.wait((pending,), timeout=timeout)
+            if not done:
+                # the window is over and upstream is quiet, send what we have
+                yield merge(held)
+                held, size, deadline = [], 0, None
+                continue
+
+            task, pending = pending, None
+            try:
+                item = task.result()
+            except StopAsyncIteration:
+                break
+            except Exception:
+                if held:
+                    yield merge(held)
+                raise
+
+            if mergeable(item):
+                held.append(item)
+                size += len(item["choices"][0]["delta"]["content"].encode("utf-8"))
+                if deadline is None:
+                    deadline = time.monotonic() + window
+                if size >= max_bytes:
+                    yield merge(held)
+                    held, size, deadline = [], 0, None
+                continue
+
+            if held:
+                yield merge(held)
+                held, size, deadline = [], 0, None
+            yield item
+
+        if held:
+            yield merge(held)
+    finally:
+        if pending is not None and not pending.done():
+            pending.cancel()
+            try:
+                await pending
+            except (asyncio.CancelledError, Exception):
+                pass
+        if hasattr(iterator, "aclose"):
+            await iterator.aclose()
@@ -0,0 +1,125 @@
+# -*- coding:utf-8 -*-
+import asyncio
+from collections import deque
+from claude_to_chatgpt.logger import logger
+
+
+class ConversationPool:
+    """
+    claude.ai conversations of one account, created before the requests that need them.
+
+    lease() hands out a warm conversation, or creates one if none is left. A
+    conversation is used by one request or one session at a time, so requests
+    of an account run in parallel instead of queueing on a single conversation.
+    retire() queues a conversation for deletion. A background task tops the
+    warm conversations up after each lease and deletes the retired ones in
+    batches, every gc_interval seconds or as soon as gc_batch are waiting.
+    """
+
+    def __init__(self, client, size=2, gc_interval=30.0, gc_batch=50):
+        self.client = client
+        self.size = size
+        self.gc_interval = gc_interval
+        self.gc_batch = gc_batch
+        self.warm = deque()
+        self.leased = set()
+        self.retired = []
+        self.task = None
+        self.wakeup = None
+        self.created = 0
+        self.deleted = 0
+        self.leases = 0
+        self.cold_leases = 0
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.wakeup = asyncio.Event()
+            self.task = asyncio.create_task(self.run())
+
+    async def create(self):
+        conversation = await self.client.create_new_chat()
+        self.created += 1
+        return conversation["uuid"]
+
+    async def lease(self):
+        self.start()
+        self.leases += 1
+        if self.warm:
+            conversation_id = self.warm.popleft()
+        else:
+            self.cold_leases += 1
+            conversation_id = await self.create()
+        self.leased.add(conversation_id)
+        # refill in the background
+        self.wakeup.set()
+        return conversation_id
+
+    def retire(self, conversation_id):
+        self.leased.discard(conversation_id)
+        self.retired.append(conversation_id)
+        if len(self.retired) >= self.gc_batch and self.wakeup is not None:
+            self.wakeup.set()
+
+    async def run(self):
+        while True:
+            try:
+                await self.refill()
+                await self.collect()
+            except Exception as e:
+                logger.warning(f"claude.ai conversation pool maintenance failed: {e}")
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.gc_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+
+    async def refill(self):
+        missing = self.size - len(self.warm)
+        if missing <= 0:
+            return
+        created = await asyncio.gather(*(self.create() for _ in range(missing)), return_exceptions=True)
+        for conversation_id in created:
+            if isinstance(conversation_id, Exception):
+                logger.warning(f"Failed to create a claude.ai conversation: {conversation_id}")
+            else:
+                self.warm.append(conversation_id)
+
+    async def collect(self):
+        batch = self.retired[:self.gc_batch]
+        if not batch:
+            return
+        del self.retired[:len(batch)]
+        deleted = await self.client.delete_conversations(batch)
+        self.deleted += len(deleted)
+        if len(deleted) < len(batch):
+            logger.warning(f"Failed to delete {len(batch) - len(deleted)} claude.ai conversations")
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        # sessions live in memory, so leased conversations are not continued after shutdown either
+        self.retired.extend(self.warm)
+        self.retired.extend(self.leased)
+        self.warm.clear()
+        self.leased.clear()
+        while self.retired:
+            try:
+                await self.collect()
+            except Exception as e:
+                logger.warning(f"Failed to delete claude.ai conversations on shutdown: {e}")
+
+    def stats(self):
+        return {
+            "warm": len(self.warm),
+            "leased": len(self.leased),
+            "retired": len(self.retired),
+            "created": self.created,
+            "deleted": self.deleted,
+            "leases": self.leases,
+            "cold_leases": self.cold_leases,
+        }
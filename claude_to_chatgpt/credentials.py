@@ -0,0 +1,244 @@
+# -*- coding:utf-8 -*-
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from claude_to_chatgpt.logger import logger
+from claude_to_chatgpt.shared import key_of
+
+
+def split_credentials(value, separator=","):
+    if not value:
+        return []
+    return [item.strip() for item in value.split(separator) if item.strip()]
+
+
+def retry_after(headers):
+    """Seconds from a Retry-After header, None if missing or not a number."""
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def mask(secret):
+    return f"{secret[:6]}..." if len(secret) > 10 else "***"
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        """Seconds until a token is available, 0 if one is available now."""
+        self.refill(now)
+        if self.tokens >= 1 or self.rate <= 0:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self.refill(now)
+        self.tokens -= 1
+
+
+class Credential:
+    """
+    One upstream account: an API key, a Poe token or a claude.ai cookie.
+
+    max_concurrency and rate are off when None, then the account takes any
+    number of requests and only its cooldowns hold requests back. burst
+    defaults to one second's worth of requests.
+    """
+
+    def __init__(self, value, client=None, max_concurrency=None, rate=None, burst=None, **extra):
+        self.value = value
+        self.name = mask(value)
+        self.key = key_of(value)
+        # backend client bound to this account, if the backend needs one
+        self.client = client
+        self.extra = extra
+        self.max_concurrency = max_concurrency
+        self.bucket = TokenBucket(rate, burst or max(1.0, rate)) if rate else None
+        self.in_flight = 0
+        self.cooldown_until = 0.0
+        self.requests = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.busy_seconds = 0.0
+        self.busy_since = None
+
+    def wait_time(self, now):
+        if now < self.cooldown_until:
+            return self.cooldown_until - now
+        if self.max_concurrency is not None and self.in_flight >= self.max_concurrency:
+            return None
+        return self.bucket.wait_time(now) if self.bucket is not None else 0.0
+
+    def start(self, now):
+        if self.bucket is not None:
+            self.bucket.take(now)
+        if self.in_flight == 0:
+            self.busy_since = now
+        self.in_flight += 1
+        self.requests += 1
+
+    def finish(self, now):
+        self.in_flight -= 1
+        if self.in_flight == 0 and self.busy_since is not None:
+            self.busy_seconds += now - self.busy_since
+            self.busy_since = None
+
+
+class CredentialPool:
+    """
+    Schedules requests across several credentials of one backend.
+
+    Requests go to the least loaded credential. Each credential can also have
+    a concurrency limit and a token bucket, both off unless configured.
+    Credentials reported as rate limited are skipped until their cooldown
+    expires. With several workers, cooldowns go through a SharedState so
+    every worker skips the credential. Its files are read and written in a
+    thread, requests are scheduled meanwhile with the cooldowns read last.
+    """
+
+    def __init__(self, credentials, cooldown=60.0, acquire_timeout=30.0, shared=None, sync_interval=1.0):
+        if not credentials:
+            raise ValueError("A credential pool needs at least one credential.")
+        self.credentials = credentials
+        self.cooldown_seconds = cooldown
+        self.acquire_timeout = acquire_timeout
+        self.shared = shared
+        self.sync_interval = sync_interval
+        self.synced = 0.0
+        self.created = time.monotonic()
+        self.condition = None
+        # SharedState reads and writes running in a thread
+        self.background = set()
+
+    def __len__(self):
+        return len(self.credentials)
+
+    def in_background(self, awaitable):
+        task = asyncio.ensure_future(awaitable)
+        self.background.add(task)
+        task.add_done_callback(self.background_done)
+
+    def background_done(self, task):
+        self.background.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"Failed to share credential cooldowns: {task.exception()}")
+
+    def sync(self, now):
+        """Starts picking up cooldowns set by other workers, at most every sync_interval seconds."""
+        if self.shared is None or now - self.synced < self.sync_interval:
+            return
+        self.synced = now
+        self.in_background(self.load_cooldowns())
+
+    async def load_cooldowns(self):
+        cooldowns = await asyncio.get_running_loop().run_in_executor(None, self.shared.cooldowns)
+        now = time.monotonic()
+        wall = time.time()
+        for credential in self.credentials:
+            until = cooldowns.get(credential.key)
+            if until is not None and until > wall:
+                credential.cooldown_until = max(credential.cooldown_until, now + until - wall)
+
+    def pick(self, now, prefer=None, available=None):
+        """Returns (credential, 0) if one can be used now, else (None, seconds to wait)."""
+        best = None
+        wait = None
+        for credential in self.credentials:
+            if available is not None and not available(credential):
+                continue
+            delay = credential.wait_time(now)
+            if delay is None:
+                continue
+            if delay > 0:
+                wait = delay if wait is None else min(wait, delay)
+                continue
+            if credential.key == prefer:
+                return credential, 0.0
+            # least loaded first, ties go to the least used credential
+            load = (credential.in_flight / (credential.max_concurrency or 1), credential.requests)
+            if best is None or load < best[0]:
+                best = (load, credential)
+        if best is not None:
+            return best[1], 0.0
+        return None, wait
+
+    @asynccontextmanager
+    async def acquire(self, prefer=None, available=None):
+        """
+        Waits for a credential and holds it while the block runs. The one with
+        the key `prefer` is taken if it can be used now, as when it holds the
+        upstream conversation of a chat. Credentials for which `available`
+        returns False are skipped until another request releases one, as when
+        the account's chat with a bot is busy.
+        """
+        if self.condition is None:
+            self.condition = asyncio.Condition()
+
+        deadline = time.monotonic() + self.acquire_timeout
+        async with self.condition:
+            while True:
+                now = time.monotonic()
+                self.sync(now)
+                credential, wait = self.pick(now, prefer, available)
+                if credential is not None:
+                    credential.start(now)
+                    break
+                remaining = deadline - now
+                if remaining <= 0:
+                    raise RuntimeError("No upstream credential available, all are busy or rate limited.")
+                # woken early when another request releases its credential
+                timeout = remaining if wait is None else min(wait, remaining)
+                try:
+                    await asyncio.wait_for(self.condition.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+
+        try:
+            yield credential
+        except Exception:
+            credential.errors += 1
+            raise
+        finally:
+            credential.finish(time.monotonic())
+            async with self.condition:
+                self.condition.notify_all()
+
+    def cooldown(self, credential, seconds=None):
+        seconds = self.cooldown_seconds if seconds is None else seconds
+        credential.rate_limited += 1
+        credential.cooldown_until = max(credential.cooldown_until, time.monotonic() + seconds)
+        if self.shared is not None:
+            self.in_background(asyncio.get_running_loop().run_in_executor(
+                None, self.shared.set_cooldown, credential.key, time.time() + seconds))
+        logger.warning(f"Credential {credential.name} is rate limited, cooling down for {seconds:.0f}s")
+
+    def stats(self):
+        now = time.monotonic()
+        elapsed = max(now - self.created, 1e-9)
+        stats = []
+        for credential in self.credentials:
+            busy = credential.busy_seconds
+            if credential.busy_since is not None:
+                busy += now - credential.busy_since
+            stats.append({
+                "name": credential.name,
+                "in_flight": credential.in_flight,
+                "max_concurrency": credential.max_concurrency,
+                "requests": credential.requests,
+                "errors": credential.errors,
+                "rate_limited": credential.rate_limited,
+                "cooldown_remaining": round(max(0.0, credential.cooldown_until - now), 1),
+                "utilization": round(busy / elapsed, 4),
+            })
+        return stats
@@ -0,0 +1,167 @@
+# -*- coding:utf-8 -*-
+import time
+from claude_to_chatgpt.models import model_map, models_list
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+RATE_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+# the model label comes from the client, keep its values bounded
+KNOWN_MODELS = set(model_map) | {model["id"] for model in models_list}
+
+
+def model_label(model):
+    return model if model in KNOWN_MODELS else "other"
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def format_labels(names, values, extra=""):
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name, documentation, labelnames=("adapter", "model")):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.values = {}
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        lines = self.header()
+        for labels, value in self.values.items():
+            lines.append(f"{self.name}{format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) - amount
+
+    def set(self, labels, value):
+        self.values[labels] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, buckets=LATENCY_BUCKETS, labelnames=("adapter", "model")):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = buckets
+
+    def observe(self, labels, value):
+        series = self.values.get(labels)
+        if series is None:
+            # per bucket counts, then sum and count
+            series = self.values[labels] = [0] * len(self.buckets) + [0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+                break
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self):
+        lines = self.header()
+        for labels, series in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = format_labels(self.labelnames, labels, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            le = format_labels(self.labelnames, labels, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{le} {series[-1]}")
+            lines.append(f"{self.name}_sum{format_labels(self.labelnames, labels)} {series[-2]}")
+            lines.append(f"{self.name}_count{format_labels(self.labelnames, labels)} {series[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.register(Counter("chat_requests_total", "Chat completion requests sent to an adapter."))
+UPSTREAM_ERRORS = REGISTRY.register(Counter("chat_upstream_errors_total", "Chat completion requests that failed upstream."))
+IN_FLIGHT = REGISTRY.register(Gauge("chat_streams_in_flight", "Chat completion streams currently open."))
+CHUNKS = REGISTRY.register(Counter("chat_chunks_total", "Chunks produced by adapters."))
+TOKENS = REGISTRY.register(Counter("chat_completion_tokens_total", "Completion tokens produced by adapters."))
+TIME_TO_FIRST_TOKEN = REGISTRY.register(Histogram("chat_time_to_first_token_seconds", "Time from request to the first chunk."))
+DURATION = REGISTRY.register(Histogram("chat_request_duration_seconds", "Time from request to the last chunk."))
+CHUNK_RATE = REGISTRY.register(Histogram("chat_chunks_per_second", "Chunks per second of each stream.", RATE_BUCKETS))
+TOKEN_RATE = REGISTRY.register(Histogram("chat_tokens_per_second", "Completion tokens per second of each stream.", RATE_BUCKETS))
+BREAKER_STATE = REGISTRY.register(Gauge(
+    "upstream_circuit_breaker_state", "Circuit breaker state: 0 closed, 1 half open, 2 open.", ("upstream",)))
+BREAKER_TRANSITIONS = REGISTRY.register(Counter(
+    "upstream_circuit_breaker_transitions_total", "Circuit breaker state changes.", ("upstream", "state")))
+RETRIES = REGISTRY.register(Counter("upstream_retries_total", "Upstream calls retried.", ("upstream",)))
+RETRIES_DENIED = REGISTRY.register(Counter(
+    "upstream_retries_denied_total", "Upstream retries skipped because the retry budget was exhausted.", ("upstream",)))
+
+
+def record_upstream_error(adapter, model):
+    UPSTREAM_ERRORS.inc((adapter, model_label(model)))
+
+
+async def instrument(stream, adapter, model):
+    """Wraps an adapter's chat() stream; per chunk work is kept to a few local updates."""
+    labels = (adapter, model_label(model))
+    REQUESTS.inc(labels)
+    IN_FLIGHT.inc(labels)
+    start = time.perf_counter()
+    first = None
+    chunks = 0
+    tokens = 0
+    try:
+        async for item in stream:
+            if first is None:
+                first = time.perf_counter()
+                TIME_TO_FIRST_TOKEN.observe(labels, first - start)
+            chunks += 1
+            if isinstance(item, dict):
+                usage = item.get("usage")
+                if usage:
+                    tokens = usage.get("completion_tokens", tokens)
+            yield item
+    except Exception:
+        UPSTREAM_ERRORS.inc(labels)
+        raise
+    finally:
+        end = time.perf_counter()
+        IN_FLIGHT.dec(labels)
+        DURATION.observe(labels, end - start)
+        CHUNKS.inc(labels, chunks)
+        TOKENS.inc(labels, tokens)
+        if first is not None and end > first:
+            CHUNK_RATE.observe(labels, chunks / (end - first))
+            TOKEN_RATE.observe(labels, tokens / (end - first))
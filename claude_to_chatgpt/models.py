@@ -103,3 +103,11 @@ model_map = {
     "gpt-4": "claude-v1.3-100k",
     "gpt-4-0314": "claude-v1.3-100k",
 }
+
+# models of the messages api, names starting with "claude-" are sent as is
+messages_model_map = {
+    "gpt-3.5-turbo": "claude-3-haiku-20240307",
+    "gpt-3.5-turbo-0301": "claude-3-haiku-20240307",
+    "gpt-4": "claude-3-opus-20240229",
+    "gpt-4-0314": "claude-3-opus-20240229",
+}
@@ -1,4 +1,7 @@
 import re, json, random, logging, time, queue, threading, traceback, hashlib, string, random, os
+import asyncio
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 import quickjs
 import httpx
 import secrets
@@ -7,6 +10,8 @@ import uuid
 import random
 from pathlib import Path
 from urllib.parse import urlparse
+from claude_to_chatgpt.shared import file_lock
+from claude_to_chatgpt import resilience
 
 parent_path = Path(__file__).resolve().parent
 queries_path = parent_path / "poe_graphql" / "queries.json"
@@ -35,6 +40,21 @@ except FileNotFoundError:
   logger.error("GraphQL queries file not found.")
   queries = {}
 
+# handles of bots known by their codename, their page is downloaded directly instead of searching all bots
+bot_handles = {
+  "capybara": "Assistant",
+  "beaver": "GPT-4",
+  "vizcacha": "GPT-4-32k",
+  "chinchilla": "ChatGPT",
+  "agouti": "ChatGPT-16k",
+  "a2": "Claude-instant",
+  "a2_100k": "Claude-instant-100k",
+  "a2_2": "Claude-2-100k",
+}
+
+class RateLimitError(RuntimeError):
+  pass
+
 def generate_payload(query_name, variables):
   if query_name == "recv":
     return generate_recv_payload(variables)
@@ -68,19 +88,32 @@ def generate_recv_payload(variables):
 
   return payload
 
+# connection errors of the http libraries poe.Client can use
+TRANSIENT_ERRORS = (resilience.UpstreamError, httpx.TransportError, OSError)
+
+def check_status(r, url):
+  if r.status_code == 200:
+    return r
+  if r.status_code == 307 and r.headers.get("Location", "").startswith("/login"):
+    raise RuntimeError("Invalid or missing token.")
+  if r.status_code >= 500 or r.status_code == 429:
+    raise resilience.UpstreamError(f"Server returned a status code of {r.status_code} while downloading {url}.")
+  raise RuntimeError(f"Server returned a status code of {r.status_code} while downloading {url}.")
+
 def request_with_retries(method, *args, **kwargs):
-  attempts = kwargs.get("attempts") or 10
+  attempts = kwargs.pop("attempts", None)
   url = args[0]
-  for i in range(attempts):
-    r = method(*args, **kwargs)
-    if r.status_code == 200:
-      return r
-    if r.status_code == 307:
-      if r.headers.get("Location").startswith("/login"):
-        raise RuntimeError("Invalid or missing token.")
-    logger.warn(f"Server returned a status code of {r.status_code} while downloading {url}. Retrying ({i+1}/{attempts})...")
+  return resilience.call_sync(
+    "poe", lambda: check_status(method(*args, **kwargs), url), retry_on=TRANSIENT_ERRORS, max_attempts=attempts)
 
-  raise RuntimeError(f"Failed to download {url} too many times.")
+async def async_request_with_retries(method, *args, **kwargs):
+  attempts = kwargs.pop("attempts", None)
+  url = args[0]
+
+  async def attempt():
+    return check_status(await method(*args, **kwargs), url)
+
+  return await resilience.call("poe", attempt, retry_on=TRANSIENT_ERRORS, max_attempts=attempts)
 
 def generate_nonce(length:int=16):
   return "".join(secrets.choice(string.ascii_letters + string.digits) for i in range(length))
@@ -120,16 +153,169 @@ def get_saved_device_id(user_id):
 
   return device_id
 
+def parse_next_data(html):
+  json_regex = r'<script id="__NEXT_DATA__" type="application\/json">(.+?)</script>'
+  json_text = re.search(json_regex, html).group(1)
+  return json.loads(json_text)
+
+def get_viewer(next_data):
+  if "payload" in next_data["props"]["pageProps"]:
+    return next_data["props"]["pageProps"]["payload"]["viewer"]
+  return next_data["props"]["pageProps"]["data"]["viewer"]
+
+def valid_next_data(value):
+  try:
+    return bool(value["buildId"]) and bool(get_viewer(value)["poeUser"]["id"])
+  except (KeyError, TypeError):
+    return False
+
+def valid_formkey(value):
+  return isinstance(value, list) and len(value) == 2 and isinstance(value[0], str) and bool(value[0])
+
+def valid_bots(value):
+  return isinstance(value, dict) and bool(value) and all(
+    isinstance(bot, dict) and "defaultBotObject" in bot for bot in value.values())
+
+class BootstrapCache:
+  """
+  Session bootstrap data of one token kept on disk between runs, next to device_id.json.
+
+  Every artifact has its own TTL. An artifact past half its TTL is still used
+  and refreshed in the background; an expired or invalid one is downloaded
+  again before use. The websocket channel is not cached: it belongs to one
+  process, and a stale minSeq would replay old updates.
+  """
+  ttls = {
+    "next_data": 3600,
+    "formkey": 6 * 3600,
+    "bots": 24 * 3600,
+  }
+  validators = {
+    "next_data": valid_next_data,
+    "formkey": valid_formkey,
+    "bots": valid_bots,
+  }
+
+  def __init__(self, token, ttls=None):
+    token_key = hashlib.sha256(token.encode()).hexdigest()[:16]
+    self.path = get_config_path() / "bootstrap" / f"{token_key}.json"
+    self.ttls = {**self.ttls, **(ttls or {})}
+    self.lock = threading.Lock()
+    self.entries = {}
+    self.reload()
+
+  def reload(self):
+    try:
+      entries = json.loads(self.path.read_text())
+    except (OSError, ValueError):
+      entries = {}
+    self.entries = entries if isinstance(entries, dict) else {}
+
+  def age(self, name):
+    entry = self.entries.get(name)
+    if not isinstance(entry, dict) or not isinstance(entry.get("saved"), (int, float)):
+      return None
+    return time.time() - entry["saved"]
+
+  def get(self, name):
+    age = self.age(name)
+    if age is None or age > self.ttls[name]:
+      return None
+    value = self.entries[name].get("value")
+    if not self.validators[name](value):
+      logger.warn(f"Ignoring invalid cached {name} in {self.path}")
+      return None
+    return value
+
+  def is_stale(self, name):
+    age = self.age(name)
+    return age is None or age > self.ttls[name] / 2
+
+  def put(self, name, value):
+    with self.lock:
+      self.entries[name] = {"saved": time.time(), "value": value}
+      try:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps(self.entries))
+        os.replace(tmp_path, self.path)
+      except OSError as e:
+        logger.warn(f"Failed to write bootstrap cache {self.path}: {e}")
+
+class BotCache:
+  """LRU of bot chat data by codename, entries expire ttl seconds after they were stored."""
+
+  def __init__(self, max_size=64, ttl=3600):
+    self.max_size = max_size
+    self.ttl = ttl
+    self.entries = OrderedDict()
+    self.lock = threading.Lock()
+
+  def get(self, codename, default=None):
+    with self.lock:
+      entry = self.entries.get(codename)
+      if entry is None:
+        return default
+      if entry[0] < time.time():
+        del self.entries[codename]
+        return default
+      self.entries.move_to_end(codename)
+      return entry[1]
+
+  def put(self, codename, chat_data):
+    with self.lock:
+      self.entries[codename] = (time.time() + self.ttl, chat_data)
+      self.entries.move_to_end(codename)
+      while len(self.entries) > self.max_size:
+        self.entries.popitem(last=False)
+
+  def discard(self, codename):
+    with self.lock:
+      self.entries.pop(codename, None)
+
+  def __contains__(self, codename):
+    return self.get(codename) is not None
+
+  def __getitem__(self, codename):
+    chat_data = self.get(codename)
+    if chat_data is None:
+      raise KeyError(codename)
+    return chat_data
+
+  def __iter__(self):
+    return iter(self.to_dict())
+
+  def __len__(self):
+    return len(self.to_dict())
+
+  def to_dict(self):
+    now = time.time()
+    with self.lock:
+      return {codename: entry[1] for codename, entry in self.entries.items() if entry[0] >= now}
+
 class Client:
   gql_url = "https://poe.com/api/gql_POST"
   gql_recv_url = "https://poe.com/api/receive_POST"
   home_url = "https://poe.com"
   settings_url = "https://poe.com/api/settings"
 
-  def __init__(self, token, proxy=None, headers=headers, device_id=None, client_identifier=client_identifier, formkey=None):
-    self.ws_connecting = False
+  def __init__(self, token, proxy=None, headers=headers, device_id=None, client_identifier=client_identifier, formkey=None, shared=None,
+               bootstrap_cache=True, bots=None, bot_cache_size=64, bot_ttl=3600, bot_workers=8,
+               ping_interval=20, ping_timeout=10, backoff_min=0.5, backoff_max=30):
+    # websocket state, changes are announced on ws_cond, see ws_run_thread()
+    self.ws = None
+    self.ws_thread = None
     self.ws_connected = False
-    self.ws_error = False
+    self.ws_opened_at = None
+    self.ws_cond = threading.Condition()
+    self.ws_stop = threading.Event()
+    self.ping_interval = ping_interval
+    self.ping_timeout = ping_timeout
+    self.backoff_min = backoff_min
+    self.backoff_max = backoff_max
+    # updates are replayed from here after a reconnect to the same channel
+    self.min_seq = None
+    self.channel = None
     self.connect_count = 0
     self.setup_count = 0
 
@@ -141,6 +327,8 @@ class Client:
     self.active_messages = {}
     self.message_queues = {}
     self.suggestion_callbacks = {}
+    # notified whenever active_messages changes
+    self.message_cond = threading.Condition()
 
     self.headers = {**headers, **{
       "Cache-Control": "no-cache",
@@ -151,6 +339,17 @@ class Client:
     }}
     self.formkey_salt = None
     self.formkey = formkey
+    self.formkey_given = formkey is not None
+    # SharedState of a multi worker deployment, see bootstrap()
+    self.shared = shared
+    self.cache = BootstrapCache(token) if bootstrap_cache else None
+    self.refreshing = False
+    # bots are fetched when first used, only the codenames in prefetch_bots at startup
+    self.prefetch_bots = list(bots or [])
+    self.bots = BotCache(bot_cache_size, bot_ttl)
+    self.bot_names = {}
+    self.bot_workers = bot_workers
+    self.bot_locks = {}
 
     self.connect_ws()
 
@@ -177,30 +376,141 @@ class Client:
     self.session.headers.update(self.headers)
 
   def setup_connection(self):
+    first_setup = self.setup_count == 0
     if self.setup_count % 5 == 0:
       self.setup_session()
 
     self.setup_count += 1
 
     self.ws_domain = f"tch{random.randint(1, 1e6)}"
-    self.next_data = self.get_next_data(overwrite_vars=True)
-    self.channel = self.get_channel_data()
+    if self.shared is not None and first_setup:
+      # the first worker downloads everything, the others only need their own channel
+      token_key = hashlib.sha256(self.token.encode()).hexdigest()[:16]
+      # shared as long as the shortest lived artifact in it is fresh
+      ttl = min((self.cache or BootstrapCache).ttls.values())
+      self.load_bootstrap(self.shared.once(f"poe-{token_key}", self.bootstrap, ttl))
+    else:
+      self.load_next_data()
+    self.set_channel(self.get_channel_data())
+    self.set_gql_headers()
+
+    if first_setup and self.shared is None:
+      self.load_bots()
+
+    if self.device_id is None:
+      self.device_id = self.get_device_id()
+
+    self.subscribe()
+    self.refresh_in_background()
+
+  def set_channel(self, channel):
+    if self.channel is None or channel["channel"] != self.channel["channel"]:
+      self.min_seq = None
+    self.channel = channel
 
+  def set_gql_headers(self):
     self.gql_headers = {
       "poe-formkey": self.formkey,
       "poe-tchannel": self.channel["channel"],
     }
     self.gql_headers = {**self.gql_headers, **self.headers}
 
-    if not hasattr(self, "bots"):
-      self.bots = self.get_bots(download_next_data=False)
-    if not hasattr(self, "bot_names"):
-      self.bot_names = self.get_bot_names()
-
+  def bootstrap(self):
+    """Loads the session data that does not depend on the websocket channel."""
+    self.load_next_data()
+    self.set_channel(self.get_channel_data())
+    self.set_gql_headers()
+    self.load_bots()
     if self.device_id is None:
       self.device_id = self.get_device_id()
+    return {
+      "next_data": self.next_data,
+      "formkey": self.formkey,
+      "formkey_salt": self.formkey_salt,
+      "bots": self.bots.to_dict(),
+      "device_id": self.device_id,
+    }
 
-    self.subscribe()
+  def load_bootstrap(self, data):
+    self.formkey = data["formkey"]
+    self.formkey_salt = data["formkey_salt"]
+    self.set_next_data(data["next_data"])
+    for codename, chat_data in data["bots"].items():
+      self.bots.put(codename, chat_data)
+    self.bot_names = self.get_bot_names()
+    if self.device_id is None:
+      self.device_id = data["device_id"]
+
+  def load_next_data(self):
+    """next_data and formkey from the bootstrap cache, downloads them if missing or expired."""
+    if self.cache is None:
+      self.get_next_data(overwrite_vars=True)
+      return
+    if not self.formkey:
+      cached = self.cache.get("formkey")
+      if cached is not None:
+        self.formkey, self.formkey_salt = cached
+    next_data = self.cache.get("next_data")
+    if next_data is not None and self.formkey:
+      logger.info("Using cached next_data")
+      if self.formkey_salt is None:
+        self.formkey_salt = "4LxgHM6KpFqokX0Ox"
+      self.set_next_data(next_data)
+      return
+
+    download_formkey = not self.formkey
+    self.get_next_data(overwrite_vars=True)
+    self.cache.put("next_data", self.next_data)
+    if download_formkey:
+      self.cache.put("formkey", [self.formkey, self.formkey_salt])
+
+  def load_bots(self):
+    """Puts the prefetched bots into the bot cache, from the bootstrap cache when it has them."""
+    bots = dict((self.cache.get("bots") if self.cache is not None else None) or {})
+    for codename, chat_data in bots.items():
+      self.bots.put(codename, chat_data)
+    missing = [codename for codename in self.prefetch_bots if codename not in bots]
+    if not missing:
+      logger.info("Using cached bots")
+      self.bot_names = self.get_bot_names()
+      return
+    bots.update(self.prefetch(missing))
+    if self.cache is not None:
+      self.cache.put("bots", bots)
+
+  def refresh_in_background(self):
+    if self.cache is None or self.refreshing:
+      return
+    if not any(self.cache.is_stale(name) for name in self.cache.ttls):
+      return
+    self.refreshing = True
+    threading.Thread(target=self.refresh_cache, daemon=True).start()
+
+  def refresh_cache(self):
+    """Downloads the stale parts of the bootstrap cache for the next start."""
+    try:
+      # workers sharing the cache file take turns, and skip what another one already refreshed
+      with file_lock(f"{self.cache.path}.lock"):
+        self.cache.reload()
+        refresh_formkey = self.cache.is_stale("formkey") and not self.formkey_given
+        if self.cache.is_stale("next_data") or refresh_formkey:
+          logger.info("Refreshing cached next_data...")
+          r = request_with_retries(self.session.get, self.home_url)
+          next_data = parse_next_data(r.text)
+          self.set_next_data(next_data)
+          self.cache.put("next_data", next_data)
+          if refresh_formkey:
+            # the running session keeps its formkey, the new one is used from the next start
+            self.cache.put("formkey", list(self.download_formkey(r.text)))
+        if self.cache.is_stale("bots"):
+          logger.info("Refreshing cached bots...")
+          bots = self.prefetch(list(self.bots) or self.prefetch_bots, refresh=True)
+          if bots:
+            self.cache.put("bots", bots)
+    except Exception as e:
+      logger.warn(f"Failed to refresh the bootstrap cache: {e}")
+    finally:
+      self.refreshing = False
 
   def get_device_id(self):
     user_id = self.viewer["poeUser"]["id"]
@@ -246,29 +556,30 @@ class Client:
     logger.info("Downloading next_data...")
 
     r = request_with_retries(self.session.get, self.home_url)
-    json_regex = r'<script id="__NEXT_DATA__" type="application\/json">(.+?)</script>'
-    json_text = re.search(json_regex, r.text).group(1)
-    next_data = json.loads(json_text)
+    next_data = parse_next_data(r.text)
 
     if overwrite_vars:
       if not self.formkey:
-        script_src_regex = r'src="(https://psc2\.cf2\.poecdn\.net/[a-f0-9]{40}/_next/static/chunks/pages/_app-[a-f0-9]{16}\.js)"'
-        script_src = re.search(script_src_regex, r.text).group(1)
-        r2 = request_with_retries(self.session.get, script_src)
-        self.formkey, self.formkey_salt = self.extract_formkey(r.text, r2.text)
+        self.formkey, self.formkey_salt = self.download_formkey(r.text)
       
       if self.formkey_salt is None:
         self.formkey_salt = "4LxgHM6KpFqokX0Ox"
 
-      if "payload" in next_data["props"]["pageProps"]:
-        self.viewer = next_data["props"]["pageProps"]["payload"]["viewer"]
-      else:
-        self.viewer = next_data["props"]["pageProps"]["data"]["viewer"]
-      self.user_id = self.viewer["poeUser"]["id"]
-      self.next_data = next_data
+      self.set_next_data(next_data)
 
     return next_data
 
+  def download_formkey(self, html):
+    script_src_regex = r'src="(https://psc2\.cf2\.poecdn\.net/[a-f0-9]{40}/_next/static/chunks/pages/_app-[a-f0-9]{16}\.js)"'
+    script_src = re.search(script_src_regex, html).group(1)
+    r = request_with_retries(self.session.get, script_src)
+    return self.extract_formkey(html, r.text)
+
+  def set_next_data(self, next_data):
+    self.viewer = get_viewer(next_data)
+    self.user_id = self.viewer["poeUser"]["id"]
+    self.next_data = next_data
+
   def get_bot(self, handle):
     url = f'https://poe.com/_next/data/{self.next_data["buildId"]}/{handle}.json'
 
@@ -295,32 +606,53 @@ class Client:
       next_page = bot_list_data["pageInfo"]["hasNextPage"]
       end_cursor = bot_list_data["pageInfo"]["endCursor"]
 
-    threads = []
-    bots = {}
-
-    def get_bot_thread(bot):
-      chat_data = self.get_bot(bot["node"]["handle"])
-      bots[chat_data["defaultBotObject"]["nickname"]] = chat_data
-
-    for bot in bot_list:
-      thread = threading.Thread(target=get_bot_thread, args=(bot,), daemon=True)
-      threads.append(thread)
-
-    for thread in threads:
-      thread.start()
-    for thread in threads:
-      thread.join()
+    return self.fetch_bots([bot["node"]["handle"] for bot in bot_list])
 
-    self.bots = bots
+  def fetch_bots(self, handles):
+    """Downloads the given bots with at most bot_workers requests at a time and caches them."""
+    bots = {}
+    if not handles:
+      return bots
+    with ThreadPoolExecutor(max_workers=min(self.bot_workers, len(handles))) as executor:
+      for chat_data in executor.map(self.get_bot, handles):
+        codename = chat_data["defaultBotObject"]["nickname"]
+        bots[codename] = chat_data
+        self.bots.put(codename, chat_data)
     self.bot_names = self.get_bot_names()
     return bots
 
-  def get_bot_by_codename(self, bot_codename):
-    if bot_codename in self.bots:
-      return self.bots[bot_codename]
+  def prefetch(self, codenames, refresh=False):
+    """Resolves the given codenames with at most bot_workers requests at a time."""
+    if not codenames:
+      return {}
+    if refresh:
+      for codename in codenames:
+        self.bots.discard(codename)
+    with ThreadPoolExecutor(max_workers=min(self.bot_workers, len(codenames))) as executor:
+      return dict(zip(codenames, executor.map(self.get_bot_by_codename, codenames)))
 
-    #todo: cache this so it isn't re-downloaded every time
-    return self.get_bot(bot_codename)
+  def get_bot_by_codename(self, bot_codename):
+    chat_data = self.bots.get(bot_codename)
+    if chat_data is not None:
+      return chat_data
+
+    with self.bot_locks.setdefault(bot_codename, threading.Lock()):
+      # another thread may have fetched it meanwhile
+      chat_data = self.bots.get(bot_codename)
+      if chat_data is not None:
+        return chat_data
+      try:
+        chat_data = self.get_bot(bot_handles.get(bot_codename, bot_codename))
+      except (KeyError, TypeError, RuntimeError):
+        chat_data = None
+      if chat_data is None or chat_data["defaultBotObject"]["nickname"] != bot_codename:
+        # neither a known codename nor a handle, look for it among all bots
+        chat_data = self.get_bots().get(bot_codename)
+        if chat_data is None:
+          raise RuntimeError(f"Bot {bot_codename} is not available.")
+      self.bots.put(bot_codename, chat_data)
+      self.bot_names[bot_codename] = chat_data["defaultBotObject"]["displayName"]
+      return chat_data
 
   def get_bot_names(self):
     bot_names = {}
@@ -370,21 +702,26 @@ class Client:
   def get_websocket_url(self, channel=None):
     if channel is None:
       channel = self.channel
-    query = f'?min_seq={channel["minSeq"]}&channel={channel["channel"]}&hash={channel["channelHash"]}'
+    min_seq = channel["minSeq"] if self.min_seq is None else self.min_seq
+    query = f'?min_seq={min_seq}&channel={channel["channel"]}&hash={channel["channelHash"]}'
     return f'ws://{self.ws_domain}.tch.{channel["baseHost"]}/up/{channel["boxName"]}/updates'+query
 
-  def send_query(self, query_name, variables, attempts=20):
-    for i in range(attempts):
-      json_data = generate_payload(query_name, variables)
-      payload = json.dumps(json_data, separators=(",", ":"))
+  def build_query(self, query_name, variables):
+    json_data = generate_payload(query_name, variables)
+    payload = json.dumps(json_data, separators=(",", ":"))
 
-      base_string = payload + self.gql_headers["poe-formkey"] + self.formkey_salt
+    base_string = payload + self.gql_headers["poe-formkey"] + self.formkey_salt
 
-      headers = {
-        "content-type": "application/json",
-        "poe-tag-id": hashlib.md5(base_string.encode()).hexdigest()
-      }
-      headers = {**self.gql_headers, **headers}
+    headers = {
+      "content-type": "application/json",
+      "poe-tag-id": hashlib.md5(base_string.encode()).hexdigest()
+    }
+    headers = {**self.gql_headers, **headers}
+    return payload, headers
+
+  def send_query(self, query_name, variables, attempts=5):
+    for i in range(attempts):
+      payload, headers = self.build_query(query_name, variables)
 
       if query_name == "recv":
         r = request_with_retries(self.session.post, self.gql_recv_url, data=payload, headers=headers)
@@ -393,8 +730,10 @@ class Client:
       r = request_with_retries(self.session.post, self.gql_url, data=payload, headers=headers)
       data = r.json()
       if data["data"] == None:
-        logger.warn(f'{query_name} returned an error: {data["errors"][0]["message"]} | Retrying ({i+1}/20) | Response: {data}')
-        time.sleep(2)
+        logger.warn(f'{query_name} returned an error: {data["errors"][0]["message"]} | Retrying ({i+1}/{attempts}) | Response: {data}')
+        if not resilience.should_retry("poe", i, attempts):
+          break
+        time.sleep(resilience.delay(i))
         continue
 
       return r.json()
@@ -419,6 +758,7 @@ class Client:
     })
 
   def ws_run_thread(self):
+    """Keeps the websocket connected until disconnect_ws(), reconnecting with exponential backoff."""
     kwargs = {}
     if self.proxy:
       proxy_parsed = urlparse(self.proxy)
@@ -432,87 +772,102 @@ class Client:
       if proxy_parsed.username and proxy_parsed.password:
         kwargs["http_proxy_auth"] = (proxy_parsed.username, proxy_parsed.password)
 
-    self.ws.run_forever(**kwargs)
+    delay = self.backoff_min
+    while not self.ws_stop.is_set():
+      self.ws_opened_at = None
+      try:
+        # refresh the session and channel every fifth connection, the first one was set up by connect_ws()
+        if self.connect_count > 0 and self.connect_count % 5 == 0:
+          self.setup_connection()
+        self.connect_count += 1
+        self.ws = websocket.WebSocketApp(
+          self.get_websocket_url(),
+          header={"User-Agent": user_agent},
+          on_message=self.on_message,
+          on_open=self.on_ws_connect,
+          on_error=self.on_ws_error,
+          on_close=self.on_ws_close
+        )
+        # pings find dead connections that never report a close
+        self.ws.run_forever(ping_interval=self.ping_interval, ping_timeout=self.ping_timeout, **kwargs)
+      except Exception as e:
+        logger.warn(f"Websocket connection failed: {e}")
+      self.set_ws_connected(False)
+      if self.ws_stop.is_set():
+        break
+
+      # only a connection that stayed up for a while resets the backoff
+      if self.ws_opened_at is not None and time.monotonic() - self.ws_opened_at > self.backoff_max:
+        delay = self.backoff_min
+      wait = delay * random.uniform(0.5, 1.5)
+      delay = min(delay * 2, self.backoff_max)
+      logger.info(f"Reconnecting websocket in {wait:.1f}s (min_seq={self.min_seq})")
+      self.ws_stop.wait(wait)
+
+  def set_ws_connected(self, connected):
+    with self.ws_cond:
+      self.ws_connected = connected
+      if connected:
+        self.ws_opened_at = time.monotonic()
+      self.ws_cond.notify_all()
 
   def connect_ws(self, timeout=5):
     if self.ws_connected:
       return
 
-    if self.ws_connecting:
-      while not self.ws_connected:
-        time.sleep(0.01)
-      return
-
-    self.ws_connecting = True
-    self.ws_connected = False
-
-    if self.connect_count % 5 == 0:
+    # the first setup downloads the session data, it is not part of the timeout
+    if self.setup_count == 0:
       self.setup_connection()
 
-    self.connect_count += 1
-
-    ws = websocket.WebSocketApp(
-      self.get_websocket_url(),
-      header={"User-Agent": user_agent},
-      on_message=self.on_message,
-      on_open=self.on_ws_connect,
-      on_error=self.on_ws_error,
-      on_close=self.on_ws_close
-    )
-
-    self.ws = ws
-
-    t = threading.Thread(target=self.ws_run_thread, daemon=True)
-    t.start()
-
-    timer = 0
-    while not self.ws_connected:
-      time.sleep(0.01)
-      timer += 0.01
-      if timer > timeout:
-        self.ws_connecting = False
-        self.ws_connected = False
-        self.ws_error = True
-        ws.close()
+    with self.ws_cond:
+      if self.ws_thread is None or not self.ws_thread.is_alive():
+        self.ws_stop.clear()
+        self.ws_thread = threading.Thread(target=self.ws_run_thread, daemon=True)
+        self.ws_thread.start()
+      if not self.ws_cond.wait_for(lambda: self.ws_connected, timeout):
         raise RuntimeError("Timed out waiting for websocket to connect.")
 
+  def reconnect_ws(self):
+    # ws_run_thread() opens a new connection once this one is closed
+    ws = self.ws
+    if ws is not None:
+      ws.close(timeout=1)
+
   def disconnect_ws(self):
-    self.ws_connecting = False
-    self.ws_connected = False
-    if self.ws:
-      self.ws.close()
+    self.ws_stop.set()
+    self.reconnect_ws()
+    self.set_ws_connected(False)
 
   def on_ws_connect(self, ws):
-    self.ws_connecting = False
-    self.ws_connected = True
+    self.set_ws_connected(True)
 
   def on_ws_close(self, ws, close_status_code, close_message):
     logger.warn(f"Websocket closed with status {close_status_code}: {close_message}")
-
-    self.ws_connecting = False
-    self.ws_connected = False
-    if self.ws_error:
-      self.ws_error = False
-      self.connect_ws()
+    self.set_ws_connected(False)
 
   def on_ws_error(self, ws, error):
-    self.ws_connecting = False
-    self.ws_connected = False
-    self.ws_error = True
+    logger.warn(f"Websocket error: {error}")
+    self.set_ws_connected(False)
 
-  def on_message(self, ws, msg):
-    try:
-      data = json.loads(msg)
+  def parse_updates(self, msg):
+    data = json.loads(msg)
+    if data.get("min_seq") is not None:
+      self.min_seq = data["min_seq"]
 
-      if not "messages" in data:
-        return
+    if not "messages" in data:
+      return []
 
-      for message_str in data["messages"]:
-        message_data = json.loads(message_str)
-        if message_data["message_type"] != "subscriptionUpdate":
-          continue
-        message = message_data["payload"]["data"]["messageAdded"]
+    updates = []
+    for message_str in data["messages"]:
+      message_data = json.loads(message_str)
+      if message_data["message_type"] != "subscriptionUpdate":
+        continue
+      updates.append(message_data["payload"]["data"]["messageAdded"])
+    return updates
 
+  def on_message(self, ws, msg):
+    try:
+      for message in self.parse_updates(msg):
         #handle suggested replies
         if "suggestedReplies" in message and type(message["suggestedReplies"]) == list and len(message["suggestedReplies"]) > 0 and message["messageId"] in self.suggestion_callbacks:
           self.suggestion_callbacks[message["messageId"]](message["suggestedReplies"][-1])
@@ -528,35 +883,41 @@ class Client:
 
           #indicate that the response id is tied to the human message id
           elif key != "pending" and value == None and message["state"] != "complete":
-            self.active_messages[key] = message["messageId"]
+            self.set_active_message(key, message["messageId"])
             self.message_queues[key].put(message)
             return
 
     except Exception:
       logger.error(traceback.format_exc())
-      self.disconnect_ws()
-      self.connect_ws()
+      self.reconnect_ws()
     
   def is_busy(self):
     return bool(self.active_messages)
 
+  def set_active_message(self, key, value):
+    with self.message_cond:
+      self.active_messages[key] = value
+      self.message_cond.notify_all()
+
+  def remove_active_message(self, key):
+    with self.message_cond:
+      self.active_messages.pop(key, None)
+      self.message_queues.pop(key, None)
+      self.message_cond.notify_all()
+
   def send_message(self, chatbot, message, with_chat_break=False, timeout=20, async_recv=True, suggest_callback=None):
     # if there is another active message, wait until it has finished sending
-    timer = 0
-    while None in self.active_messages.values():
-      time.sleep(0.01)
-      timer += 0.01
-      if timer > timeout:
+    with self.message_cond:
+      if not self.message_cond.wait_for(lambda: None not in self.active_messages.values(), timeout):
         raise RuntimeError("Timed out waiting for other messages to send.")
+      # None indicates that a message is still in progress
+      self.active_messages["pending"] = None
 
-    # None indicates that a message is still in progress
-    self.active_messages["pending"] = None
-
-    # reconnect websocket
-    while self.ws_error:
-      time.sleep(0.01)
-
-    self.connect_ws()
+    try:
+      self.connect_ws()
+    except Exception:
+      self.remove_active_message("pending")
+      raise
 
     logger.info(f"Sending message to {chatbot}: {message}")
 
@@ -577,13 +938,11 @@ class Client:
         "withChatBreak": with_chat_break,
         "attachments": []
       })
-      del self.active_messages["pending"]
-    except Exception as e:
-      del self.active_messages["pending"]
-      raise e
+    finally:
+      self.remove_active_message("pending")
 
     if not message_data["data"]["messageEdgeCreate"]["message"]:
-      raise RuntimeError(f"Daily limit reached for {chatbot}.")
+      raise RateLimitError(f"Daily limit reached for {chatbot}.")
     try:
       human_message = message_data["data"]["messageEdgeCreate"]["message"]
       human_message_id = human_message["node"]["messageId"]
@@ -591,8 +950,8 @@ class Client:
       raise RuntimeError(f"An unknown error occurred. Raw response data: {message_data}")
 
     # indicate that the current message is waiting for a response
-    self.active_messages[human_message_id] = None
     self.message_queues[human_message_id] = queue.Queue()
+    self.set_active_message(human_message_id, None)
 
     last_text = ""
     message_id = None
@@ -600,8 +959,7 @@ class Client:
       try:
         message = self.message_queues[human_message_id].get(timeout=timeout)
       except queue.Empty:
-        del self.active_messages[human_message_id]
-        del self.message_queues[human_message_id]
+        self.remove_active_message(human_message_id)
         raise RuntimeError("Response timed out.")
 
       #only break when the message is marked as complete
@@ -611,6 +969,10 @@ class Client:
         else:
           continue
 
+      # updates replayed after a reconnect can be older than the text we have
+      if len(message["text"]) <= len(last_text):
+        continue
+
       #update info about response
       message["text_new"] = message["text"][len(last_text):]
       last_text = message["text"]
@@ -623,7 +985,7 @@ class Client:
       yield message
 
     def recv_post_thread():
-      bot_message_id = self.active_messages[human_message_id]
+      bot_message_id = message_id
 
       # wait 2 seconds after sending the request
       time.sleep(2.5)
@@ -648,8 +1010,7 @@ class Client:
     if not async_recv:
       t.join()
 
-    del self.active_messages[human_message_id]
-    del self.message_queues[human_message_id]
+    self.remove_active_message(human_message_id)
 
   def send_chat_break(self, chatbot):
     logger.info(f"Sending chat break to {chatbot}")
@@ -790,4 +1151,185 @@ class Client:
 
   def purge_all_conversations(self):
     logger.info("Purging all conversations")
-    self.send_query("DeleteUserMessagesMutation", {})
\ No newline at end of file
+    self.send_query("DeleteUserMessagesMutation", {})
+
+
+class AsyncClient(Client):
+  """
+  asyncio front end for Client.
+
+  Session bootstrap still happens synchronously in __init__. After that, GraphQL
+  calls go through an httpx.AsyncClient and websocket updates are handed to the
+  event loop, one asyncio.Queue per bot message, so many messages to different
+  bots or chats can stream at the same time without blocking the loop.
+  """
+
+  def __init__(self, token, proxy=None, **kwargs):
+    self.loop = None
+    self.async_session = None
+    # bot codename -> queues of sent messages still waiting for their bot message id
+    self.pending_queues = {}
+    # bot message id -> queue of updates for it
+    self.response_queues = {}
+    # a chat only generates one answer at a time
+    self.chat_locks = {}
+    self.background_tasks = set()
+    super().__init__(token, proxy=proxy, **kwargs)
+
+  def setup_async_session(self):
+    self.loop = asyncio.get_running_loop()
+    if self.async_session is None or self.async_session.is_closed:
+      self.async_session = httpx.AsyncClient(headers=self.headers, proxies=self.proxy)
+      self.async_session.cookies.set("p-b", self.token, domain="poe.com")
+
+  async def close(self):
+    if self.async_session is not None:
+      await self.async_session.aclose()
+      self.async_session = None
+    self.disconnect_ws()
+    if getattr(self, "session", None) is not None:
+      self.session.close()
+
+  async def send_query_async(self, query_name, variables, attempts=5):
+    for i in range(attempts):
+      payload, headers = self.build_query(query_name, variables)
+
+      if query_name == "recv":
+        await async_request_with_retries(self.async_session.post, self.gql_recv_url, content=payload, headers=headers)
+        return None
+
+      r = await async_request_with_retries(self.async_session.post, self.gql_url, content=payload, headers=headers)
+      data = r.json()
+      if data["data"] == None:
+        logger.warn(f'{query_name} returned an error: {data["errors"][0]["message"]} | Retrying ({i+1}/{attempts}) | Response: {data}')
+        if not resilience.should_retry("poe", i, attempts):
+          break
+        await asyncio.sleep(resilience.delay(i))
+        continue
+
+      return data
+
+    raise RuntimeError(f'{query_name} failed too many times.')
+
+  def on_message(self, ws, msg):
+    # runs on the websocket thread, routing happens on the event loop
+    try:
+      updates = self.parse_updates(msg)
+    except Exception:
+      logger.error(traceback.format_exc())
+      self.reconnect_ws()
+      return
+
+    if self.loop is None or self.loop.is_closed():
+      return
+    for message in updates:
+      self.loop.call_soon_threadsafe(self.dispatch_update, message)
+
+  def dispatch_update(self, message):
+    message_queue = self.response_queues.get(message["messageId"])
+    if message_queue is None:
+      if message["state"] == "complete":
+        return
+      # the first unknown update from a bot belongs to the oldest message sent to it
+      author = message.get("author")
+      if author is not None:
+        waiting = self.pending_queues.get(author)
+      else:
+        waiting = next((queues for queues in self.pending_queues.values() if queues), None)
+      if not waiting:
+        return
+      message_queue = waiting.popleft()
+      self.response_queues[message["messageId"]] = message_queue
+    message_queue.put_nowait(message)
+
+  async def send_message(self, chatbot, message, with_chat_break=False, timeout=20):
+    self.setup_async_session()
+    if not self.ws_connected:
+      await self.loop.run_in_executor(None, self.connect_ws)
+
+    logger.info(f"Sending message to {chatbot}: {message}")
+
+    chat_id = (await self.loop.run_in_executor(None, self.get_bot_by_codename, chatbot))["chatId"]
+    lock = self.chat_locks.setdefault(chat_id, asyncio.Lock())
+    async with lock:
+      message_queue = asyncio.Queue()
+      waiting = self.pending_queues.setdefault(chatbot, deque())
+      waiting.append(message_queue)
+      message_id = None
+      try:
+        message_data = await self.send_query_async("SendMessageMutation", {
+          "bot": chatbot,
+          "query": message,
+          "chatId": chat_id,
+          "source": {
+            "chatInputMetadata": {
+              "useVoiceRecord": False
+            },
+            "sourceType": "chat_input"
+          },
+          "clientNonce": generate_nonce(),
+          "sdid": self.device_id,
+          "withChatBreak": with_chat_break,
+          "attachments": []
+        })
+
+        if not message_data["data"]["messageEdgeCreate"]["message"]:
+          raise RateLimitError(f"Daily limit reached for {chatbot}.")
+        try:
+          human_message = message_data["data"]["messageEdgeCreate"]["message"]
+          human_message_id = human_message["node"]["messageId"]
+        except TypeError:
+          raise RuntimeError(f"An unknown error occurred. Raw response data: {message_data}")
+
+        last_text = ""
+        while True:
+          try:
+            update = await asyncio.wait_for(message_queue.get(), timeout)
+          except asyncio.TimeoutError:
+            raise RuntimeError("Response timed out.")
+
+          #only break when the message is marked as complete
+          if update["state"] == "complete":
+            if last_text and update["messageId"] == message_id:
+              break
+            else:
+              continue
+
+          # updates replayed after a reconnect can be older than the text we have
+          if len(update["text"]) <= len(last_text):
+            continue
+
+          #update info about response
+          update["text_new"] = update["text"][len(last_text):]
+          last_text = update["text"]
+          message_id = update["messageId"]
+
+          yield update
+      finally:
+        if message_queue in waiting:
+          waiting.remove(message_queue)
+        for key in [key for key, value in self.response_queues.items() if value is message_queue]:
+          del self.response_queues[key]
+
+    task = asyncio.create_task(self.send_recv(chatbot, chat_id, human_message_id, message_id, last_text))
+    self.background_tasks.add(task)
+    task.add_done_callback(self.background_tasks.discard)
+
+  async def send_recv(self, chatbot, chat_id, human_message_id, bot_message_id, last_text):
+    # wait a moment after the answer, then report the response stats like the web client
+    await asyncio.sleep(2.5)
+    try:
+      await self.send_query_async("recv", {
+        "bot": chatbot,
+        "time_to_first_typing_indicator": 300, # randomly select
+        "time_to_first_subscription_response": 600,
+        "time_to_full_bot_response": 1100,
+        "full_response_length": len(last_text) + 1,
+        "full_response_word_count": len(last_text.split(" ")) + 1,
+        "human_message_id": human_message_id,
+        "bot_message_id": bot_message_id,
+        "chat_id": chat_id,
+        "bot_response_status": "success",
+      })
+    except Exception:
+      logger.warn(f"Failed to send response stats for {chatbot}: {traceback.format_exc()}")
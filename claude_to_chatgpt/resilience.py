@@ -0,0 +1,219 @@
+# -*- coding:utf-8 -*-
+import asyncio
+import random
+import threading
+import time
+from claude_to_chatgpt.logger import logger
+from claude_to_chatgpt.metrics import BREAKER_STATE, BREAKER_TRANSITIONS, RETRIES, RETRIES_DENIED
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class UpstreamError(RuntimeError):
+    """An upstream failure worth a retry: a transport error or a 5xx response."""
+
+
+class CircuitOpenError(RuntimeError):
+    """The upstream's breaker is open, the request was not sent."""
+
+
+def backoff(attempt, base=0.2, cap=10.0):
+    """Full jitter exponential backoff: a random delay up to base * 2 ** attempt, at most cap."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class RetryBudget:
+    """
+    Retries allowed across all upstreams, as a share of the requests.
+
+    Every request deposits `ratio` of a retry and every retry withdraws one,
+    on top of a small steady allowance of `min_per_second`. When an upstream
+    degrades, retries stop at roughly `ratio` times the traffic instead of
+    multiplying it.
+    """
+
+    def __init__(self, ratio=0.2, min_per_second=1.0, capacity=100.0):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.min_per_second)
+        self.updated = now
+
+    def record_request(self):
+        with self.lock:
+            self.refill(time.monotonic())
+            self.tokens = min(self.capacity, self.tokens + self.ratio)
+
+    def try_retry(self):
+        with self.lock:
+            self.refill(time.monotonic())
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class CircuitBreaker:
+    """
+    Fails fast while an upstream keeps failing.
+
+    After `failure_threshold` consecutive failures the breaker opens and
+    requests are refused for `reset_timeout` seconds. Then a single probe is
+    let through: its success closes the breaker, its failure opens it again.
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.lock = threading.Lock()
+        BREAKER_STATE.set((name,), STATE_VALUES[CLOSED])
+
+    def transition(self, state):
+        if state == self.state:
+            return
+        logger.warning(f"Circuit breaker {self.name}: {self.state} -> {state}")
+        self.state = state
+        BREAKER_STATE.set((self.name,), STATE_VALUES[state])
+        BREAKER_TRANSITIONS.inc((self.name, state))
+
+    def allow(self):
+        with self.lock:
+            if self.state == CLOSED:
+                return
+            if self.state == OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    raise CircuitOpenError(f"{self.name} is unavailable, its circuit breaker is open.")
+                self.transition(HALF_OPEN)
+            if self.probing:
+                raise CircuitOpenError(f"{self.name} is unavailable, waiting for a probe request.")
+            self.probing = True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.probing = False
+            self.transition(CLOSED)
+
+    def release(self):
+        # the request failed for a reason that says nothing about the upstream's health
+        with self.lock:
+            self.probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.probing = False
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self.transition(OPEN)
+
+    def stats(self):
+        return {"state": self.state, "failures": self.failures}
+
+
+BUDGET = RetryBudget()
+BREAKERS = {}
+_settings = {"failure_threshold": 5, "reset_timeout": 30.0, "max_attempts": 3, "base_delay": 0.2, "max_delay": 10.0}
+
+
+def configure(retry_ratio=None, retry_min_per_second=None, **kwargs):
+    """Sets the breaker and retry settings, call it before the first request."""
+    if retry_ratio is not None:
+        BUDGET.ratio = retry_ratio
+    if retry_min_per_second is not None:
+        BUDGET.min_per_second = retry_min_per_second
+    _settings.update({key: value for key, value in kwargs.items() if value is not None})
+
+
+def breaker(name):
+    circuit = BREAKERS.get(name)
+    if circuit is None:
+        circuit = BREAKERS[name] = CircuitBreaker(name, _settings["failure_threshold"], _settings["reset_timeout"])
+    return circuit
+
+
+def should_retry(name, attempt, max_attempts=None):
+    """Whether a failed attempt (counted from 0) may be retried, charging the retry budget."""
+    max_attempts = max_attempts or _settings["max_attempts"]
+    if attempt + 1 >= max_attempts:
+        return False
+    if not BUDGET.try_retry():
+        RETRIES_DENIED.inc((name,))
+        logger.warning(f"Retry budget exhausted, not retrying {name}")
+        return False
+    RETRIES.inc((name,))
+    return True
+
+
+def delay(attempt):
+    return backoff(attempt, _settings["base_delay"], _settings["max_delay"])
+
+
+async def call(name, func, *args, retry_on=(UpstreamError,), max_attempts=None, **kwargs):
+    """
+    Awaits func(*args, **kwargs) behind the upstream's breaker, retrying
+    failures of the types in retry_on with backoff while the budget allows.
+    """
+    circuit = breaker(name)
+    BUDGET.record_request()
+    attempt = 0
+    while True:
+        circuit.allow()
+        try:
+            result = await func(*args, **kwargs)
+        except retry_on as e:
+            circuit.record_failure()
+            if not should_retry(name, attempt, max_attempts):
+                raise UpstreamError(f"{name} failed: {e}") from e
+            wait = delay(attempt)
+            logger.warning(f"{name} failed ({e}), retrying in {wait:.2f}s")
+            await asyncio.sleep(wait)
+            attempt += 1
+            continue
+        except BaseException:
+            circuit.release()
+            raise
+        circuit.record_success()
+        return result
+
+
+def call_sync(name, func, *args, retry_on=(UpstreamError,), max_attempts=None, **kwargs):
+    """call() for blocking code, such as the poe.Client bootstrap threads."""
+    circuit = breaker(name)
+    BUDGET.record_request()
+    attempt = 0
+    while True:
+        circuit.allow()
+        try:
+            result = func(*args, **kwargs)
+        except retry_on as e:
+            circuit.record_failure()
+            if not should_retry(name, attempt, max_attempts):
+                raise UpstreamError(f"{name} failed: {e}") from e
+            wait = delay(attempt)
+            logger.warning(f"{name} failed ({e}), retrying in {wait:.2f}s")
+            time.sleep(wait)
+            attempt += 1
+            continue
+        except BaseException:
+            circuit.release()
+            raise
+        circuit.record_success()
+        return result
+
+
+def stats():
+    return {name: circuit.stats() for name, circuit in BREAKERS.items()}
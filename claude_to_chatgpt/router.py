@@ -0,0 +1,155 @@
+# -*- coding:utf-8 -*-
+import time
+from claude_to_chatgpt import metrics
+from claude_to_chatgpt.logger import logger
+from claude_to_chatgpt.schemas import ChatRequest
+from claude_to_chatgpt.sse import Interrupted
+
+# seconds a failed try is assumed to cost when comparing backends
+FAILURE_COST = 10.0
+
+
+def parse_routes(value):
+    """
+    Routes from "gpt-3.5-turbo=claude,poe;gpt-4=poe,claude2;*=claude": each model
+    name maps to the backends that may serve it, in order of preference. "*" is
+    used for models without a route of their own.
+    """
+    routes = {}
+    for route in (value or "").split(";"):
+        if "=" not in route:
+            continue
+        model, backends = route.split("=", 1)
+        backends = [backend.strip() for backend in backends.split(",") if backend.strip()]
+        if model.strip() and backends:
+            routes[model.strip()] = backends
+    return routes
+
+
+class Backend:
+    """
+    One adapter behind the router, with live estimates of its latency and errors.
+
+    latency is an EWMA of the time to the first chunk. error_rate is an EWMA of
+    failures that also decays with time, so a backend that failed a while ago
+    gets traffic again and can show it recovered.
+    """
+
+    def __init__(self, name, adapter, alpha=0.3, error_half_life=30.0):
+        self.name = name
+        self.adapter = adapter
+        self.alpha = alpha
+        self.error_half_life = error_half_life
+        self.latency = None
+        self.errors = 0.0
+        self.errors_updated = time.monotonic()
+        self.in_flight = 0
+        self.requests = 0
+        self.failures = 0
+
+    def error_rate(self, now):
+        return self.errors * 0.5 ** ((now - self.errors_updated) / self.error_half_life)
+
+    def record_error(self, now, value):
+        self.errors = self.error_rate(now) * (1 - self.alpha) + value * self.alpha
+        self.errors_updated = now
+
+    def record_success(self, latency):
+        now = time.monotonic()
+        self.latency = latency if self.latency is None else self.latency * (1 - self.alpha) + latency * self.alpha
+        self.record_error(now, 0.0)
+
+    def record_failure(self):
+        self.failures += 1
+        self.record_error(time.monotonic(), 1.0)
+
+    def score(self, now):
+        """Expected seconds to the first chunk, lower is better. Unmeasured backends go first."""
+        latency = self.latency or 0.0
+        # a backend with streams in flight is likely slower, one that fails wastes a try
+        return latency * (1 + self.in_flight) + self.error_rate(now) * FAILURE_COST
+
+    def stats(self):
+        return {
+            "name": self.name,
+            "latency": round(self.latency, 4) if self.latency is not None else None,
+            "error_rate": round(self.error_rate(time.monotonic()), 4),
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "failures": self.failures,
+        }
+
+
+class Router:
+    """
+    Serves each model from several adapters.
+
+    Backends allowed for a model are tried from the lowest score. A backend that
+    fails before its first chunk is recorded as failed and the next one is tried,
+    once a chunk was sent the stream stays on that backend. Every backend call
+    is instrumented under the backend's own adapter name.
+    """
+
+    def __init__(self, adapters, routes, alpha=0.3, error_half_life=30.0):
+        self.backends = {name: Backend(name, adapter, alpha, error_half_life) for name, adapter in adapters.items()}
+        self.routes = {}
+        for model, names in routes.items():
+            unknown = [name for name in names if name not in self.backends]
+            if unknown:
+                raise ValueError(f"Route for {model} uses unknown backends: {', '.join(unknown)}")
+            self.routes[model] = [self.backends[name] for name in names]
+
+    def candidates(self, model):
+        backends = self.routes.get(model) or self.routes.get("*") or list(self.backends.values())
+        now = time.monotonic()
+        # equal scores, as of backends not measured yet, go to the one with fewer streams in flight.
+        # sorted() is stable, full ties keep the configured order
+        return sorted(backends, key=lambda backend: (backend.score(now), backend.in_flight))
+
+    async def chat(self, chat_request: ChatRequest):
+        error = None
+        for backend in self.candidates(chat_request.model):
+            stream = metrics.instrument(
+                backend.adapter.chat(chat_request), type(backend.adapter).__name__, chat_request.model)
+            backend.requests += 1
+            backend.in_flight += 1
+            start = time.monotonic()
+            try:
+                try:
+                    first = await stream.__anext__()
+                except StopAsyncIteration:
+                    backend.record_success(time.monotonic() - start)
+                    return
+                except Exception as e:
+                    backend.record_failure()
+                    logger.warning(f"Backend {backend.name} failed, trying the next one: {e}")
+                    error = e
+                    continue
+                backend.record_success(time.monotonic() - start)
+
+                yield first
+                try:
+                    async for item in stream:
+                        if isinstance(item, Interrupted):
+                            # the adapter ended a stream that failed after its first chunk
+                            backend.record_failure()
+                        yield item
+                except Exception:
+                    backend.record_failure()
+                    raise
+                return
+            finally:
+                backend.in_flight -= 1
+                await stream.aclose()
+        if error is None:
+            raise RuntimeError(f"No backend for model {chat_request.model}")
+        raise error
+
+    async def close(self):
+        for backend in self.backends.values():
+            close = getattr(backend.adapter, "close", None)
+            if close is not None:
+                await close()
+
+    def stats(self):
+        return [backend.stats() for backend in self.backends.values()]
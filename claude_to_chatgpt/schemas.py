@@ -0,0 +1,97 @@
+# -*- coding:utf-8 -*-
+import json
+
+try:
+    import orjson
+
+    def loads(data):
+        return orjson.loads(data)
+
+except ImportError:
+    loads = json.loads
+
+ROLES = ("system", "user", "assistant")
+
+
+class ChatRequest:
+    """
+    An OpenAI chat completion request, decoded and validated once in app.py.
+
+    Adapters read the typed fields. `params` keeps the decoded body for
+    anything else, such as building cache keys.
+    """
+
+    __slots__ = ("model", "messages", "stream", "temperature", "top_p", "max_tokens", "stop", "n", "params", "headers")
+
+    def __init__(self, model, messages, stream=False, temperature=None, top_p=None, max_tokens=None, stop=None, n=None,
+                 params=None, headers=None):
+        self.model = model
+        self.messages = messages
+        self.stream = stream
+        self.temperature = temperature
+        self.top_p = top_p
+        self.max_tokens = max_tokens
+        self.stop = stop
+        self.n = n
+        self.params = params if params is not None else {}
+        self.headers = headers if headers is not None else {}
+
+    @classmethod
+    def from_dict(cls, params, headers=None):
+        if not isinstance(params, dict):
+            raise ValueError("Request body must be a JSON object.")
+
+        model = params.get("model")
+        if not isinstance(model, str) or not model:
+            raise ValueError("'model' must be a non-empty string.")
+
+        messages = params.get("messages")
+        if not isinstance(messages, list) or not messages:
+            raise ValueError("'messages' must be a non-empty list.")
+        for i, message in enumerate(messages):
+            if not isinstance(message, dict):
+                raise ValueError(f"messages[{i}] must be an object.")
+            if message.get("role") not in ROLES:
+                raise ValueError(f"messages[{i}].role must be one of {', '.join(ROLES)}.")
+            if not isinstance(message.get("content"), (str, list)):
+                raise ValueError(f"messages[{i}].content must be a string or a list.")
+
+        stream = params.get("stream")
+        if stream is None:
+            stream = False
+        elif not isinstance(stream, bool):
+            raise ValueError("'stream' must be a boolean.")
+        for field in ("temperature", "top_p"):
+            value = params.get(field)
+            if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float))):
+                raise ValueError(f"'{field}' must be a number.")
+        for field in ("max_tokens", "n"):
+            value = params.get(field)
+            if value is not None and (isinstance(value, bool) or not isinstance(value, int)):
+                raise ValueError(f"'{field}' must be an integer.")
+        stop = params.get("stop")
+        if isinstance(stop, str):
+            stop = [stop]
+        if stop is not None and not (isinstance(stop, list) and all(isinstance(item, str) for item in stop)):
+            raise ValueError("'stop' must be a string or a list of strings.")
+
+        return cls(
+            model=model,
+            messages=messages,
+            stream=stream,
+            temperature=params.get("temperature"),
+            top_p=params.get("top_p"),
+            max_tokens=params.get("max_tokens"),
+            stop=stop,
+            n=params.get("n"),
+            params=params,
+            headers=headers,
+        )
+
+    @classmethod
+    def parse(cls, body, headers=None):
+        try:
+            params = loads(body)
+        except ValueError as e:
+            raise ValueError(f"Request body is not valid JSON: {e}")
+        return cls.from_dict(params, headers)
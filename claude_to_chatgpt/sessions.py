@@ -0,0 +1,145 @@
+# -*- coding:utf-8 -*-
+import hashlib
+import json
+import time
+from collections import OrderedDict
+
+labels = {
+    "system": "System",
+    "user": "User",
+    "assistant": "Assistant",
+}
+
+
+def history_key(model, messages):
+    """Hash of a conversation so far, whitespace around texts is ignored as clients often trim it."""
+    digest = hashlib.blake2b(model.encode("utf-8"), digest_size=16)
+    for message in messages:
+        content = message["content"]
+        content = content.strip() if isinstance(content, str) else json.dumps(content, sort_keys=True)
+        digest.update(b"\x00" + message["role"].encode("utf-8") + b"\x00" + content.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def text_of(content):
+    if isinstance(content, str):
+        return content
+    return "".join(part.get("text", "") for part in content if part.get("type") == "text")
+
+
+def transcript(messages):
+    """The whole conversation as one prompt, for an upstream conversation that starts fresh."""
+    if len(messages) == 1:
+        return text_of(messages[0]["content"])
+    return "\n\n".join(f"{labels[message['role']]}: {text_of(message['content'])}" for message in messages)
+
+
+class Session:
+    """
+    An upstream conversation that holds the context of a chat.
+
+    credential is the key of the account that owns it, conversation the
+    upstream's id for it: a Poe bot, a claude.ai conversation uuid or a Slack
+    relay conversation id. parent is the last upstream message, if needed.
+    generation is the number of times the conversation's context had been
+    replaced when the session was taken, see SessionStore.current().
+    """
+
+    __slots__ = ("credential", "conversation", "parent", "generation")
+
+    def __init__(self, credential, conversation, parent=None):
+        self.credential = credential
+        self.conversation = conversation
+        self.parent = parent
+        self.generation = 0
+
+    @property
+    def slot(self):
+        return (self.credential, self.conversation)
+
+
+class SessionStore:
+    """
+    Maps the history of a chat to the upstream conversation that already has it.
+
+    When a request's messages before the last one hash to a stored session,
+    only the last message has to be sent upstream. Sessions are taken out when
+    used and stored again under the new history once the reply is complete, so
+    a history continues at most one conversation. Each upstream conversation
+    is held by its latest history only: a history that was branched from or
+    overwritten does not match anymore and the chat is replayed in full.
+
+    Where a new chat can reset a conversation that a taken session still
+    points to, as a Poe bot's chat with a chat break, the reset goes through
+    release(). That bumps the conversation's generation, and current() then
+    tells the taken session its context is gone.
+    """
+
+    def __init__(self, max_size=4096, ttl=3600.0, on_evict=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        # called with sessions dropped for their age or the size limit, to free their conversation
+        self.on_evict = on_evict
+        self.sessions = OrderedDict()
+        self.heads = {}
+        # slot -> number of times its context was replaced
+        self.generations = {}
+        self.hits = 0
+        self.misses = 0
+
+    def take(self, model, messages):
+        """The session continued by the last message, or None if the chat must be replayed."""
+        key = history_key(model, messages[:-1]) if len(messages) > 1 else None
+        entry = self.sessions.pop(key, None) if key is not None else None
+        if entry is not None and entry[1] < time.monotonic():
+            self.evict(key, entry[0])
+            entry = None
+        if entry is None or self.heads.get(entry[0].slot) != key:
+            self.misses += 1
+            return None
+        session = entry[0]
+        del self.heads[session.slot]
+        session.generation = self.generations.get(session.slot, 0)
+        self.hits += 1
+        return session
+
+    def evict(self, key, session):
+        if self.heads.get(session.slot) == key:
+            del self.heads[session.slot]
+        if self.on_evict is not None:
+            self.on_evict(session)
+
+    def put(self, model, messages, reply, session):
+        """Stores the session under the history that now ends with the reply."""
+        key = history_key(model, messages + [{"role": "assistant", "content": reply}])
+        previous = self.heads.get(session.slot)
+        if previous is not None:
+            self.sessions.pop(previous, None)
+        replaced = self.sessions.pop(key, None)
+        if replaced is not None and replaced[0].slot != session.slot:
+            # an identical chat ran in another conversation, only the latest is kept
+            self.evict(key, replaced[0])
+        now = time.monotonic()
+        self.heads[session.slot] = key
+        self.sessions[key] = (session, now + self.ttl)
+        # entries are in the order they expire, the oldest go first
+        while self.sessions:
+            oldest, (evicted, expires) = next(iter(self.sessions.items()))
+            if len(self.sessions) <= self.max_size and expires >= now:
+                break
+            del self.sessions[oldest]
+            self.evict(oldest, evicted)
+
+    def release(self, session):
+        """Forgets an upstream conversation whose context was replaced."""
+        self.generations[session.slot] = self.generations.get(session.slot, 0) + 1
+        key = self.heads.pop(session.slot, None)
+        if key is not None:
+            self.sessions.pop(key, None)
+
+    def current(self, session):
+        """True if the conversation still has the context it had when the session was taken."""
+        return session.generation == self.generations.get(session.slot, 0)
+
+    def stats(self):
+        return {"sessions": len(self.sessions), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,95 @@
+# -*- coding:utf-8 -*-
+import hashlib
+import json
+import os
+import time
+from contextlib import contextmanager
+from claude_to_chatgpt.logger import logger
+
+try:
+    import fcntl
+except ImportError:
+    # no flock on windows, where only a single worker is supported
+    fcntl = None
+
+
+def key_of(secret):
+    """A file name safe key for a token, without writing the token itself to disk."""
+    return hashlib.sha256(secret.encode("utf-8")).hexdigest()[:16]
+
+
+@contextmanager
+def file_lock(path):
+    """Exclusive lock between processes, held while the block runs."""
+    with open(path, "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class SharedState:
+    """
+    State shared by the worker processes of one deployment, kept as JSON files
+    in a directory.
+
+    once() runs an expensive bootstrap in the first worker that needs it, the
+    others wait on the lock and read its result until it is ttl seconds old.
+    Credential cooldowns are kept in one file, so a rate limit seen by one
+    worker is respected by all.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, name):
+        return os.path.join(self.directory, f"{name}.json")
+
+    def read(self, name):
+        try:
+            with open(self.path(name), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def write(self, name, data):
+        tmp_path = f"{self.path(name)}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path(name))
+
+    def read_fresh(self, name, ttl):
+        entry = self.read(name)
+        if not isinstance(entry, dict) or not isinstance(entry.get("saved"), (int, float)):
+            return None
+        if ttl is not None and time.time() - entry["saved"] > ttl:
+            return None
+        return entry.get("value")
+
+    def once(self, name, factory, ttl=None):
+        data = self.read_fresh(name, ttl)
+        if data is not None:
+            return data
+        with file_lock(self.path(name) + ".lock"):
+            # another worker may have finished while we waited
+            data = self.read_fresh(name, ttl)
+            if data is None:
+                logger.info(f"Bootstrapping {name} for all workers")
+                data = factory()
+                self.write(name, {"saved": time.time(), "value": data})
+        return data
+
+    def cooldowns(self):
+        """Wall clock time until which each credential key is cooling down."""
+        return self.read("cooldowns") or {}
+
+    def set_cooldown(self, key, until):
+        with file_lock(self.path("cooldowns") + ".lock"):
+            now = time.time()
+            cooldowns = {k: v for k, v in self.cooldowns().items() if v > now}
+            cooldowns[key] = max(cooldowns.get(key, 0.0), until)
+            self.write("cooldowns", cooldowns)
@@ -0,0 +1,90 @@
+# -*- coding:utf-8 -*-
+import asyncio
+
+_END = object()
+
+
+class _Failure:
+    def __init__(self, error):
+        self.error = error
+
+
+class Flight:
+    def __init__(self):
+        self.items = []
+        self.done = False
+        self.subscribers = set()
+        self.task = None
+
+    def publish(self, item):
+        for queue in self.subscribers:
+            queue.put_nowait(item)
+
+
+class SingleFlight:
+    """
+    Merges identical in-flight requests into one upstream stream.
+
+    The first request for a key starts the upstream call in its own task; later
+    requests with the same key subscribe to it. Every subscriber has its own
+    unbounded queue, so a slow client never holds back the upstream or the
+    other subscribers, and a late subscriber first gets the items it missed.
+    """
+
+    def __init__(self):
+        self.flights = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def subscribe(self, key, factory):
+        flight = self.flights.get(key)
+        if flight is None:
+            flight = Flight()
+            self.flights[key] = flight
+            flight.task = asyncio.create_task(self.run(key, flight, factory()))
+            self.leaders += 1
+        else:
+            self.coalesced += 1
+
+        queue = asyncio.Queue()
+        for item in flight.items:
+            queue.put_nowait(item)
+        if flight.done:
+            queue.put_nowait(_END)
+        flight.subscribers.add(queue)
+        try:
+            while True:
+                item = await queue.get()
+                if item is _END:
+                    break
+                if isinstance(item, _Failure):
+                    raise item.error
+                yield item
+        finally:
+            flight.subscribers.discard(queue)
+            # nobody is listening any more, stop the upstream call
+            if not flight.subscribers and not flight.done:
+                flight.task.cancel()
+
+    async def run(self, key, flight, stream):
+        try:
+            async for item in stream:
+                flight.items.append(item)
+                flight.publish(item)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            flight.publish(_Failure(e))
+        finally:
+            flight.done = True
+            flight.publish(_END)
+            if self.flights.get(key) is flight:
+                del self.flights[key]
+
+    def stats(self):
+        return {
+            "in_flight": len(self.flights),
+            "subscribers": sum(len(flight.subscribers) for flight in self.flights.values()),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+        }
@@ -0,0 +1,107 @@
+# -*- coding:utf-8 -*-
+import json
+from json.encoder import encode_basestring_ascii
+
+
+class SSEDecoder:
+    """Incremental server-sent events parser.
+
+    Raw bytes are fed as they arrive from the network, and the data payload of
+    every event completed so far is returned. Lines and events split across
+    chunks are buffered until the rest arrives.
+    """
+
+    def __init__(self):
+        self.buffer = b""
+        self.data = []
+
+    def feed(self, chunk):
+        events = []
+        self.buffer += chunk
+        lines = self.buffer.split(b"\n")
+        self.buffer = lines.pop()
+        for line in lines:
+            if line.endswith(b"\r"):
+                line = line[:-1]
+            if not line:
+                if self.data:
+                    events.append(b"\n".join(self.data))
+                    self.data = []
+                continue
+            if line.startswith(b"data:"):
+                value = line[5:]
+                if value.startswith(b" "):
+                    value = value[1:]
+                self.data.append(value)
+        return events
+
+    def flush(self):
+        # a stream may end without the blank line that terminates the last event
+        events = self.feed(b"\n\n") if self.buffer or self.data else []
+        self.buffer = b""
+        return events
+
+
+async def aiter_sse(byte_iterator):
+    decoder = SSEDecoder()
+    async for chunk in byte_iterator:
+        for data in decoder.feed(chunk):
+            yield data
+    for data in decoder.flush():
+        yield data
+
+
+class Chunk(dict):
+    """A chat.completion.chunk as built by adapter.chatgpt_chunk, see SSEEncoder."""
+
+    __slots__ = ()
+
+
+class Interrupted(dict):
+    """
+    The finish item, or aggregated response, of a stream cut off by an upstream
+    error, as built by adapter.interrupted. Clients get a normal finish, the
+    response cache does not keep it.
+    """
+
+    __slots__ = ()
+
+
+class SSEEncoder:
+    """Encodes the items of one response stream as SSE events.
+
+    The output is the same as f"data: {json.dumps(item)}\n\n". Chunks from
+    chatgpt_chunk repeat id, created and model within a stream, so they are
+    serialized once into a byte template, and every delta only escapes its
+    content and formats the usage counters. Anything else goes through
+    json.dumps.
+    """
+
+    def __init__(self):
+        self.key = None
+        self.template = None
+
+    def build(self, key):
+        chunk_id, created, model = (json.dumps(value).replace("%", "%%") for value in key)
+        self.key = key
+        self.template = (
+            f'data: {{"id": {chunk_id}, "object": "chat.completion.chunk", "created": {created}, "model": {model}, '
+            '"usage": {"prompt_tokens": %d, "completion_tokens": %d, "total_tokens": %d}, '
+            '"choices": [{"delta": {"role": "assistant", "content": %s}, "index": 0, "finish_reason": null}]}\n\n'
+        ).encode("ascii")
+
+    def encode(self, item):
+        if type(item) is Chunk:
+            content = item["choices"][0]["delta"]["content"]
+            if type(content) is str:
+                key = (item["id"], item["created"], item["model"])
+                if key != self.key:
+                    self.build(key)
+                usage = item["usage"]
+                return self.template % (
+                    usage["prompt_tokens"],
+                    usage["completion_tokens"],
+                    usage["total_tokens"],
+                    encode_basestring_ascii(content).encode("ascii"),
+                )
+        return f"data: {json.dumps(item)}\n\n".encode("utf-8")
@@ -0,0 +1,99 @@
+# -*- coding:utf-8 -*-
+import httpx
+from claude_to_chatgpt.logger import logger
+
+# process-wide upstream client, opened on app startup and closed on shutdown
+_client = None
+
+_settings = {
+    "max_connections": 100,
+    "max_keepalive_connections": 20,
+    "keepalive_expiry": 30.0,
+    "http2": False,
+    "connect_timeout": 10.0,
+    "read_timeout": 60.0,
+    "write_timeout": 60.0,
+    "pool_timeout": 10.0,
+}
+
+
+def configure(**kwargs):
+    for key, value in kwargs.items():
+        if key not in _settings:
+            raise ValueError(f"Unknown transport setting: {key}")
+        if value is not None:
+            _settings[key] = value
+
+
+def http2_available():
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def create_client():
+    http2 = bool(_settings["http2"])
+    if http2 and not http2_available():
+        logger.warning("HTTP/2 requested but the 'h2' package is not installed, using HTTP/1.1")
+        http2 = False
+
+    limits = httpx.Limits(
+        max_connections=_settings["max_connections"],
+        max_keepalive_connections=_settings["max_keepalive_connections"],
+        keepalive_expiry=_settings["keepalive_expiry"],
+    )
+    timeout = httpx.Timeout(
+        connect=_settings["connect_timeout"],
+        read=_settings["read_timeout"],
+        write=_settings["write_timeout"],
+        pool=_settings["pool_timeout"],
+    )
+    return httpx.AsyncClient(limits=limits, timeout=timeout, http2=http2)
+
+
+def get_client():
+    global _client
+    if _client is None or _client.is_closed:
+        _client = create_client()
+    return _client
+
+
+async def startup():
+    get_client()
+
+
+async def shutdown():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def pool_stats():
+    stats = {
+        "max_connections": _settings["max_connections"],
+        "max_keepalive_connections": _settings["max_keepalive_connections"],
+        "keepalive_expiry": _settings["keepalive_expiry"],
+        "http2": bool(_settings["http2"]) and http2_available(),
+        "open": _client is not None and not _client.is_closed,
+        "connections": 0,
+        "idle": 0,
+        "active": 0,
+        "http2_connections": 0,
+    }
+    if not stats["open"]:
+        return stats
+
+    # httpx does not expose its pool, read it from the httpcore transport
+    pool = getattr(getattr(_client, "_transport", None), "_pool", None)
+    for connection in getattr(pool, "connections", []):
+        stats["connections"] += 1
+        if connection.is_idle():
+            stats["idle"] += 1
+        else:
+            stats["active"] += 1
+        if "HTTP/2" in connection.info():
+            stats["http2_connections"] += 1
+    return stats
@@ -0,0 +1,57 @@
+# -*- coding:utf-8 -*-
+import hashlib
+from collections import OrderedDict
+from claude_to_chatgpt.util import TokenCounter, num_tokens_from_string_async
+
+# number of converted prompts whose token counts are remembered
+PROMPT_CACHE_SIZE = 1024
+
+_prompt_tokens = OrderedDict()
+
+
+async def count_prompt_tokens(prompt):
+    """Token count of a converted prompt, memoized by a hash of its content."""
+    key = hashlib.blake2b(prompt.encode("utf-8"), digest_size=16).digest()
+    tokens = _prompt_tokens.get(key)
+    if tokens is not None:
+        _prompt_tokens.move_to_end(key)
+        return tokens
+
+    tokens = await num_tokens_from_string_async(prompt)
+    _prompt_tokens[key] = tokens
+    if len(_prompt_tokens) > PROMPT_CACHE_SIZE:
+        _prompt_tokens.popitem(last=False)
+    return tokens
+
+
+class Usage:
+    """Token usage of one chat completion request."""
+
+    def __init__(self, prompt_tokens=0):
+        self.prompt_tokens = prompt_tokens
+        self.completion = TokenCounter()
+
+    @classmethod
+    async def for_prompt(cls, prompt):
+        return cls(await count_prompt_tokens(prompt))
+
+    @property
+    def completion_tokens(self):
+        return self.completion.tokens
+
+    async def add(self, delta):
+        return await self.completion.add_async(delta)
+
+    def report(self, prompt_tokens=None, completion_tokens=None):
+        """Counts reported by the upstream, they replace the local ones."""
+        if prompt_tokens is not None:
+            self.prompt_tokens = prompt_tokens
+        if completion_tokens is not None:
+            self.completion.tokens = completion_tokens
+
+    def to_dict(self):
+        return {
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion.tokens,
+            "total_tokens": self.prompt_tokens + self.completion.tokens,
+        }
@@ -1,8 +1,45 @@
+import asyncio
+import functools
 import tiktoken
 
+# strings at least this long are tokenized in a worker thread instead of on the event loop
+OFFLOAD_THRESHOLD = 16384
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoding(encoding_name: str = "cl100k_base"):
+    """Loads a tiktoken encoding once per process."""
+    return tiktoken.get_encoding(encoding_name)
+
 
 def num_tokens_from_string(string: str, encoding_name: str = "cl100k_base") -> int:
     """Returns the number of tokens in a text string."""
-    encoding = tiktoken.get_encoding(encoding_name)
-    num_tokens = len(encoding.encode(string))
+    if not string:
+        return 0
+    encoding = get_encoding(encoding_name)
+    num_tokens = len(encoding.encode(string, disallowed_special=()))
     return num_tokens
+
+
+async def num_tokens_from_string_async(string: str, encoding_name: str = "cl100k_base") -> int:
+    """Same as num_tokens_from_string, but large strings do not block the event loop."""
+    if len(string) < OFFLOAD_THRESHOLD:
+        return num_tokens_from_string(string, encoding_name)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, num_tokens_from_string, string, encoding_name)
+
+
+class TokenCounter:
+    """Running token total of a streamed completion, fed one delta at a time."""
+
+    def __init__(self, encoding_name: str = "cl100k_base"):
+        self.encoding_name = encoding_name
+        self.tokens = 0
+
+    def add(self, delta: str) -> int:
+        self.tokens += num_tokens_from_string(delta, self.encoding_name)
+        return self.tokens
+
+    async def add_async(self, delta: str) -> int:
+        self.tokens += await num_tokens_from_string_async(delta, self.encoding_name)
+        return self.tokens
@@ -0,0 +1,23 @@
+import os
+import re
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# adapter.py imports poe and claude as top level modules
+sys.path[:0] = [ROOT, os.path.join(ROOT, "claude_to_chatgpt")]
+
+from claude_to_chatgpt import util  # noqa: E402
+
+
+class WordEncoding:
+    """Stands in for the tiktoken encoding, which would be downloaded on first use."""
+
+    def encode(self, text, **kwargs):
+        return re.findall(r"\w+|[^\w\s]", text)
+
+
+@pytest.fixture(autouse=True)
+def offline_encoding(monkeypatch):
+    monkeypatch.setattr(util, "get_encoding", lambda encoding_name="cl100k_base": WordEncoding())
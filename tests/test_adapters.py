@@ -0,0 +1,263 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from claude_to_chatgpt import adapter, metrics, resilience, transport
+from claude_to_chatgpt.router import Router
+from claude_to_chatgpt.schemas import ChatRequest
+from claude_to_chatgpt.sessions import SessionStore
+from claude_to_chatgpt.sse import Interrupted
+
+LIST_CONTENT = [
+    {"type": "text", "text": "What is "},
+    {"type": "image_url", "image_url": {"url": "https://example.com/cat.png"}},
+    {"type": "text", "text": "this?"},
+]
+
+
+def chat_request(content=LIST_CONTENT, model="gpt-3.5-turbo"):
+    return ChatRequest.from_dict({"model": model, "messages": [{"role": "user", "content": content}], "stream": True})
+
+
+def collect(stream):
+    async def run():
+        return [item async for item in stream]
+
+    return asyncio.run(run())
+
+
+def content_of(items):
+    return "".join(item["choices"][0]["delta"]["content"] for item in items
+                   if isinstance(item, dict) and item["object"] == "chat.completion.chunk")
+
+
+class FakePoeClient:
+    def __init__(self, token, **kwargs):
+        self.token = token
+        self.sent = []
+
+    async def send_message(self, chatbot, message, with_chat_break=False, timeout=20):
+        self.sent.append((chatbot, message, with_chat_break))
+        yield {"text_new": "A cat."}
+
+    async def close(self):
+        pass
+
+
+class FakeClaudeClient:
+    def __init__(self, cookie, organization=None, max_clients=10):
+        self.max_clients = max_clients
+        self.sent = []
+
+    async def send_message(self, prompt, conversation_id):
+        self.sent.append((prompt, conversation_id))
+        yield "A cat."
+
+    async def close(self):
+        pass
+
+
+def test_slack_adapter_sends_text_of_list_content(monkeypatch):
+    bodies = []
+
+    def handler(request):
+        bodies.append(json.loads(request.content))
+        message = {"conversation_id": "conv-1", "message": {"id": "m-1", "content": {"parts": ["A cat."]}}}
+        return httpx.Response(200, content=f"data: {json.dumps(message)}\n\ndata: [DONE]\n\n".encode())
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(transport, "get_client", lambda: client)
+
+    items = collect(adapter.ClaudeSlackAdapter("channel", "token", "http://slack.test").chat(chat_request()))
+
+    assert bodies[0]["messages"][0]["content"]["parts"] == ["What is this?"]
+    assert content_of(items) == "A cat."
+    assert items[-1]["usage"]["prompt_tokens"] > 0
+
+
+def test_poe_adapter_sends_text_of_list_content(monkeypatch):
+    monkeypatch.setattr(adapter.poe, "AsyncClient", FakePoeClient)
+    poe_adapter = adapter.PoeAdapter("token", None, "chinchilla", "a2_2")
+
+    items = collect(poe_adapter.chat(chat_request()))
+
+    assert poe_adapter.pool.credentials[0].client.sent == [("chinchilla", "What is this?", True)]
+    assert content_of(items) == "A cat."
+
+
+def test_claude2_adapter_sends_text_of_list_content(monkeypatch):
+    monkeypatch.setattr(adapter.claude, "Client", FakeClaudeClient)
+    claude2_adapter = adapter.claude2Adapter("cookie", "chat-1", conversations=0)
+
+    items = collect(claude2_adapter.chat(chat_request()))
+
+    assert claude2_adapter.pool.credentials[0].client.sent == [("What is this?", "chat-1")]
+    assert content_of(items) == "A cat."
+
+
+def test_claude2_adapter_without_pool_needs_a_chat_id_per_account(monkeypatch):
+    monkeypatch.setattr(adapter.claude, "Client", FakeClaudeClient)
+
+    with pytest.raises(ValueError, match="CLAUDE2_CHATID"):
+        adapter.claude2Adapter("cookie", None, conversations=0)
+    with pytest.raises(ValueError, match="CLAUDE2_CHATID"):
+        adapter.claude2Adapter(["cookie-a", "cookie-b"], ["chat-a"], conversations=0)
+    # a session store leases conversations from the pool anyway
+    adapter.claude2Adapter("cookie", None, conversations=0, sessions=SessionStore())
+
+
+def test_claude2_sessions_have_room_for_streams_and_the_conversation_pool(monkeypatch):
+    monkeypatch.setattr(adapter.claude, "Client", FakeClaudeClient)
+
+    limited = adapter.claude2Adapter("cookie", None, pool_options={"max_concurrency": 4}, conversations=2)
+    unlimited = adapter.claude2Adapter("cookie", None, conversations=2)
+    configured = adapter.claude2Adapter("cookie", None, conversations=2, max_clients=5)
+
+    assert limited.pool.credentials[0].client.max_clients == 4 + 2 + adapter.claude.DELETE_CONCURRENCY
+    assert unlimited.pool.credentials[0].client.max_clients > 10
+    assert configured.pool.credentials[0].client.max_clients == 5
+
+
+def test_poe_adapter_spreads_streams_of_a_bot_across_accounts(monkeypatch):
+    class SlowPoeClient(FakePoeClient):
+        streaming = 0
+        most = 0
+
+        async def send_message(self, chatbot, message, with_chat_break=False, timeout=20):
+            self.sent.append((chatbot, message, with_chat_break))
+            SlowPoeClient.streaming += 1
+            SlowPoeClient.most = max(SlowPoeClient.most, SlowPoeClient.streaming)
+            await asyncio.sleep(0.01)
+            SlowPoeClient.streaming -= 1
+            yield {"text_new": "A cat."}
+
+    monkeypatch.setattr(adapter.poe, "AsyncClient", SlowPoeClient)
+    poe_adapter = adapter.PoeAdapter("token-a,token-b", None, "chinchilla", "a2_2")
+
+    async def collect_async(stream):
+        return [item async for item in stream]
+
+    async def run():
+        return await asyncio.gather(*[collect_async(poe_adapter.chat(chat_request("Hi"))) for _ in range(4)])
+
+    results = asyncio.run(run())
+
+    assert all(content_of(items) == "A cat." for items in results)
+    # two accounts, so at most two streams of the same bot at once, one per account
+    assert SlowPoeClient.most == 2
+    assert [len(credential.client.sent) for credential in poe_adapter.pool.credentials] == [2, 2]
+
+
+def test_router_labels_metrics_with_the_backend_adapter(monkeypatch):
+    monkeypatch.setattr(adapter.poe, "AsyncClient", FakePoeClient)
+    router = Router({"poe": adapter.PoeAdapter("token", None, "chinchilla", "a2_2")}, {"*": ["poe"]})
+    labels = ("PoeAdapter", "gpt-3.5-turbo")
+    before = metrics.REQUESTS.values.get(labels, 0)
+
+    collect(router.chat(chat_request("Hi")))
+
+    assert metrics.REQUESTS.values.get(labels, 0) == before + 1
+    assert ("Router", "gpt-3.5-turbo") not in metrics.REQUESTS.values
+
+
+def test_router_closes_poe_clients(monkeypatch):
+    closed = []
+
+    class ClosingPoeClient(FakePoeClient):
+        async def close(self):
+            closed.append(self.token)
+
+    monkeypatch.setattr(adapter.poe, "AsyncClient", ClosingPoeClient)
+    router = Router({"poe": adapter.PoeAdapter("token-a,token-b", None, "chinchilla", "a2_2")}, {"*": ["poe"]})
+
+    asyncio.run(router.close())
+
+    assert closed == ["token-a", "token-b"]
+
+
+def test_poe_continuation_replays_a_chat_reset_while_it_waited(monkeypatch):
+    monkeypatch.setattr(adapter.poe, "AsyncClient", FakePoeClient)
+    sessions = SessionStore()
+    poe_adapter = adapter.PoeAdapter("token", None, "chinchilla", "a2_2", pool_options={"max_concurrency": 1},
+                                     sessions=sessions)
+    first = [{"role": "user", "content": "First question"}]
+    continuation = first + [{"role": "assistant", "content": "A cat."}, {"role": "user", "content": "Second question"}]
+    other = [{"role": "user", "content": "Another chat"}]
+
+    def request(messages):
+        return ChatRequest.from_dict({"model": "gpt-3.5-turbo", "messages": messages, "stream": True})
+
+    async def collect_async(stream):
+        return [item async for item in stream]
+
+    async def run():
+        await collect_async(poe_adapter.chat(request(first)))
+        # the only account is busy, the new chat queues first and the continuation after it
+        async with poe_adapter.pool.acquire():
+            new_chat = asyncio.create_task(collect_async(poe_adapter.chat(request(other))))
+            await asyncio.sleep(0)
+            continued = asyncio.create_task(collect_async(poe_adapter.chat(request(continuation))))
+            await asyncio.sleep(0)
+        await asyncio.gather(new_chat, continued)
+
+    asyncio.run(run())
+
+    sent = poe_adapter.pool.credentials[0].client.sent
+    assert sent[1] == ("chinchilla", "Another chat", True)
+    # the new chat's chat break replaced the context, the continuation is replayed in full
+    assert sent[2][2] is True
+    assert "First question" in sent[2][1] and "Second question" in sent[2][1]
+
+
+class CutOffStream(httpx.AsyncByteStream):
+    """An upstream response that fails after its first events."""
+
+    def __init__(self, events, error=None):
+        self.events = events
+        self.error = error
+
+    async def __aiter__(self):
+        for event in self.events:
+            yield event.encode()
+        if self.error is not None:
+            raise self.error
+
+
+def anthropic_adapter(monkeypatch, stream, api_mode):
+    client = httpx.AsyncClient(transport=httpx.MockTransport(lambda request: httpx.Response(200, stream=stream)))
+    monkeypatch.setattr(transport, "get_client", lambda: client)
+    return adapter.ClaudeAdapter("key", "http://anthropic.test", api_mode=api_mode)
+
+
+def test_complete_stream_cut_off_mid_way_ends_interrupted(monkeypatch):
+    stream = CutOffStream(['data: {"completion": "Hel"}\n\n'], httpx.ReadError("connection reset"))
+    claude_adapter = anthropic_adapter(monkeypatch, stream, "complete")
+    labels = ("ClaudeAdapter", "gpt-3.5-turbo")
+    before = metrics.UPSTREAM_ERRORS.values.get(labels, 0)
+    failures = resilience.breaker("anthropic").failures
+
+    items = collect(claude_adapter.chat(chat_request("Hi")))
+
+    assert content_of(items) == "Hel"
+    assert isinstance(items[-1], Interrupted)
+    assert metrics.UPSTREAM_ERRORS.values.get(labels, 0) == before + 1
+    assert resilience.breaker("anthropic").failures == failures + 1
+
+
+def test_messages_error_event_after_content_ends_interrupted(monkeypatch):
+    events = [
+        'event: message_start\ndata: {"type": "message_start", "message": {"usage": {"input_tokens": 5}}}\n\n',
+        'event: content_block_delta\ndata: {"type": "content_block_delta", '
+        '"delta": {"type": "text_delta", "text": "Hel"}}\n\n',
+        'event: error\ndata: {"type": "error", "error": {"type": "overloaded_error", "message": "Overloaded"}}\n\n',
+    ]
+    claude_adapter = anthropic_adapter(monkeypatch, CutOffStream(events), "messages")
+
+    items = collect(claude_adapter.chat(chat_request("Hi")))
+
+    assert content_of(items) == "Hel"
+    assert isinstance(items[-1], Interrupted)
+    assert items[-1]["choices"][0]["finish_reason"] == "stop"
+    assert items[-1]["usage"]["prompt_tokens"] == 5
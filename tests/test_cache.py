@@ -0,0 +1,85 @@
+import asyncio
+import json
+
+import httpx
+
+from claude_to_chatgpt import adapter, transport
+from claude_to_chatgpt.cache import ResponseCache
+from claude_to_chatgpt.schemas import ChatRequest
+from claude_to_chatgpt.usage import Usage
+
+
+def record(cache, key, stream):
+    async def run():
+        return [item async for item in cache.record(key, stream)]
+
+    return asyncio.run(run())
+
+
+async def items(*values):
+    for value in values:
+        yield value
+
+
+def chunk(text):
+    return adapter.chatgpt_chunk(1.0, "gpt-3.5-turbo", text, Usage())
+
+
+def test_completed_stream_is_cached():
+    cache = ResponseCache()
+    record(cache, "key", items(chunk("Hello"), adapter.finish(1.0, "gpt-3.5-turbo"), "[DONE]"))
+
+    assert asyncio.run(cache.get("key")) is not None
+
+
+def test_interrupted_stream_is_not_cached():
+    cache = ResponseCache()
+    record(cache, "key", items(chunk("Hel"), adapter.interrupted(1.0, "gpt-3.5-turbo")))
+
+    assert asyncio.run(cache.get("key")) is None
+
+
+def test_stream_without_finish_is_not_cached():
+    cache = ResponseCache()
+    record(cache, "key", items(chunk("Hel")))
+
+    assert asyncio.run(cache.get("key")) is None
+
+
+def test_interrupted_aggregate_is_not_cached():
+    cache = ResponseCache()
+    response = asyncio.run(adapter.aggregate(items(chunk("Hel"), adapter.interrupted(1.0, "gpt-3.5-turbo"))))
+    asyncio.run(cache.put("key", [response]))
+
+    assert response["choices"][0]["message"]["content"] == "Hel"
+    assert asyncio.run(cache.get("key")) is None
+
+
+class FailingStream(httpx.AsyncByteStream):
+    """A relay response that is cut off after its first event."""
+
+    async def __aiter__(self):
+        message = {"conversation_id": "conv-1", "message": {"id": "m-1", "content": {"parts": ["Hel"]}}}
+        yield f"data: {json.dumps(message)}\n\n".encode()
+        raise httpx.ReadError("connection reset")
+
+
+def test_slack_stream_failing_mid_way_is_not_cached(monkeypatch):
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(200, stream=FailingStream())
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(transport, "get_client", lambda: client)
+    slack = adapter.ClaudeSlackAdapter("channel", "token", "http://slack.test")
+    request = ChatRequest.from_dict({"model": "gpt-3.5-turbo", "messages": [{"role": "user", "content": "Hi"}],
+                                     "stream": True, "temperature": 0})
+    cache = ResponseCache()
+
+    first = record(cache, "key", slack.chat(request))
+
+    assert first[-1]["choices"][0]["finish_reason"] == "stop"
+    assert asyncio.run(cache.get("key")) is None
+    assert len(calls) == 1
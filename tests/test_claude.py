@@ -0,0 +1,94 @@
+import asyncio
+
+import pytest
+
+import claude
+
+
+class FakeResponse:
+    def __init__(self, chunks, status_code=200):
+        self.chunks = chunks
+        self.status_code = status_code
+        self.closed = False
+
+    async def aiter_content(self):
+        for chunk in self.chunks:
+            yield chunk
+
+    async def aclose(self):
+        self.closed = True
+
+
+class FakeSession:
+    def __init__(self, response):
+        self.response = response
+
+    async def post(self, url, headers=None, data=None, stream=False):
+        return self.response
+
+
+class FakeJSONResponse:
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.body = body
+
+    def json(self):
+        return self.body
+
+
+def send(response):
+    client = claude.Client("cookie", organization="org")
+    client.session = FakeSession(response)
+
+    async def run():
+        return [completion async for completion in client.send_message("Hi", "conv-1")]
+
+    return asyncio.run(run())
+
+
+def test_send_message_yields_completions_as_they_arrive():
+    response = FakeResponse([
+        b'data: {"completion": "Hel", "stop_reason": null}\r\n\r\ndata: {"comp',
+        b'letion": "lo", "stop_reason": null}\r\n\r\n',
+        b'data: {"completion": "", "stop_reason": "stop_sequence"}\r\n\r\n',
+    ])
+
+    assert send(response) == ["Hel", "lo", ""]
+    assert response.closed
+
+
+def test_send_message_raises_on_rate_limit():
+    response = FakeResponse([], status_code=429)
+
+    with pytest.raises(claude.RateLimitError):
+        send(response)
+    assert response.closed
+
+
+def test_session_opens_the_configured_connections():
+    client = claude.Client("cookie", max_clients=40)
+
+    async def run():
+        try:
+            return client.get_session().max_clients
+        finally:
+            await client.close()
+
+    assert asyncio.run(run()) == 40
+
+
+def test_create_new_chat_returns_the_conversation():
+    client = claude.Client("cookie", organization="org")
+    client.session = FakeSession(FakeJSONResponse(201, {"uuid": "conv-1"}))
+
+    assert asyncio.run(client.create_new_chat()) == {"uuid": "conv-1"}
+
+
+@pytest.mark.parametrize("status_code, error", [(429, claude.RateLimitError), (403, RuntimeError),
+                                                (500, RuntimeError)])
+def test_create_new_chat_raises_on_an_error_status(status_code, error):
+    client = claude.Client("cookie", organization="org")
+    client.session = FakeSession(FakeJSONResponse(status_code, {"error": {"message": "Forbidden"}}))
+
+    with pytest.raises(error, match="status|rate limit"):
+        asyncio.run(client.create_new_chat())
@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+
+from claude_to_chatgpt import adapter
+from claude_to_chatgpt.coalesce import coalesce
+from claude_to_chatgpt.sse import Chunk
+from claude_to_chatgpt.usage import Usage
+
+
+def chunk(text, completion_tokens):
+    usage = Usage(1)
+    usage.report(completion_tokens=completion_tokens)
+    return adapter.chatgpt_chunk(1.0, "gpt-3.5-turbo", text, usage)
+
+
+async def timed(items):
+    """Yields each item after the delay paired with it."""
+    for delay, item in items:
+        await asyncio.sleep(delay)
+        yield item
+
+
+def run(stream):
+    async def collect():
+        return [item async for item in stream]
+
+    return asyncio.run(collect())
+
+
+def contents(items):
+    return [item["choices"][0]["delta"]["content"] if item["object"] == "chat.completion.chunk" else item["object"]
+            for item in items]
+
+
+def test_chunks_within_the_window_are_merged():
+    items = run(coalesce(timed([(0, chunk("Hel", 1)), (0, chunk("lo", 2)), (0.2, chunk(" world", 3))]), window=0.05))
+
+    assert contents(items) == ["Hello", " world"]
+    # a merged chunk carries the usage of its last delta
+    assert items[0]["usage"]["completion_tokens"] == 2
+    assert type(items[0]) is Chunk
+
+
+def test_byte_limit_flushes_before_the_window_ends():
+    items = run(coalesce(timed([(0, chunk("ab", 1)), (0, chunk("cd", 2)), (0, chunk("e", 3))]),
+                         window=10, max_bytes=4))
+
+    assert contents(items) == ["abcd", "e"]
+
+
+def test_other_items_flush_what_is_held():
+    finish = adapter.finish(1.0, "gpt-3.5-turbo")
+    items = run(coalesce(timed([(0, chunk("Hel", 1)), (0, chunk("lo", 2)), (0, finish), (0, "[DONE]")]), window=10))
+
+    assert items[0]["choices"][0]["delta"]["content"] == "Hello"
+    assert items[1:] == [finish, "[DONE]"]
+
+
+def test_upstream_error_sends_what_is_held_first():
+    async def failing():
+        yield chunk("Hel", 1)
+        raise RuntimeError("upstream down")
+
+    received = []
+
+    async def collect():
+        async for item in coalesce(failing(), window=10):
+            received.append(item)
+
+    with pytest.raises(RuntimeError, match="upstream down"):
+        asyncio.run(collect())
+    assert contents(received) == ["Hel"]
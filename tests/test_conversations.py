@@ -0,0 +1,39 @@
+import asyncio
+
+from claude_to_chatgpt.conversations import ConversationPool
+
+
+class FakeClaudeClient:
+    def __init__(self):
+        self.count = 0
+        self.conversations = set()
+
+    async def create_new_chat(self):
+        self.count += 1
+        self.conversations.add(f"conv-{self.count}")
+        return {"uuid": f"conv-{self.count}"}
+
+    async def delete_conversations(self, conversation_ids):
+        deleted = [conversation_id for conversation_id in conversation_ids if conversation_id in self.conversations]
+        self.conversations.difference_update(deleted)
+        return deleted
+
+
+def test_close_deletes_warm_leased_and_retired_conversations():
+    client = FakeClaudeClient()
+    pool = ConversationPool(client, size=2, gc_interval=60, gc_batch=2)
+
+    async def run():
+        retired = await pool.lease()
+        await pool.lease()
+        # let the background task top the warm conversations up
+        await asyncio.sleep(0.01)
+        pool.retire(retired)
+        await pool.close()
+
+    asyncio.run(run())
+
+    assert client.count > 0
+    assert client.conversations == set()
+    assert pool.stats()["deleted"] == client.count
+    assert pool.task is None
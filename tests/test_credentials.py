@@ -0,0 +1,111 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from claude_to_chatgpt.credentials import Credential, CredentialPool
+
+
+async def acquire_many(pool, count):
+    start = time.monotonic()
+    for _ in range(count):
+        async with pool.acquire():
+            pass
+    return time.monotonic() - start
+
+
+def test_pool_without_limits_does_not_throttle():
+    pool = CredentialPool([Credential("key-a")])
+
+    assert asyncio.run(acquire_many(pool, 50)) < 0.5
+
+
+def test_pool_without_limits_spreads_requests():
+    pool = CredentialPool([Credential("key-a"), Credential("key-b")])
+
+    async def run():
+        async with pool.acquire() as first, pool.acquire() as second:
+            return first, second
+
+    first, second = asyncio.run(run())
+    assert first is not second
+
+
+def test_configured_rate_limits_requests():
+    pool = CredentialPool([Credential("key-a", rate=20, burst=1)], acquire_timeout=5)
+
+    # the first request uses the burst, the other two wait 1/20 s each
+    assert asyncio.run(acquire_many(pool, 3)) == pytest.approx(0.1, abs=0.05)
+
+
+def test_configured_concurrency_limits_requests():
+    pool = CredentialPool([Credential("key-a", max_concurrency=1)], acquire_timeout=0.1)
+
+    async def run():
+        async with pool.acquire():
+            async with pool.acquire():
+                pass
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(run())
+
+
+class SlowSharedState:
+    """Shared cooldowns behind slow file I/O, records the threads that used it."""
+
+    def __init__(self, cooldowns=None):
+        self.data = dict(cooldowns or {})
+        self.threads = []
+
+    def cooldowns(self):
+        self.threads.append(threading.get_ident())
+        time.sleep(0.05)
+        return dict(self.data)
+
+    def set_cooldown(self, key, until):
+        self.threads.append(threading.get_ident())
+        time.sleep(0.05)
+        self.data[key] = until
+
+
+def test_shared_cooldowns_are_read_off_the_event_loop():
+    first, second = Credential("key-a"), Credential("key-b")
+    shared = SlowSharedState({first.key: time.time() + 60})
+    pool = CredentialPool([first, second], shared=shared, sync_interval=0)
+
+    async def run():
+        start = time.monotonic()
+        async with pool.acquire():
+            pass
+        waited = time.monotonic() - start
+        # the read finishes in its thread, later requests skip the credential another worker cooled down
+        await asyncio.sleep(0.1)
+        picked = []
+        for _ in range(3):
+            async with pool.acquire() as credential:
+                picked.append(credential)
+        return waited, picked
+
+    waited, picked = asyncio.run(run())
+
+    assert waited < 0.05
+    assert picked == [second, second, second]
+    assert threading.get_ident() not in shared.threads
+
+
+def test_cooldown_is_shared_off_the_event_loop():
+    credential = Credential("key-a")
+    shared = SlowSharedState()
+    pool = CredentialPool([credential], shared=shared)
+
+    async def run():
+        start = time.monotonic()
+        pool.cooldown(credential, 30)
+        blocked = time.monotonic() - start
+        await asyncio.gather(*pool.background)
+        return blocked
+
+    assert asyncio.run(run()) < 0.05
+    assert shared.data[credential.key] > time.time() + 20
+    assert threading.get_ident() not in shared.threads
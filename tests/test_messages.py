@@ -0,0 +1,111 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from claude_to_chatgpt import adapter, resilience, transport
+from claude_to_chatgpt.schemas import ChatRequest
+from claude_to_chatgpt.sse import Interrupted
+
+
+def sse(*events):
+    return "".join(f"event: {event['type']}\ndata: {json.dumps(event)}\n\n" for event in events).encode()
+
+
+def text_delta(text):
+    return {"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": text}}
+
+
+MESSAGE_START = {"type": "message_start", "message": {"id": "msg_1", "usage": {"input_tokens": 10, "output_tokens": 1}}}
+
+
+def messages_adapter(monkeypatch, content, requests=None):
+    def handler(request):
+        if requests is not None:
+            requests.append(json.loads(request.content))
+        return httpx.Response(200, content=content)
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(transport, "get_client", lambda: client)
+    return adapter.ClaudeAdapter("key", "http://anthropic.test", api_mode="messages")
+
+
+def chat(claude_adapter, messages=None, stream=True):
+    request = ChatRequest.from_dict({"model": "gpt-3.5-turbo", "stream": stream,
+                                     "messages": messages or [{"role": "user", "content": "Hi"}]})
+
+    async def run():
+        return [item async for item in claude_adapter.chat(request)]
+
+    return asyncio.run(run())
+
+
+def test_stream_events_become_chunks_and_a_finish(monkeypatch):
+    content = sse(
+        MESSAGE_START,
+        {"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}},
+        {"type": "ping"},
+        text_delta("Hello"),
+        text_delta(" world"),
+        {"type": "content_block_stop", "index": 0},
+        {"type": "message_delta", "delta": {"stop_reason": "max_tokens"}, "usage": {"output_tokens": 7}},
+        {"type": "message_stop"},
+    )
+
+    items = chat(messages_adapter(monkeypatch, content))
+
+    assert [item["choices"][0]["delta"]["content"] for item in items[:-1]] == ["Hello", " world"]
+    assert items[-1]["object"] == "chat.completion"
+    assert items[-1]["choices"][0]["finish_reason"] == "length"
+    # message_delta carries the final output token count
+    assert items[-1]["usage"] == {"prompt_tokens": 10, "completion_tokens": 7, "total_tokens": 17}
+
+
+def test_error_event_before_content_goes_to_the_caller(monkeypatch):
+    content = sse(MESSAGE_START, {"type": "error", "error": {"type": "overloaded_error", "message": "Overloaded"}})
+
+    with pytest.raises(resilience.UpstreamError, match="Overloaded"):
+        chat(messages_adapter(monkeypatch, content))
+
+
+def test_stream_without_message_stop_is_interrupted(monkeypatch):
+    items = chat(messages_adapter(monkeypatch, sse(MESSAGE_START, text_delta("Hello"), text_delta(" big world"))))
+
+    assert isinstance(items[-1], Interrupted)
+    # without message_delta the deltas are counted locally
+    assert [item["usage"]["completion_tokens"] for item in items] == [1, 3, 3]
+    assert items[-1]["usage"]["prompt_tokens"] == 10
+
+
+def test_non_streaming_message(monkeypatch):
+    message = {"content": [{"type": "text", "text": "Hello"}, {"type": "text", "text": " world"}],
+               "stop_reason": "end_turn", "usage": {"input_tokens": 10, "output_tokens": 2}}
+
+    items = chat(messages_adapter(monkeypatch, json.dumps(message).encode()), stream=False)
+
+    assert items[0]["choices"][0]["message"]["content"] == "Hello world"
+    assert items[0]["choices"][0]["finish_reason"] == "stop"
+    assert items[0]["usage"] == {"prompt_tokens": 10, "completion_tokens": 2, "total_tokens": 12}
+
+
+def test_request_params(monkeypatch):
+    requests = []
+    claude_adapter = messages_adapter(monkeypatch, sse(MESSAGE_START, {"type": "message_stop"}), requests)
+
+    chat(claude_adapter, [
+        {"role": "system", "content": "Be brief."},
+        {"role": "system", "content": "Be kind."},
+        {"role": "user", "content": [
+            {"type": "text", "text": "What is this?"},
+            {"type": "image_url", "image_url": {"url": "data:image/png;base64,AAAA"}},
+        ]},
+    ])
+
+    params = requests[0]
+    assert params["model"] == "claude-3-haiku-20240307"
+    assert params["system"] == "Be brief.\n\nBe kind."
+    assert params["messages"] == [{"role": "user", "content": [
+        {"type": "text", "text": "What is this?"},
+        {"type": "image", "source": {"type": "base64", "media_type": "image/png", "data": "AAAA"}},
+    ]}]
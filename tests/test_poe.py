@@ -0,0 +1,39 @@
+import pytest
+
+import poe
+
+
+@pytest.fixture
+def client(monkeypatch):
+    # no session bootstrap or websocket, bots are resolved through the stubs below
+    monkeypatch.setattr(poe.Client, "connect_ws", lambda self, timeout=5: None)
+    client = poe.Client("token", bootstrap_cache=False)
+    codenames = {handle: codename for codename, handle in poe.bot_handles.items()}
+    client.handles = []
+
+    def get_bot(handle):
+        client.handles.append(handle)
+        codename = codenames.get(handle, handle)
+        return {"chatId": len(client.handles), "defaultBotObject": {"nickname": codename, "displayName": handle}}
+
+    def get_bots(download_next_data=True):
+        raise AssertionError("all bots were downloaded")
+
+    client.get_bot = get_bot
+    client.get_bots = get_bots
+    return client
+
+
+@pytest.mark.parametrize("codename, handle", [("chinchilla", "ChatGPT"), ("a2_2", "Claude-2-100k")])
+def test_default_bots_resolve_without_downloading_all_bots(client, codename, handle):
+    chat_data = client.get_bot_by_codename(codename)
+
+    assert chat_data["defaultBotObject"]["nickname"] == codename
+    assert client.handles == [handle]
+
+
+def test_resolved_bots_are_cached(client):
+    client.get_bot_by_codename("chinchilla")
+    client.get_bot_by_codename("chinchilla")
+
+    assert client.handles == ["ChatGPT"]
@@ -0,0 +1,132 @@
+import asyncio
+import time
+
+import pytest
+
+from claude_to_chatgpt import resilience
+from claude_to_chatgpt.resilience import CircuitBreaker, CircuitOpenError, RetryBudget, UpstreamError
+
+
+@pytest.fixture(autouse=True)
+def fresh_resilience(monkeypatch):
+    monkeypatch.setattr(resilience, "BREAKERS", {})
+    monkeypatch.setattr(resilience, "BUDGET", RetryBudget())
+    monkeypatch.setattr(resilience, "_settings", dict(resilience._settings, base_delay=0.0))
+
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker("test", failure_threshold=3, reset_timeout=60)
+
+    for _ in range(2):
+        breaker.allow()
+        breaker.record_failure()
+    breaker.allow()
+    breaker.record_success()
+    for _ in range(3):
+        breaker.allow()
+        breaker.record_failure()
+
+    assert breaker.state == resilience.OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+
+
+def test_half_open_breaker_lets_one_probe_through():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+
+    breaker.allow()
+    assert breaker.state == resilience.HALF_OPEN
+    # the probe is in flight, everything else still fails fast
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+
+    breaker.record_success()
+    assert breaker.state == resilience.CLOSED
+    breaker.allow()
+
+
+def test_failed_probe_opens_the_breaker_again():
+    breaker = CircuitBreaker("test", failure_threshold=3, reset_timeout=0.05)
+    for _ in range(3):
+        breaker.record_failure()
+    time.sleep(0.06)
+
+    breaker.allow()
+    breaker.record_failure()
+
+    assert breaker.state == resilience.OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+
+
+def test_released_probe_lets_the_next_one_through():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+
+    breaker.allow()
+    # e.g. a 4xx, it says nothing about the upstream
+    breaker.release()
+
+    breaker.allow()
+    assert breaker.state == resilience.HALF_OPEN
+
+
+def test_retry_budget_is_exhausted_and_refilled_by_requests():
+    budget = RetryBudget(ratio=0.5, min_per_second=0, capacity=2)
+
+    assert budget.try_retry()
+    assert budget.try_retry()
+    assert not budget.try_retry()
+
+    budget.record_request()
+    budget.record_request()
+    assert budget.try_retry()
+    assert not budget.try_retry()
+
+
+def test_call_stops_retrying_when_the_budget_is_exhausted(monkeypatch):
+    monkeypatch.setattr(resilience, "BUDGET", RetryBudget(ratio=0, min_per_second=0, capacity=1))
+    attempts = []
+
+    async def failing():
+        attempts.append(1)
+        raise UpstreamError("503")
+
+    with pytest.raises(UpstreamError):
+        asyncio.run(resilience.call("test", failing, max_attempts=5))
+
+    # the first try and the one retry the budget allowed
+    assert len(attempts) == 2
+    assert resilience.breaker("test").failures == 2
+
+
+def test_call_retries_until_success():
+    attempts = []
+
+    async def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise UpstreamError("503")
+        return "ok"
+
+    assert asyncio.run(resilience.call("test", flaky, max_attempts=3)) == "ok"
+    assert resilience.breaker("test").stats() == {"state": resilience.CLOSED, "failures": 0}
+
+
+def test_call_fails_fast_while_the_breaker_is_open():
+    resilience.configure(failure_threshold=1, reset_timeout=60)
+    attempts = []
+
+    async def failing():
+        attempts.append(1)
+        raise UpstreamError("503")
+
+    with pytest.raises(UpstreamError):
+        asyncio.run(resilience.call("test", failing, max_attempts=1))
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(resilience.call("test", failing, max_attempts=1))
+
+    assert len(attempts) == 1
@@ -0,0 +1,150 @@
+import asyncio
+
+import pytest
+
+from claude_to_chatgpt import adapter
+from claude_to_chatgpt.router import Router, parse_routes
+from claude_to_chatgpt.schemas import ChatRequest
+from claude_to_chatgpt.usage import Usage
+
+
+class FakeAdapter:
+    """Streams `chunks`, then raises `error` if one is given, or ends with `end` or a finish item."""
+
+    def __init__(self, chunks=("Hi",), error=None, end=None):
+        self.chunks = chunks
+        self.error = error
+        self.end = end
+        self.calls = 0
+
+    async def chat(self, chat_request):
+        self.calls += 1
+        for text in self.chunks:
+            yield adapter.chatgpt_chunk(1.0, chat_request.model, text, Usage())
+        if self.error is not None:
+            raise self.error
+        yield self.end or adapter.finish(1.0, chat_request.model)
+
+
+def chat_request(model="gpt-3.5-turbo"):
+    return ChatRequest.from_dict({"model": model, "messages": [{"role": "user", "content": "Hi"}], "stream": True})
+
+
+def collect(router, model="gpt-3.5-turbo"):
+    async def run():
+        return [item async for item in router.chat(chat_request(model))]
+
+    return asyncio.run(run())
+
+
+def test_parse_routes():
+    assert parse_routes("gpt-3.5-turbo=claude, poe;gpt-4=poe;bad;*=claude") == {
+        "gpt-3.5-turbo": ["claude", "poe"],
+        "gpt-4": ["poe"],
+        "*": ["claude"],
+    }
+
+
+def test_unknown_backend_in_a_route_is_rejected():
+    with pytest.raises(ValueError, match="unknown backends: slack"):
+        Router({"claude": FakeAdapter()}, {"*": ["claude", "slack"]})
+
+
+def test_fails_over_before_the_first_chunk():
+    failing = FakeAdapter(chunks=(), error=RuntimeError("down"))
+    working = FakeAdapter(chunks=("Hello",))
+    router = Router({"failing": failing, "working": working}, {"*": ["failing", "working"]})
+
+    items = collect(router)
+
+    assert items[0]["choices"][0]["delta"]["content"] == "Hello"
+    assert (failing.calls, working.calls) == (1, 1)
+    assert router.backends["failing"].failures == 1
+    assert router.backends["working"].latency is not None
+
+
+def test_does_not_fail_over_after_the_first_chunk():
+    failing = FakeAdapter(chunks=("Hel",), error=RuntimeError("cut off"))
+    working = FakeAdapter()
+    router = Router({"failing": failing, "working": working}, {"*": ["failing", "working"]})
+    received = []
+
+    async def run():
+        async for item in router.chat(chat_request()):
+            received.append(item)
+
+    with pytest.raises(RuntimeError, match="cut off"):
+        asyncio.run(run())
+
+    assert [item["choices"][0]["delta"]["content"] for item in received] == ["Hel"]
+    assert working.calls == 0
+    assert router.backends["failing"].failures == 1
+    assert router.backends["failing"].in_flight == 0
+
+
+def test_interrupted_stream_counts_as_a_failure():
+    cut_off = FakeAdapter(chunks=("Hel",), end=adapter.interrupted(1.0, "gpt-3.5-turbo"))
+    router = Router({"cut_off": cut_off}, {"*": ["cut_off"]})
+
+    collect(router)
+
+    assert router.backends["cut_off"].failures == 1
+
+
+def test_last_error_is_raised_when_every_backend_fails():
+    router = Router({"a": FakeAdapter(chunks=(), error=RuntimeError("a down")),
+                     "b": FakeAdapter(chunks=(), error=RuntimeError("b down"))}, {"*": ["a", "b"]})
+
+    with pytest.raises(RuntimeError, match="b down"):
+        collect(router)
+
+
+def test_failed_backend_is_tried_last():
+    failing = FakeAdapter(chunks=(), error=RuntimeError("down"))
+    working = FakeAdapter()
+    router = Router({"failing": failing, "working": working}, {"*": ["failing", "working"]})
+
+    collect(router)
+    collect(router)
+
+    assert (failing.calls, working.calls) == (1, 2)
+
+
+def test_models_use_their_own_route():
+    claude = FakeAdapter()
+    poe = FakeAdapter()
+    router = Router({"claude": claude, "poe": poe}, {"gpt-4": ["poe"], "*": ["claude"]})
+
+    collect(router, "gpt-4")
+    collect(router, "gpt-3.5-turbo")
+
+    assert (claude.calls, poe.calls) == (1, 1)
+
+
+def test_unmeasured_backends_share_a_burst():
+    release = None
+
+    class BlockedAdapter(FakeAdapter):
+        async def chat(self, chat_request):
+            self.calls += 1
+            await release.wait()
+            yield adapter.finish(1.0, chat_request.model)
+
+    first, second = BlockedAdapter(), BlockedAdapter()
+    router = Router({"first": first, "second": second}, {"*": ["first", "second"]})
+
+    async def run():
+        nonlocal release
+        release = asyncio.Event()
+
+        async def stream():
+            return [item async for item in router.chat(chat_request())]
+
+        streams = [asyncio.create_task(stream()) for _ in range(4)]
+        await asyncio.sleep(0.01)
+        release.set()
+        await asyncio.gather(*streams)
+
+    asyncio.run(run())
+
+    assert (first.calls, second.calls) == (2, 2)
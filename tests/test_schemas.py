@@ -0,0 +1,49 @@
+import os
+import re
+
+import pytest
+from fastapi.testclient import TestClient
+
+from claude_to_chatgpt.schemas import ChatRequest
+
+# app.py builds its adapter on import, the Anthropic one needs no credentials
+os.environ.setdefault("MODEL", "claude")
+from claude_to_chatgpt import app  # noqa: E402
+
+
+def test_parse_reads_the_typed_fields():
+    request = ChatRequest.parse(b'{"model": "gpt-4", "messages": [{"role": "user", "content": "Hi"}], '
+                                b'"stream": true, "temperature": 0, "stop": "END", "max_tokens": 10}',
+                                {"authorization": "Bearer key"})
+
+    assert request.model == "gpt-4"
+    assert request.messages == [{"role": "user", "content": "Hi"}]
+    assert request.stream is True
+    assert request.temperature == 0
+    assert request.stop == ["END"]
+    assert request.max_tokens == 10
+    assert request.headers == {"authorization": "Bearer key"}
+    assert request.params["stop"] == "END"
+
+
+@pytest.mark.parametrize("body, message", [
+    (b'{"model": ', "not valid JSON"),
+    (b'[]', "must be a JSON object"),
+    (b'{"messages": [{"role": "user", "content": "Hi"}]}', "'model'"),
+    (b'{"model": "gpt-4", "messages": []}', "'messages'"),
+    (b'{"model": "gpt-4", "messages": [{"role": "bot", "content": "Hi"}]}', "messages[0].role"),
+    (b'{"model": "gpt-4", "messages": [{"role": "user", "content": 1}]}', "messages[0].content"),
+    (b'{"model": "gpt-4", "messages": [{"role": "user", "content": "Hi"}], "stream": "yes"}', "'stream'"),
+    (b'{"model": "gpt-4", "messages": [{"role": "user", "content": "Hi"}], "temperature": true}', "'temperature'"),
+    (b'{"model": "gpt-4", "messages": [{"role": "user", "content": "Hi"}], "max_tokens": 1.5}', "'max_tokens'"),
+    (b'{"model": "gpt-4", "messages": [{"role": "user", "content": "Hi"}], "stop": [1]}', "'stop'"),
+])
+def test_invalid_request_is_answered_with_400(body, message):
+    with pytest.raises(ValueError, match=re.escape(message)):
+        ChatRequest.parse(body)
+
+    response = TestClient(app.app).post("/v1/chat/completions", content=body)
+
+    assert response.status_code == 400
+    assert response.json()["error"]["type"] == "invalid_request_error"
+    assert message in response.json()["error"]["message"]
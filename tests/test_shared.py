@@ -0,0 +1,31 @@
+import json
+import os
+import time
+
+from claude_to_chatgpt.shared import SharedState
+
+
+def test_once_runs_the_factory_once(tmp_path):
+    shared = SharedState(str(tmp_path))
+    calls = []
+
+    def factory():
+        calls.append(1)
+        return {"formkey": "a"}
+
+    assert shared.once("poe", factory, ttl=60) == {"formkey": "a"}
+    assert shared.once("poe", factory, ttl=60) == {"formkey": "a"}
+    assert len(calls) == 1
+
+
+def test_once_runs_the_factory_again_after_the_ttl(tmp_path):
+    shared = SharedState(str(tmp_path))
+    shared.once("poe", lambda: {"formkey": "old"}, ttl=60)
+    path = os.path.join(str(tmp_path), "poe.json")
+    with open(path) as f:
+        entry = json.load(f)
+    entry["saved"] = time.time() - 120
+    with open(path, "w") as f:
+        json.dump(entry, f)
+
+    assert shared.once("poe", lambda: {"formkey": "new"}, ttl=60) == {"formkey": "new"}
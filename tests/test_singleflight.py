@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+
+from claude_to_chatgpt.singleflight import SingleFlight
+
+# seconds between the items of an upstream stream
+DELAY = 0.05
+
+
+class Upstream:
+    """Streams its items DELAY seconds apart, and counts its calls."""
+
+    def __init__(self, items, error=None):
+        self.items = items
+        self.error = error
+        self.calls = 0
+        self.cancelled = False
+
+    async def stream(self):
+        self.calls += 1
+        try:
+            for item in self.items:
+                await asyncio.sleep(DELAY)
+                yield item
+            if self.error is not None:
+                raise self.error
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+
+
+async def collect(stream):
+    return [item async for item in stream]
+
+
+def test_identical_requests_share_one_upstream_call():
+    flights = SingleFlight()
+    upstream = Upstream(["a", "b", "c"])
+
+    async def run():
+        first = asyncio.create_task(collect(flights.subscribe("key", upstream.stream)))
+        await asyncio.sleep(DELAY * 1.5)
+        # joins after the first item, and still gets it
+        second = asyncio.create_task(collect(flights.subscribe("key", upstream.stream)))
+        return await asyncio.gather(first, second)
+
+    assert asyncio.run(run()) == [["a", "b", "c"], ["a", "b", "c"]]
+    assert upstream.calls == 1
+    assert flights.stats() == {"in_flight": 0, "subscribers": 0, "leaders": 1, "coalesced": 1}
+
+
+def test_upstream_error_reaches_every_subscriber():
+    flights = SingleFlight()
+    upstream = Upstream(["a"], RuntimeError("upstream down"))
+
+    async def run():
+        return await asyncio.gather(collect(flights.subscribe("key", upstream.stream)),
+                                    collect(flights.subscribe("key", upstream.stream)), return_exceptions=True)
+
+    results = asyncio.run(run())
+
+    assert [str(result) for result in results] == ["upstream down", "upstream down"]
+    assert upstream.calls == 1
+
+
+def test_cancelled_subscriber_does_not_stop_the_others():
+    flights = SingleFlight()
+    upstream = Upstream(["a", "b", "c"])
+
+    async def run():
+        leaving = asyncio.create_task(collect(flights.subscribe("key", upstream.stream)))
+        staying = asyncio.create_task(collect(flights.subscribe("key", upstream.stream)))
+        await asyncio.sleep(DELAY * 1.5)
+        leaving.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leaving
+        return await staying
+
+    assert asyncio.run(run()) == ["a", "b", "c"]
+    assert not upstream.cancelled
+
+
+def test_upstream_call_stops_when_every_subscriber_left():
+    flights = SingleFlight()
+    upstream = Upstream(["a", "b", "c"])
+
+    async def run():
+        subscriber = asyncio.create_task(collect(flights.subscribe("key", upstream.stream)))
+        await asyncio.sleep(DELAY * 1.5)
+        subscriber.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await subscriber
+        await asyncio.sleep(DELAY)
+
+    asyncio.run(run())
+
+    assert upstream.cancelled
+    assert flights.stats()["in_flight"] == 0
@@ -0,0 +1,84 @@
+import asyncio
+import json
+
+import pytest
+
+from claude_to_chatgpt import adapter
+from claude_to_chatgpt.sse import SSEDecoder, SSEEncoder, aiter_sse
+from claude_to_chatgpt.usage import Usage
+
+
+def decode(chunks):
+    async def stream():
+        for chunk in chunks:
+            yield chunk
+
+    async def run():
+        return [data async for data in aiter_sse(stream())]
+
+    return asyncio.run(run())
+
+
+def test_decoder_joins_events_split_across_reads():
+    decoder = SSEDecoder()
+
+    assert decoder.feed(b'event: completion\ndata: {"completion": "He') == []
+    assert decoder.feed(b'llo"}\n') == []
+    assert decoder.feed(b'\ndata: {"completion": " world"}\n\nda') == [b'{"completion": "Hello"}',
+                                                                      b'{"completion": " world"}']
+    assert decoder.feed(b"ta: [DONE]\n\n") == [b"[DONE]"]
+
+
+def test_decoder_handles_crlf_line_endings():
+    # the \r and \n of one line ending may arrive in different reads
+    assert decode([b"data: first\r", b"\n\r\ndata: second\r\n", b"\r\n"]) == [b"first", b"second"]
+
+
+def test_decoder_joins_multi_line_data_and_skips_comments():
+    assert decode([b": keep-alive\n\ndata: one\ndata: two\nid: 1\n\n"]) == [b"one\ntwo"]
+
+
+def test_decoder_flushes_an_event_without_its_blank_line():
+    assert decode([b"data: first\n\ndata: last"]) == [b"first", b"last"]
+
+
+def usage(prompt_tokens, completion_tokens):
+    usage = Usage(prompt_tokens)
+    usage.report(completion_tokens=completion_tokens)
+    return usage
+
+
+def expected(item):
+    return f"data: {json.dumps(item)}\n\n".encode("utf-8")
+
+
+@pytest.mark.parametrize("content", [
+    "Hello",
+    "",
+    'She said "100%" \\ done\n\ttab',
+    "%s %d %% %(name)s",
+    "héllo wörld, 你好, emoji \U0001f600, control \x00\x1f",
+])
+def test_encoder_output_equals_json_dumps(content):
+    chunk = adapter.chatgpt_chunk(1690000000.123, "gpt-3.5-turbo", content, usage(3, 5))
+
+    assert SSEEncoder().encode(chunk) == expected(chunk)
+
+
+def test_encoder_rebuilds_its_template_for_another_stream():
+    encoder = SSEEncoder()
+    first = adapter.chatgpt_chunk(1.0, "gpt-3.5-turbo", "a", usage(1, 1))
+    # a model name that would break a %-template if it was not escaped
+    second = adapter.chatgpt_chunk(2.0, 'gpt-4 "100%"', "b", usage(2, 2))
+
+    assert encoder.encode(first) == expected(first)
+    assert encoder.encode(second) == expected(second)
+    assert encoder.encode(first) == expected(first)
+
+
+def test_encoder_passes_other_items_through_json_dumps():
+    encoder = SSEEncoder()
+    finish = adapter.finish(1.0, "gpt-3.5-turbo", usage(1, 2))
+
+    assert encoder.encode(finish) == expected(finish)
+    assert encoder.encode("[DONE]") == expected("[DONE]")